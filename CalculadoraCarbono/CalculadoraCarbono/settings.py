@@ -139,6 +139,8 @@ REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
     ],
+    # Todas las listas se paginan por cursor; ver miapp/paginacion.py
+    'DEFAULT_PAGINATION_CLASS': 'miapp.paginacion.PaginacionCursor',
 }
 
 # JWT Configuration
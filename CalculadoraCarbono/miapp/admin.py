@@ -9,7 +9,7 @@ from .models import (
 # Personalizar el Admin de Usuario
 class UsuarioAdmin(UserAdmin):
     fieldsets = UserAdmin.fieldsets + (
-        ('Información Personal', {'fields': ('nombre_completo', 'region', 'pais')}),
+        ('Información Personal', {'fields': ('nombre_completo', 'region', 'pais', 'zona_horaria')}),
     )
     list_display = ('username', 'email', 'nombre_completo', 'region', 'pais', 'is_staff')
     search_fields = ('username', 'email', 'nombre_completo', 'region', 'pais')
@@ -37,7 +37,8 @@ class MaterialReciclableInline(admin.TabularInline):
 
 # Admin para RegistroHuellaCarbono
 class RegistroHuellaCarbonoAdmin(admin.ModelAdmin):
-    list_display = ('id', 'usuario', 'fecha', 'huella_total', 'huella_consumo', 'huella_transporte', 'huella_energia', 'huella_residuos')
+    list_display = ('id', 'usuario', 'fecha', 'huella_total', 'huella_consumo', 'huella_transporte', 'huella_energia', 'huella_residuos', 'version_factores')
+    readonly_fields = ('version_factores',)
     list_filter = ('fecha', 'usuario')
     search_fields = ('usuario__username', 'usuario__email')
     date_hierarchy = 'fecha'
@@ -59,8 +60,8 @@ class MaterialAdmin(admin.ModelAdmin):
 
 # Admin para FactorEmision
 class FactorEmisionAdmin(admin.ModelAdmin):
-    list_display = ('categoria', 'subcategoria', 'region', 'valor', 'unidad', 'fecha_actualizacion')
-    list_filter = ('categoria', 'region', 'fecha_actualizacion')
+    list_display = ('categoria', 'subcategoria', 'region', 'valor', 'unidad', 'distribucion', 'incertidumbre', 'fecha_actualizacion', 'vigente_desde', 'vigente_hasta')
+    list_filter = ('categoria', 'region', 'distribucion', 'fecha_actualizacion', 'vigente_desde')
     search_fields = ('categoria', 'subcategoria', 'region', 'descripcion')
     date_hierarchy = 'fecha_actualizacion'
 
@@ -0,0 +1,73 @@
+"""
+Utilidades para agregar series temporales en la base de datos: rangos de
+fechas y truncado por periodo (día, semana, mes o año).
+"""
+
+import datetime
+
+from django.db.models.functions import TruncDay, TruncWeek, TruncMonth, TruncYear
+from django.utils import timezone
+
+GRANULARIDADES = {
+    'dia': TruncDay,
+    'semana': TruncWeek,
+    'mes': TruncMonth,
+    'anio': TruncYear,
+}
+
+# Formato de la etiqueta de cada periodo; la semana se identifica por su lunes
+FORMATOS_PERIODO = {
+    'dia': '%Y-%m-%d',
+    'semana': '%Y-%m-%d',
+    'mes': '%Y-%m',
+    'anio': '%Y',
+}
+
+
+class ParametroInvalido(ValueError):
+    pass
+
+
+def parsear_granularidad(valor, por_defecto='mes'):
+    granularidad = valor or por_defecto
+    if granularidad not in GRANULARIDADES:
+        raise ParametroInvalido(f"granularidad debe ser una de: {', '.join(GRANULARIDADES)}")
+    return granularidad
+
+
+def parsear_rango(parametros):
+    # Fechas opcionales desde/hasta (AAAA-MM-DD), ambas incluidas
+    rango = []
+    for nombre in ('desde', 'hasta'):
+        valor = parametros.get(nombre)
+        try:
+            rango.append(datetime.date.fromisoformat(valor) if valor else None)
+        except ValueError:
+            raise ParametroInvalido(f"{nombre} debe tener el formato AAAA-MM-DD")
+    desde, hasta = rango
+    if desde and hasta and hasta < desde:
+        raise ParametroInvalido("hasta no puede ser anterior a desde")
+    return desde, hasta
+
+
+def filtrar_rango(queryset, desde, hasta, campo='fecha', tzinfo=None):
+    """
+    Limita el queryset a los días entre desde y hasta (incluidos) en la zona
+    horaria indicada o, si no, en la actual. Los límites se comparan como
+    instantes para que la consulta pueda usar el índice de la columna.
+    """
+    tzinfo = tzinfo or timezone.get_current_timezone()
+    if desde:
+        queryset = queryset.filter(**{f'{campo}__gte': datetime.datetime.combine(desde, datetime.time.min, tzinfo)})
+    if hasta:
+        siguiente = hasta + datetime.timedelta(days=1)
+        queryset = queryset.filter(**{f'{campo}__lt': datetime.datetime.combine(siguiente, datetime.time.min, tzinfo)})
+    return queryset
+
+
+def truncar(granularidad, campo='fecha', tzinfo=None):
+    return GRANULARIDADES[granularidad](campo, tzinfo=tzinfo)
+
+
+def etiqueta_periodo(periodo, granularidad):
+    return periodo.strftime(FORMATOS_PERIODO[granularidad])
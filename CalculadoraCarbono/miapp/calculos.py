@@ -0,0 +1,668 @@
+"""
+Motor de cálculo por lotes de la huella de carbono.
+
+Carga las tablas Detalle* como columnas de NumPy y evalúa las mismas fórmulas
+que los métodos calcular_emisiones_* de los modelos, pero sobre miles de
+registros a la vez. Los resultados se escriben por lotes con
+actualizar_en_bloque.
+"""
+
+from collections import Counter
+
+import numpy as np
+from django.db import connections, router, transaction
+from django.db.models import F, Q
+from django.db.models.functions import TruncDate
+
+from .factores import (
+    FACTORES_PREDETERMINADOS, CLAVES_CALEFACCION, SEMANAS_POR_MES, REGIONES_POR_DEFECTO,
+    obtener_factores, registro_factores, clave_de_factor
+)
+from .models import (
+    CambioFactorPendiente, RegistroHuellaCarbono, DetalleConsumo, DetalleTransporte,
+    DetalleEnergia, DetalleResiduos, MaterialReciclable, RegistroReciclaje, Usuario
+)
+from .panel import invalidar_paneles
+from .versiones import subir_versiones
+from .estadisticas import (
+    CAMPOS_SUMA, TAMANO_LOTE_ESTADISTICAS, aplicar_altas, aplicar_baja, aplicar_cambio, estado_guardado,
+    recalcular_estadisticas
+)
+from .percentiles import cambiar_promedios, promedios_usuarios
+from . import clasificaciones
+
+CAMPOS_CONSUMO = (
+    'consumo_carne_roja', 'consumo_aves', 'consumo_pescado', 'consumo_lacteos',
+    'consumo_frutas_verduras', 'porcentaje_alimentos_importados',
+    'compras_ropa_nuevas', 'compras_electronicos', 'compras_online',
+)
+CAMPOS_TRANSPORTE = (
+    'km_vehiculo_gasolina', 'km_vehiculo_diesel', 'km_vehiculo_hibrido',
+    'km_vehiculo_electrico', 'km_autobus', 'km_tren_metro',
+    'vuelos_cortos', 'vuelos_medianos', 'vuelos_largos',
+)
+CAMPOS_ENERGIA = (
+    'consumo_electricidad_kwh', 'porcentaje_energia_renovable',
+    'consumo_gas_natural_m3', 'consumo_agua_m3', 'tipo_calefaccion',
+    'consumo_calefaccion',
+)
+CAMPOS_RESIDUOS = ('kg_residuos_totales', 'kg_compostaje')
+
+# Modelo de detalle, campos y clave de categoría en el resultado
+DETALLES = (
+    ('consumo', DetalleConsumo, CAMPOS_CONSUMO),
+    ('transporte', DetalleTransporte, CAMPOS_TRANSPORTE),
+    ('energia', DetalleEnergia, CAMPOS_ENERGIA),
+    ('residuos', DetalleResiduos, CAMPOS_RESIDUOS),
+)
+
+CAMPOS_HUELLA = ('huella_consumo', 'huella_transporte', 'huella_energia', 'huella_residuos', 'huella_total')
+
+
+def _distinto_de_cero(campo):
+    return Q(**{f'{campo}__gt': 0}) | Q(**{f'{campo}__lt': 0})
+
+
+def _calefaccion(tipo):
+    return Q(detalle_energia__tipo_calefaccion=tipo) & _distinto_de_cero('detalle_energia__consumo_calefaccion')
+
+
+# Clave de factor -> condición sobre los Detalle* de un registro para que ese
+# factor influya en su huella. Las claves ausentes no intervienen en huella_*.
+DEPENDENCIAS_FACTORES = {
+    'carne_roja': _distinto_de_cero('detalle_consumo__consumo_carne_roja'),
+    'aves': _distinto_de_cero('detalle_consumo__consumo_aves'),
+    'pescado': _distinto_de_cero('detalle_consumo__consumo_pescado'),
+    'lacteos': _distinto_de_cero('detalle_consumo__consumo_lacteos'),
+    'frutas_verduras': _distinto_de_cero('detalle_consumo__consumo_frutas_verduras'),
+    'importacion': _distinto_de_cero('detalle_consumo__porcentaje_alimentos_importados'),
+    'ropa': _distinto_de_cero('detalle_consumo__compras_ropa_nuevas'),
+    'electronicos': _distinto_de_cero('detalle_consumo__compras_electronicos'),
+    'compras_online': _distinto_de_cero('detalle_consumo__compras_online'),
+    'gasolina': _distinto_de_cero('detalle_transporte__km_vehiculo_gasolina'),
+    'diesel': _distinto_de_cero('detalle_transporte__km_vehiculo_diesel'),
+    'hibrido': _distinto_de_cero('detalle_transporte__km_vehiculo_hibrido'),
+    'electrico': _distinto_de_cero('detalle_transporte__km_vehiculo_electrico'),
+    'autobus': _distinto_de_cero('detalle_transporte__km_autobus'),
+    'tren_metro': _distinto_de_cero('detalle_transporte__km_tren_metro'),
+    'vuelo_corto': _distinto_de_cero('detalle_transporte__vuelos_cortos'),
+    'vuelo_mediano': _distinto_de_cero('detalle_transporte__vuelos_medianos'),
+    'vuelo_largo': _distinto_de_cero('detalle_transporte__vuelos_largos'),
+    'electricidad': _distinto_de_cero('detalle_energia__consumo_electricidad_kwh'),
+    'agua': _distinto_de_cero('detalle_energia__consumo_agua_m3'),
+    'residuos': _distinto_de_cero('detalle_residuos__kg_residuos_totales'),
+    **{clave: _calefaccion(tipo) for tipo, clave in CLAVES_CALEFACCION.items()},
+}
+
+TAMANO_LOTE = 2000
+
+
+# Fórmulas vectorizadas. Cada columna es un arreglo de longitud n y cada
+# factor puede ser un escalar o un arreglo de longitud n.
+
+def emisiones_consumo(c, f):
+    emisiones_base = (
+        c['consumo_carne_roja'] * f['carne_roja'] +
+        c['consumo_aves'] * f['aves'] +
+        c['consumo_pescado'] * f['pescado'] +
+        c['consumo_lacteos'] * f['lacteos'] +
+        c['consumo_frutas_verduras'] * f['frutas_verduras']
+    )
+    factor_ajuste = 1 + (c['porcentaje_alimentos_importados'] / 100) * (f['importacion'] - 1)
+    alimentacion = emisiones_base * factor_ajuste * SEMANAS_POR_MES
+
+    compras = (
+        c['compras_ropa_nuevas'] * f['ropa'] +
+        c['compras_electronicos'] * f['electronicos'] / 12 +
+        c['compras_online'] * f['compras_online']
+    )
+    return alimentacion + compras
+
+
+def emisiones_transporte(t, f):
+    vehiculo_privado = (
+        t['km_vehiculo_gasolina'] * f['gasolina'] +
+        t['km_vehiculo_diesel'] * f['diesel'] +
+        t['km_vehiculo_hibrido'] * f['hibrido'] +
+        t['km_vehiculo_electrico'] * f['electrico']
+    )
+    transporte_publico = (
+        t['km_autobus'] * f['autobus'] +
+        t['km_tren_metro'] * f['tren_metro']
+    )
+    vuelos = (
+        t['vuelos_cortos'] * f['vuelo_corto'] +
+        t['vuelos_medianos'] * f['vuelo_mediano'] +
+        t['vuelos_largos'] * f['vuelo_largo']
+    ) / 12
+    return vehiculo_privado + transporte_publico + vuelos
+
+
+def factores_calefaccion(tipos, f):
+    # Traduce cada tipo de calefacción a su factor; los tipos sin clave valen 0
+    n = len(tipos)
+    tabla = np.zeros((len(CLAVES_CALEFACCION) + 1, n))
+    indice = {}
+    for posicion, (tipo, clave) in enumerate(CLAVES_CALEFACCION.items(), start=1):
+        tabla[posicion] = f[clave]
+        indice[tipo] = posicion
+
+    valores, inverso = np.unique(tipos, return_inverse=True)
+    posiciones = np.array([indice.get(valor, 0) for valor in valores], dtype=np.intp)[inverso]
+    return tabla[posiciones, np.arange(n)]
+
+
+def emisiones_energia(e, f):
+    electricidad = e['consumo_electricidad_kwh'] * (f['electricidad'] * (1 - e['porcentaje_energia_renovable'] / 100))
+    calefaccion = e['consumo_calefaccion'] * factores_calefaccion(e['tipo_calefaccion'], f)
+    agua = e['consumo_agua_m3'] * f['agua']
+    return electricidad + calefaccion + agua
+
+
+def emisiones_residuos(r, f):
+    residuos_netos = np.maximum(0, r['kg_residuos_totales'] - r['kg_compostaje'])
+    return residuos_netos * f['residuos']
+
+
+def calcular_huellas(columnas, reduccion_por_reciclaje, factores=None):
+    """
+    Evalúa todas las categorías de huella para un lote.
+
+    ``columnas`` asocia 'consumo', 'transporte', 'energia' y 'residuos' con el
+    diccionario de columnas de su detalle. Devuelve un diccionario con un
+    arreglo por cada campo de CAMPOS_HUELLA.
+    """
+    if factores is None:
+        factores = obtener_factores()
+
+    huellas = {
+        'huella_consumo': emisiones_consumo(columnas['consumo'], factores),
+        'huella_transporte': emisiones_transporte(columnas['transporte'], factores),
+        'huella_energia': emisiones_energia(columnas['energia'], factores),
+        'huella_residuos': emisiones_residuos(columnas['residuos'], factores),
+    }
+    huellas['huella_total'] = (
+        huellas['huella_consumo'] +
+        huellas['huella_transporte'] +
+        huellas['huella_energia'] +
+        huellas['huella_residuos'] -
+        reduccion_por_reciclaje
+    )
+    return huellas
+
+
+def cargar_columnas(modelo, campos, registro_ids):
+    """
+    Lee los campos de un modelo Detalle* para los registros indicados.
+
+    ``registro_ids`` debe estar ordenado. Las columnas quedan alineadas con él y
+    los registros sin detalle conservan los valores por defecto (0 o '').
+    """
+    n = len(registro_ids)
+    columnas = {}
+    for campo in campos:
+        if modelo._meta.get_field(campo).get_internal_type() == 'CharField':
+            columnas[campo] = np.full(n, '', dtype=object)
+        else:
+            columnas[campo] = np.zeros(n)
+
+    filas = list(
+        modelo.objects.filter(registro_huella_id__in=registro_ids.tolist())
+        .values_list('registro_huella_id', *campos)
+    )
+    if not filas:
+        return columnas
+
+    ids_detalle, *valores = zip(*filas)
+    posiciones = np.searchsorted(registro_ids, ids_detalle)
+    for campo, valores_campo in zip(campos, valores):
+        columnas[campo][posiciones] = valores_campo
+    return columnas
+
+
+def factores_por_registro(regiones, paises, dias):
+    """
+    Resuelve los factores de cada registro según la región y el país de su
+    usuario y el día (ordinal) del registro.
+
+    Si todo el lote comparte los mismos factores devuelve su diccionario tal
+    cual; si no, un arreglo por clave con el factor de cada registro. Dentro de
+    cada par (región, país) el tramo vigente se busca con searchsorted sobre la
+    línea temporal del registro de factores.
+    """
+    dias = np.asarray(dias)
+    grupos = {}
+    for posicion, par in enumerate(zip(regiones, paises)):
+        grupos.setdefault(par, []).append(posicion)
+    lineas = {par: registro_factores.linea_factores(*par) for par in grupos}
+
+    if len(lineas) == 1:
+        linea = next(iter(lineas.values()))
+        if len(linea.valores) == 1:
+            return linea.valores[0]
+
+    factores = {clave: np.empty(len(dias)) for clave in FACTORES_PREDETERMINADOS}
+    for par, posiciones in grupos.items():
+        linea = lineas[par]
+        posiciones = np.array(posiciones, dtype=np.intp)
+        tramos = np.searchsorted(linea.inicios, dias[posiciones], side='right') - 1
+        for clave, valores in factores.items():
+            valores[posiciones] = np.array([tramo[clave] for tramo in linea.valores])[tramos]
+    return factores
+
+
+def calcular_lote(registro_ids, reduccion_por_reciclaje, regiones, paises, dias):
+    columnas = {
+        categoria: cargar_columnas(modelo, campos, registro_ids)
+        for categoria, modelo, campos in DETALLES
+    }
+    return calcular_huellas(columnas, reduccion_por_reciclaje, factores_por_registro(regiones, paises, dias))
+
+
+def _admite_update_from(connection):
+    if connection.vendor == 'postgresql':
+        return True
+    if connection.vendor == 'sqlite':
+        import sqlite3
+        return sqlite3.sqlite_version_info >= (3, 33)
+    return False
+
+
+def actualizar_en_bloque(modelo, objetos, campos):
+    """
+    Equivalente a modelo.objects.bulk_update(objetos, campos) que escribe cada
+    lote con una sola sentencia UPDATE ... FROM (VALUES ...).
+
+    bulk_update arma una expresión CASE WHEN por campo y objeto, y con lotes
+    de miles de filas ese armado en Python domina el tiempo de escritura. Se
+    usa con PostgreSQL y SQLite 3.33+; con otras bases recurre a bulk_update.
+    """
+    if not objetos:
+        return
+    connection = connections[router.db_for_write(modelo)]
+    if not _admite_update_from(connection):
+        modelo.objects.bulk_update(objetos, campos, batch_size=500)
+        return
+
+    qn = connection.ops.quote_name
+    pk = modelo._meta.pk
+    campos = [modelo._meta.get_field(campo) for campo in campos]
+    columnas = [pk] + campos
+    tabla = qn(modelo._meta.db_table)
+
+    fila = '(' + ', '.join(f'CAST(%s AS {campo.cast_db_type(connection)})' for campo in columnas) + ')'
+    asignaciones = ', '.join(f'{qn(campo.column)} = v.{qn(campo.column)}' for campo in campos)
+    cabecera = f"WITH v({', '.join(qn(campo.column) for campo in columnas)}) AS (VALUES "
+    condicion = f') UPDATE {tabla} SET {asignaciones} FROM v WHERE {tabla}.{qn(pk.column)} = v.{qn(pk.column)}'
+
+    tamano = max(1, connection.ops.bulk_batch_size(columnas, objetos))
+    with connection.cursor() as cursor:
+        for inicio in range(0, len(objetos), tamano):
+            lote = objetos[inicio:inicio + tamano]
+            parametros = [
+                campo.get_db_prep_save(getattr(objeto, campo.attname), connection)
+                for objeto in lote for campo in columnas
+            ]
+            cursor.execute(cabecera + ', '.join([fila] * len(lote)) + condicion, parametros)
+
+
+def _admite_upsert(connection):
+    if connection.vendor == 'postgresql':
+        return True
+    if connection.vendor == 'sqlite':
+        import sqlite3
+        return sqlite3.sqlite_version_info >= (3, 24)
+    return False
+
+
+def sumar_en_bloque(modelo, objetos, unicos, campos):
+    """
+    Inserta los objetos y, donde ya existe una fila con los mismos ``unicos``,
+    le suma en su lugar los valores de ``campos``: una sola sentencia INSERT
+    ... ON CONFLICT DO UPDATE por lote.
+
+    Se usa con PostgreSQL y SQLite 3.24+; con otras bases no escribe nada y
+    devuelve False, para que quien llama inserte e incremente por separado.
+    """
+    connection = connections[router.db_for_write(modelo)]
+    if not _admite_upsert(connection):
+        return False
+    if not objetos:
+        return True
+
+    qn = connection.ops.quote_name
+    opciones = modelo._meta
+    columnas = [campo for campo in opciones.concrete_fields if campo is not opciones.auto_field]
+    tabla = qn(opciones.db_table)
+
+    fila = '(' + ', '.join(['%s'] * len(columnas)) + ')'
+    cabecera = f"INSERT INTO {tabla} ({', '.join(qn(campo.column) for campo in columnas)}) VALUES "
+    asignaciones = ', '.join(
+        f'{qn(columna)} = {tabla}.{qn(columna)} + EXCLUDED.{qn(columna)}'
+        for columna in (opciones.get_field(campo).column for campo in campos)
+    )
+    conflicto = (
+        f" ON CONFLICT ({', '.join(qn(opciones.get_field(campo).column) for campo in unicos)})"
+        f" DO UPDATE SET {asignaciones}"
+    )
+
+    tamano = max(1, connection.ops.bulk_batch_size(columnas, objetos))
+    with transaction.atomic(using=connection.alias, savepoint=False), connection.cursor() as cursor:
+        for inicio in range(0, len(objetos), tamano):
+            lote = objetos[inicio:inicio + tamano]
+            parametros = [
+                campo.get_db_prep_save(campo.pre_save(objeto, True), connection)
+                for objeto in lote for campo in columnas
+            ]
+            cursor.execute(cabecera + ', '.join([fila] * len(lote)) + conflicto, parametros)
+    return True
+
+
+def guardar_huellas(registro_ids, huellas, version):
+    valores = {campo: huellas[campo].tolist() for campo in CAMPOS_HUELLA}
+    registros = [
+        RegistroHuellaCarbono(
+            id=registro_id, version_factores=version,
+            **{campo: valores[campo][i] for campo in CAMPOS_HUELLA}
+        )
+        for i, registro_id in enumerate(registro_ids.tolist())
+    ]
+    actualizar_en_bloque(RegistroHuellaCarbono, registros, CAMPOS_HUELLA + ('version_factores',))
+
+
+def datos_cambiados(usuario_ids):
+    # Al confirmar se descarta el panel en caché de los usuarios y sube su versión de datos
+    invalidar_paneles(usuario_ids)
+    subir_versiones(usuario_ids)
+
+
+def _resumible(estado):
+    # (usuario_id, fecha, huella_total) para los resúmenes mensuales
+    if estado is None:
+        return None
+    usuario_id, fecha, valores = estado
+    return usuario_id, fecha, valores['huella_total']
+
+
+def _actualizar_estadisticas(cambios):
+    """
+    Aplica a EstadisticasUsuario los cambios (registro_id, anterior, actual)
+    de registros de huella: incrementos si es un solo registro o solo altas de
+    un usuario y, si no, una reconstrucción de los usuarios afectados.
+    """
+    if len(cambios) == 1:
+        registro_id, anterior, actual = cambios[0]
+        if anterior is None:
+            aplicar_altas(actual[0], [(registro_id, *actual[1:])])
+        elif actual is None:
+            aplicar_baja(registro_id, anterior)
+        else:
+            aplicar_cambio(registro_id, anterior, actual)
+        return
+    usuarios = {estado[0] for _, anterior, actual in cambios for estado in (anterior, actual) if estado is not None}
+    if len(usuarios) == 1 and all(anterior is None for _, anterior, _ in cambios):
+        aplicar_altas(usuarios.pop(), [(registro_id, *actual[1:]) for registro_id, _, actual in cambios])
+        return
+    recalcular_estadisticas(usuarios)
+
+
+def _actualizar_promedios(usuario_ids, actualizar, *args):
+    """
+    Ejecuta ``actualizar(*args)``, que modifica EstadisticasUsuario de los
+    usuarios indicados, con sus filas bloqueadas, y mueve en los histogramas
+    la contribución de cada usuario de su media anterior a la nueva. Devuelve
+    las ubicaciones leídas ({usuario_id: (pais, region)}).
+    """
+    anteriores = promedios_usuarios(usuario_ids, bloquear=True)
+    actualizar(*args)
+    cambiar_promedios(anteriores, promedios_usuarios(usuario_ids))
+    return {usuario_id: ubicacion for usuario_id, (ubicacion, _) in anteriores.items()}
+
+
+def aplicar_efectos_registros(antes, despues, ubicaciones=None, estadisticas=True):
+    """
+    Mantiene todo lo que depende de los registros de huella tras escribirlos:
+    EstadisticasUsuario, los histogramas de percentiles, los resúmenes
+    mensuales de las clasificaciones, el panel en caché y la versión de datos
+    de cada usuario.
+
+    ``antes`` y ``despues`` asocian registro_id con su estado
+    (estadisticas.estado_registro) antes y después de la escritura; un
+    registro nuevo falta en ``antes`` y uno eliminado, en ``despues``. Con
+    ``estadisticas=False`` quien llama reconstruye EstadisticasUsuario y los
+    histogramas, que dependen de ellas, al terminar (recalcular_huellas);
+    ``ubicaciones`` ({usuario_id: (pais, region)}) evita entonces consultarlas.
+
+    Lo usan las señales de RegistroHuellaCarbono y las escrituras en bloque,
+    que no las envían.
+    """
+    ubicaciones = dict(ubicaciones or {})
+    cambios = [
+        (registro_id, antes.get(registro_id), despues.get(registro_id))
+        for registro_id in sorted(antes.keys() | despues.keys())
+        if antes.get(registro_id) != despues.get(registro_id)
+    ]
+    usuarios = sorted({estado[0] for estados in (antes, despues) for estado in estados.values()})
+
+    with transaction.atomic(savepoint=False):
+        if cambios:
+            if estadisticas:
+                ubicaciones.update(_actualizar_promedios(usuarios, _actualizar_estadisticas, cambios))
+            faltantes = [usuario_id for usuario_id in usuarios if usuario_id not in ubicaciones]
+            if faltantes:
+                ubicaciones.update(
+                    (usuario_id, (pais, region))
+                    for usuario_id, pais, region in Usuario.objects.filter(id__in=faltantes).values_list('id', 'pais', 'region')
+                )
+            resumenes = Counter()
+            for _, anterior, actual in cambios:
+                clasificaciones.incrementos_registro(_resumible(anterior), _resumible(actual), resumenes)
+            clasificaciones.aplicar_incrementos(resumenes, ubicaciones)
+        datos_cambiados(usuarios)
+
+
+def agregar_materiales_reciclaje(registro, materiales):
+    """
+    Añade materiales (diccionarios con material, cantidad y unidad) a un
+    RegistroReciclaje y actualiza los totales con incrementos F() en la misma
+    transacción, sin volver a sumar los materiales existentes. Los totales del
+    registro y de su registro de huella siguen siendo correctos con altas
+    concurrentes.
+
+    Como bulk_create y update() no envían señales, el cambio del registro de
+    huella pasa por aplicar_efectos_registros y los kg reciclados se suman al
+    resumen mensual del usuario.
+    """
+    nuevos = [MaterialReciclable(registro_reciclaje=registro, **datos) for datos in materiales]
+    for material in nuevos:
+        material.calcular_valor_material()
+        material.calcular_reduccion_co2_material()
+
+    kg = sum(material.cantidad for material in nuevos)
+    valor = sum(material.valor_economico for material in nuevos)
+    reduccion = sum(material.reduccion_co2 for material in nuevos)
+
+    with transaction.atomic():
+        MaterialReciclable.objects.bulk_create(nuevos)
+        RegistroReciclaje.objects.filter(pk=registro.pk).update(
+            kg_total_reciclado=F('kg_total_reciclado') + kg,
+            valor_economico_total=F('valor_economico_total') + valor,
+            reduccion_co2_total=F('reduccion_co2_total') + reduccion
+        )
+        # huella_total = suma de categorías - reduccion_por_reciclaje
+        if registro.registro_huella_id:
+            RegistroHuellaCarbono.objects.filter(pk=registro.registro_huella_id).update(
+                reduccion_por_reciclaje=F('reduccion_por_reciclaje') + reduccion,
+                huella_total=F('huella_total') - reduccion
+            )
+            usuario_id, fecha, valores = actual = estado_guardado(registro.registro_huella_id)
+            anterior = (usuario_id, fecha, dict(
+                valores,
+                huella_total=valores['huella_total'] + reduccion,
+                reduccion_por_reciclaje=valores['reduccion_por_reciclaje'] - reduccion
+            ))
+            aplicar_efectos_registros({registro.registro_huella_id: anterior}, {registro.registro_huella_id: actual})
+        clasificaciones.aplicar_incrementos(
+            clasificaciones.incrementos_reciclaje(None, (registro.usuario_id, registro.fecha, kg))
+        )
+        datos_cambiados([registro.usuario_id])
+
+    registro.refresh_from_db(fields=['kg_total_reciclado', 'valor_economico_total', 'reduccion_co2_total'])
+    return nuevos
+
+
+def recalcular_huellas(queryset=None, tamano_lote=TAMANO_LOTE, al_avanzar=None, actualizar_agregados=True):
+    """
+    Recalcula huella_* de todos los registros del queryset por lotes.
+
+    Recorre los registros por id (paginación por clave), calcula cada lote en
+    una sola pasada vectorizada y lo guarda en una transacción. Si se indica,
+    ``al_avanzar`` recibe el número de registros procesados tras cada lote.
+    Los resúmenes mensuales se ajustan en cada lote con
+    aplicar_efectos_registros y, al terminar, se reconstruye
+    EstadisticasUsuario de los usuarios afectados y se mueve su media en los
+    histogramas de percentiles. Con
+    ``actualizar_agregados=False`` no se tocan ni histogramas ni resúmenes,
+    que son filas compartidas entre usuarios: quien llama debe reconstruirlos
+    después (recalcular_huellas_paralelo).
+    Devuelve el total de registros recalculados.
+    """
+    if queryset is None:
+        queryset = RegistroHuellaCarbono.objects.all()
+    queryset = queryset.annotate(dia=TruncDate('fecha')).order_by('id')
+
+    procesados = 0
+    ultimo_id = 0
+    afectados = set()
+    while True:
+        filas = list(
+            queryset.filter(id__gt=ultimo_id)
+            .values_list('id', 'usuario__region', 'usuario__pais', 'dia', 'usuario_id', 'fecha', *CAMPOS_SUMA)
+            [:tamano_lote]
+        )
+        if not filas:
+            break
+
+        ids, regiones, paises, dias, usuarios, fechas, *anteriores = zip(*filas)
+        registro_ids = np.array(ids, dtype=np.int64)
+        reduccion = anteriores[CAMPOS_SUMA.index('reduccion_por_reciclaje')]
+        version = registro_factores.version()
+        huellas = calcular_lote(
+            registro_ids, np.array(reduccion, dtype=float), regiones, paises,
+            np.array([dia.toordinal() for dia in dias], dtype=np.int64)
+        )
+
+        with transaction.atomic():
+            guardar_huellas(registro_ids, huellas, version)
+            # La escritura en bloque no envía señales
+            if actualizar_agregados:
+                nuevos = {campo: huellas[campo].tolist() for campo in CAMPOS_HUELLA}
+                antes, despues = {}, {}
+                for i, registro_id in enumerate(ids):
+                    valores = {campo: columna[i] for campo, columna in zip(CAMPOS_SUMA, anteriores)}
+                    antes[registro_id] = (usuarios[i], fechas[i], valores)
+                    despues[registro_id] = (usuarios[i], fechas[i], dict(valores, **{campo: nuevos[campo][i] for campo in nuevos}))
+                aplicar_efectos_registros(
+                    antes, despues, dict(zip(usuarios, zip(paises, regiones))), estadisticas=False
+                )
+            else:
+                datos_cambiados(usuarios)
+        afectados.update(usuarios)
+
+        procesados += len(registro_ids)
+        ultimo_id = ids[-1]
+        if al_avanzar:
+            al_avanzar(procesados)
+
+    # Una reconstrucción por usuario afectado al final, no una por lote
+    afectados = sorted(afectados)
+    for inicio in range(0, len(afectados), TAMANO_LOTE_ESTADISTICAS):
+        lote = afectados[inicio:inicio + TAMANO_LOTE_ESTADISTICAS]
+        with transaction.atomic():
+            if actualizar_agregados:
+                _actualizar_promedios(lote, recalcular_estadisticas, lote)
+            else:
+                recalcular_estadisticas(lote)
+    return procesados
+
+
+def filtro_registros_afectados(categoria, subcategoria, region, vigente_desde=None, vigente_hasta=None):
+    """
+    Condición sobre RegistroHuellaCarbono que selecciona los registros cuya
+    huella depende de la fila de FactorEmision (categoria, subcategoria, region)
+    vigente entre vigente_desde y vigente_hasta.
+
+    Devuelve None si ningún registro depende de ella. Se evalúa con los
+    factores ya vigentes, es decir, después de aplicar el cambio.
+    """
+    clave = clave_de_factor(categoria, subcategoria)
+    dependencia = DEPENDENCIAS_FACTORES.get(clave)
+    if dependencia is None:
+        return None
+
+    # La región del usuario tiene prioridad sobre su país y éste sobre el valor por defecto
+    regiones_propias = registro_factores.regiones_con_factor(clave)
+    if region in REGIONES_POR_DEFECTO:
+        usuarios = ~Q(usuario__region__in=regiones_propias) & ~Q(usuario__pais__in=regiones_propias)
+    else:
+        usuarios = Q(usuario__region=region) | (Q(usuario__pais=region) & ~Q(usuario__region__in=regiones_propias))
+
+    # Solo los registros con fecha dentro de la vigencia de la fila
+    vigencia = Q()
+    if vigente_desde:
+        vigencia &= Q(fecha__date__gte=vigente_desde)
+    if vigente_hasta:
+        vigencia &= Q(fecha__date__lt=vigente_hasta)
+
+    return usuarios & dependencia & vigencia
+
+
+def recalcular_por_cambio_de_factores(cambios, tamano_lote=TAMANO_LOTE, al_avanzar=None, usuario_ids=()):
+    """
+    Recalcula solo los registros afectados por un conjunto de filas de
+    FactorEmision modificadas, dadas como tuplas (categoria, subcategoria,
+    region, vigente_desde, vigente_hasta), y todos los registros de los
+    usuarios de ``usuario_ids``, que cambiaron de ubicación.
+
+    De los afectados por los factores solo entran los registros calculados
+    con una versión de factores anterior a la vigente: si el recálculo se
+    interrumpe, repetirlo continúa con los que faltan.
+    """
+    filtros = [filtro for filtro in (filtro_registros_afectados(*cambio) for cambio in cambios) if filtro is not None]
+    condicion = None
+    if filtros:
+        condicion = filtros[0]
+        for filtro in filtros[1:]:
+            condicion |= filtro
+        condicion &= Q(version_factores__lt=registro_factores.version())
+    if usuario_ids:
+        # Sus registros ya tienen la versión vigente, pero no la ubicación
+        usuarios = Q(usuario_id__in=sorted(usuario_ids))
+        condicion = usuarios if condicion is None else condicion | usuarios
+    if condicion is None:
+        return 0
+
+    queryset = RegistroHuellaCarbono.objects.filter(condicion)
+    return recalcular_huellas(queryset, tamano_lote=tamano_lote, al_avanzar=al_avanzar)
+
+
+def propagar_cambios_factores(tamano_lote=TAMANO_LOTE, al_avanzar=None):
+    """
+    Recalcula los registros afectados por los cambios de FactorEmision y de
+    ubicación de usuarios pendientes (CambioFactorPendiente) y los da por
+    propagados.
+
+    Los cambios que lleguen mientras tanto tienen un id mayor y quedan para la
+    siguiente ejecución. Devuelve (cambios propagados, registros recalculados).
+    """
+    cambios = list(CambioFactorPendiente.objects.order_by('id'))
+    if not cambios:
+        return 0, 0
+
+    procesados = recalcular_por_cambio_de_factores(
+        {cambio.clave() for cambio in cambios if cambio.usuario_id is None},
+        tamano_lote=tamano_lote, al_avanzar=al_avanzar,
+        usuario_ids={cambio.usuario_id for cambio in cambios if cambio.usuario_id is not None}
+    )
+    CambioFactorPendiente.objects.filter(id__lte=cambios[-1].id).delete()
+    return len(cambios), procesados
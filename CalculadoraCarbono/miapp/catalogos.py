@@ -0,0 +1,190 @@
+"""
+Instantáneas de los catálogos de referencia (materiales, factores de emisión y
+recomendaciones) servidas desde la memoria del proceso.
+
+Cada catálogo se serializa una vez por versión, como JSON y como JSON
+comprimido con gzip, y se sirve con su ETag sin consultar la base de datos. La
+versión de los factores es la de VersionFactores; la de materiales y
+recomendaciones, la de VersionCatalogo, que las señales suben con cada cambio.
+Como en factores.py, cada proceso lee la versión vigente de la base de datos
+como mucho una vez por INTERVALO_VERIFICACION; tras un cambio, la instantánea
+se reconstruye en la siguiente lectura.
+"""
+
+import gzip
+import threading
+import time
+
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.http import Http404, HttpResponse
+from django.utils.cache import patch_vary_headers, quote_etag
+from rest_framework import status
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+
+from django.utils import timezone
+
+from .factores import INTERVALO_VERIFICACION
+from .models import FactorEmision, Material, Recomendacion, VersionCatalogo, VersionFactores
+from .versiones import coincide_etag
+
+# Catálogo -> (modelo, nombre del serializer en serializers.py)
+CATALOGOS = {
+    'materiales': (Material, 'MaterialSerializer'),
+    'factores': (FactorEmision, 'FactorEmisionSerializer'),
+    'recomendaciones': (Recomendacion, 'RecomendacionSerializer'),
+}
+
+NIVEL_COMPRESION = 6
+
+# Cache-Control, en segundos: sin versión en la URL el cliente revalida pronto
+# con la ETag; con ?version= igual a la vigente la respuesta no cambia nunca
+MAX_EDAD_CATALOGO = 5 * 60
+MAX_EDAD_VERSIONADA = 365 * 24 * 60 * 60
+
+
+def estado_catalogo(nombre):
+    # (versión, fecha del último cambio); (0, None) si el catálogo no ha cambiado nunca
+    if nombre == 'factores':
+        fila = VersionFactores.objects.order_by('-id').values_list('id', 'fecha').first()
+    else:
+        fila = VersionCatalogo.objects.filter(catalogo=nombre).values_list('version', 'modificado').first()
+    return fila or (0, None)
+
+
+def version_catalogo(nombre):
+    return estado_catalogo(nombre)[0]
+
+
+def subir_version_catalogo(nombre):
+    """
+    Sube la versión del catálogo dentro de la transacción en curso. Los demás
+    procesos la ven al confirmar, en su siguiente comprobación; la instantánea
+    de este proceso se descarta al confirmar.
+    """
+    filas = VersionCatalogo.objects.filter(catalogo=nombre)
+    if not filas.update(version=F('version') + 1, modificado=timezone.now()):
+        try:
+            with transaction.atomic():
+                VersionCatalogo.objects.create(catalogo=nombre, version=1)
+        except IntegrityError:
+            filas.update(version=F('version') + 1, modificado=timezone.now())
+
+    transaction.on_commit(lambda: registro_catalogos.invalidar(nombre))
+
+
+class Instantanea:
+    # Datos ya serializados de un catálogo (o del paquete de todos) en una versión
+    def __init__(self, nombre, version, datos, modificado=None):
+        self.nombre = nombre
+        self.version = version
+        self.modificado = modificado
+        self.datos = datos
+        self.json = JSONRenderer().render(datos)
+        self.comprimido = gzip.compress(self.json, NIVEL_COMPRESION)
+        self.etag = quote_etag(f'{nombre}-{version}')
+        self.por_id = {fila['id']: fila for fila in datos} if isinstance(datos, list) else {}
+
+
+class RegistroCatalogos:
+    """
+    Instantáneas de los catálogos en este proceso. Cada una se sustituye de
+    una sola vez cuando cambia la versión de su catálogo; el paquete con todos
+    se rehace cuando cambia cualquiera de ellas.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._instantaneas = {}
+        self._verificado_en = {}
+        self._paquete = None
+
+    def invalidar(self, nombre=None):
+        for catalogo in [nombre] if nombre else list(CATALOGOS):
+            self._verificado_en.pop(catalogo, None)
+
+    def instantanea(self, nombre):
+        instantanea = self._instantaneas.get(nombre)
+        ahora = time.monotonic()
+        verificado_en = self._verificado_en.get(nombre)
+        if instantanea is not None and verificado_en is not None and ahora - verificado_en < INTERVALO_VERIFICACION:
+            return instantanea
+
+        version, modificado = estado_catalogo(nombre)
+        if instantanea is None or instantanea.version != version:
+            with self._lock:
+                instantanea = self._instantaneas.get(nombre)
+                if instantanea is None or instantanea.version != version:
+                    instantanea = self._cargar(nombre, version, modificado)
+        self._verificado_en[nombre] = ahora
+        return instantanea
+
+    def paquete(self):
+        instantaneas = {nombre: self.instantanea(nombre) for nombre in CATALOGOS}
+        version = '-'.join(str(instantanea.version) for instantanea in instantaneas.values())
+        paquete = self._paquete
+        if paquete is None or paquete.version != version:
+            datos = {'versiones': {nombre: instantanea.version for nombre, instantanea in instantaneas.items()}}
+            datos.update((nombre, instantanea.datos) for nombre, instantanea in instantaneas.items())
+            paquete = self._paquete = Instantanea('catalogos', version, datos)
+        return paquete
+
+    def _cargar(self, nombre, version, modificado):
+        from . import serializers
+
+        modelo, serializer = CATALOGOS[nombre]
+        datos = getattr(serializers, serializer)(modelo.objects.order_by('id'), many=True).data
+        instantanea = self._instantaneas[nombre] = Instantanea(nombre, version, list(datos), modificado)
+        return instantanea
+
+
+registro_catalogos = RegistroCatalogos()
+
+
+def respuesta_catalogo(request, instantanea):
+    """
+    Sirve una instantánea tal cual: 304 si el cliente ya tiene su ETag y, si
+    acepta gzip, el cuerpo comprimido de antemano.
+    """
+    versionada = request.query_params.get('version') == str(instantanea.version)
+    cache_control = (
+        f'private, max-age={MAX_EDAD_VERSIONADA}, immutable' if versionada
+        else f'private, max-age={MAX_EDAD_CATALOGO}'
+    )
+
+    if coincide_etag(request, instantanea.etag):
+        respuesta = HttpResponse(status=status.HTTP_304_NOT_MODIFIED)
+    elif 'gzip' in request.headers.get('Accept-Encoding', ''):
+        respuesta = HttpResponse(instantanea.comprimido, content_type='application/json')
+        respuesta['Content-Encoding'] = 'gzip'
+    else:
+        respuesta = HttpResponse(instantanea.json, content_type='application/json')
+    respuesta['ETag'] = instantanea.etag
+    respuesta['Cache-Control'] = cache_control
+    patch_vary_headers(respuesta, ('Accept-Encoding',))
+    return respuesta
+
+
+class CatalogoMixin:
+    """
+    Para los ViewSets de solo lectura de un catálogo: el listado sin búsqueda
+    y el detalle se sirven desde la instantánea; con ?search= se consulta la
+    base de datos como siempre.
+    """
+    catalogo = None
+    pagination_class = None
+
+    def list(self, request, *args, **kwargs):
+        if request.query_params.get('search'):
+            return super().list(request, *args, **kwargs)
+        return respuesta_catalogo(request, registro_catalogos.instantanea(self.catalogo))
+
+    def retrieve(self, request, *args, **kwargs):
+        try:
+            fila = registro_catalogos.instantanea(self.catalogo).por_id.get(int(kwargs[self.lookup_field]))
+        except ValueError:
+            fila = None
+        if fila is None:
+            raise Http404
+        return Response(fila)
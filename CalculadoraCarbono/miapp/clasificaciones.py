@@ -0,0 +1,381 @@
+"""
+Clasificaciones mensuales por país y por región: menor huella, mayor mejora
+respecto al mes anterior y más kg reciclados.
+
+Los totales por usuario y mes (ResumenMensualUsuario) se mantienen con
+incrementos en cada escritura, igual que las estadísticas y los histogramas.
+Cada escritura marca como pendientes las particiones (mes, país, región)
+afectadas; las posiciones de una partición pendiente se recalculan de una vez
+con el comando refrescar_clasificaciones, nunca en una lectura. Las lecturas
+del top N y de la posición propia usan índices sobre las posiciones guardadas,
+no cuentan filas y no escriben.
+"""
+
+import datetime
+from collections import Counter
+
+import numpy as np
+from django.db import transaction
+from django.db.models import Case, F, OuterRef, Q, Subquery, Sum, Count, Value, When
+from django.db.models.functions import TruncMonth
+from django.utils import timezone
+
+from .agregaciones import ParametroInvalido
+from .models import ResumenMensualUsuario, ParticionClasificacion, RegistroHuellaCarbono, RegistroReciclaje, Usuario
+
+# Métrica -> (campo del resumen, True si gana el valor más bajo)
+METRICAS = {
+    'huella': ('huella_promedio', True),
+    'mejora': ('mejora', False),
+    'reciclaje': ('kg_reciclados', False),
+}
+AMBITOS = ('pais', 'region')
+
+LIMITE_POR_DEFECTO = 10
+MAX_LIMITE = 100
+
+MAX_INCREMENTOS_POR_SENTENCIA = 200
+# Campos de ResumenMensualUsuario que reciben incrementos, con su tipo
+CAMPOS_INCREMENTO = (('numero_registros', int), ('suma_huella_total', float), ('kg_reciclados', float))
+TAMANO_LOTE_RESUMENES = 5000
+
+
+def mes_de(fecha):
+    # Primer día del mes de un instante, en la zona horaria actual (como TruncMonth)
+    return timezone.localtime(fecha).date().replace(day=1)
+
+
+def mes_siguiente(mes):
+    return (mes + datetime.timedelta(days=32)).replace(day=1)
+
+
+def mes_anterior(mes):
+    return (mes - datetime.timedelta(days=1)).replace(day=1)
+
+
+def particiones(mes, pais, region):
+    # Particiones a las que pertenece un usuario en un mes
+    resultado = []
+    if pais:
+        resultado.append((mes, pais, ''))
+    if region:
+        resultado.append((mes, pais or '', region))
+    return resultado
+
+
+def marcar_pendientes(claves):
+    """
+    Marca como pendientes las particiones (mes, pais, region) indicadas y las
+    del mes siguiente, cuya mejora depende de este mes.
+    """
+    claves = {clave for mes, pais, region in claves for clave in ((mes, pais, region), (mes_siguiente(mes), pais, region))}
+    if not claves:
+        return
+    claves = sorted(claves)
+    ParticionClasificacion.objects.bulk_create(
+        [ParticionClasificacion(mes=mes, pais=pais, region=region) for mes, pais, region in claves],
+        ignore_conflicts=True
+    )
+    for inicio in range(0, len(claves), MAX_INCREMENTOS_POR_SENTENCIA):
+        filtro = Q()
+        for mes, pais, region in claves[inicio:inicio + MAX_INCREMENTOS_POR_SENTENCIA]:
+            filtro |= Q(mes=mes, pais=pais, region=region)
+        ParticionClasificacion.objects.filter(filtro, pendiente=False).update(pendiente=True)
+
+
+def aplicar_incrementos(incrementos, ubicaciones=None):
+    """
+    Suma a los resúmenes los incrementos dados como Counter de
+    (usuario_id, mes, campo) -> cantidad, con campo numero_registros,
+    suma_huella_total o kg_reciclados. Crea los resúmenes que faltan con el
+    país y la región actuales del usuario (de ``ubicaciones``, {usuario_id:
+    (pais, region)}, o de la base de datos) y marca sus particiones.
+    """
+    # calculos importa este módulo
+    from .calculos import sumar_en_bloque
+
+    incrementos = {clave: cantidad for clave, cantidad in incrementos.items() if cantidad}
+    if not incrementos:
+        return
+    por_resumen = {}
+    for (usuario_id, mes, campo), cantidad in incrementos.items():
+        por_resumen.setdefault((usuario_id, mes), {})[campo] = cantidad
+    usuarios = {usuario_id for usuario_id, _ in por_resumen}
+    if ubicaciones is None or not usuarios <= ubicaciones.keys():
+        ubicaciones = {
+            usuario_id: (pais, region)
+            for usuario_id, pais, region in Usuario.objects.filter(id__in=usuarios).values_list('id', 'pais', 'region')
+        }
+    claves = sorted(clave for clave in por_resumen if clave[0] in ubicaciones)
+    # Solo las altas crean resúmenes: un descuento sin resumen es el de un
+    # usuario que se está eliminando
+    altas = [clave for clave in claves if any(cantidad > 0 for cantidad in por_resumen[clave].values())]
+    nuevos = [
+        ResumenMensualUsuario(
+            usuario_id=usuario_id, mes=mes, pais=ubicaciones[usuario_id][0], region=ubicaciones[usuario_id][1],
+            **{campo: tipo(por_resumen[(usuario_id, mes)].get(campo, 0)) for campo, tipo in CAMPOS_INCREMENTO}
+        )
+        for usuario_id, mes in altas
+    ]
+
+    with transaction.atomic(savepoint=False):
+        # Las altas se insertan o suman en una sola sentencia si la base de
+        # datos lo admite; el resto se actualiza con CASE
+        if sumar_en_bloque(ResumenMensualUsuario, nuevos, ('usuario', 'mes'), [campo for campo, _ in CAMPOS_INCREMENTO]):
+            actualizar = sorted(set(claves) - set(altas))
+        else:
+            ResumenMensualUsuario.objects.bulk_create(
+                [
+                    ResumenMensualUsuario(usuario_id=resumen.usuario_id, mes=resumen.mes, pais=resumen.pais, region=resumen.region)
+                    for resumen in nuevos
+                ],
+                ignore_conflicts=True
+            )
+            actualizar = claves
+        for inicio in range(0, len(actualizar), MAX_INCREMENTOS_POR_SENTENCIA):
+            lote = actualizar[inicio:inicio + MAX_INCREMENTOS_POR_SENTENCIA]
+            filtro = Q()
+            for usuario_id, mes in lote:
+                filtro |= Q(usuario_id=usuario_id, mes=mes)
+            cambios = {}
+            for campo, tipo in CAMPOS_INCREMENTO:
+                condiciones = [
+                    When(Q(usuario_id=usuario_id, mes=mes), then=Value(tipo(por_resumen[(usuario_id, mes)][campo])))
+                    for usuario_id, mes in lote if campo in por_resumen[(usuario_id, mes)]
+                ]
+                if condiciones:
+                    cambios[campo] = F(campo) + Case(*condiciones, default=Value(tipo(0)))
+            ResumenMensualUsuario.objects.filter(filtro).update(**cambios)
+
+        marcar_pendientes(
+            particion for usuario_id, mes in claves for particion in particiones(mes, *ubicaciones[usuario_id])
+        )
+
+
+def incrementos_registro(anterior, actual, incrementos=None):
+    """
+    Incrementos de un registro de huella que pasa de ``anterior`` a ``actual``,
+    dados como (usuario_id, fecha, huella_total) o None en altas y bajas.
+    """
+    incrementos = Counter() if incrementos is None else incrementos
+    for estado, signo in ((anterior, -1), (actual, 1)):
+        if estado is not None:
+            usuario_id, fecha, huella_total = estado
+            mes = mes_de(fecha)
+            incrementos[(usuario_id, mes, 'numero_registros')] += signo
+            incrementos[(usuario_id, mes, 'suma_huella_total')] += signo * huella_total
+    return incrementos
+
+
+def incrementos_reciclaje(anterior, actual, incrementos=None):
+    # Igual que incrementos_registro, con (usuario_id, fecha, kg_total_reciclado)
+    incrementos = Counter() if incrementos is None else incrementos
+    for estado, signo in ((anterior, -1), (actual, 1)):
+        if estado is not None:
+            usuario_id, fecha, kg = estado
+            incrementos[(usuario_id, mes_de(fecha), 'kg_reciclados')] += signo * kg
+    return incrementos
+
+
+def mover_usuario(usuario_id, ubicacion):
+    # Los resúmenes del usuario pasan a su nuevo país y región
+    resumenes = ResumenMensualUsuario.objects.filter(usuario_id=usuario_id)
+    anteriores = set(resumenes.values_list('mes', 'pais', 'region'))
+    if not anteriores:
+        return
+    resumenes.update(pais=ubicacion[0], region=ubicacion[1])
+    marcar_pendientes(
+        particion
+        for mes, pais, region in anteriores | {(mes, *ubicacion) for mes, _, _ in anteriores}
+        for particion in particiones(mes, pais, region)
+    )
+
+
+def _posiciones(valores, usuario_ids, ascendente):
+    # Posición 1..n de cada valor válido (NaN = sin posición); a igual valor, menor usuario_id
+    posiciones = np.zeros(len(valores), dtype=np.int64)
+    validos = np.flatnonzero(~np.isnan(valores))
+    clave = valores[validos] if ascendente else -valores[validos]
+    orden = validos[np.lexsort((usuario_ids[validos], clave))]
+    posiciones[orden] = np.arange(1, len(orden) + 1)
+    return posiciones
+
+
+def refrescar_particion(mes, pais, region):
+    """
+    Recalcula huella promedio, mejora y posiciones de todos los resúmenes de
+    una partición. La partición deja de estar pendiente antes de leer, de modo
+    que una escritura concurrente la vuelve a marcar.
+    """
+    from .calculos import actualizar_en_bloque
+
+    ambito = 'region' if region else 'pais'
+    ParticionClasificacion.objects.update_or_create(
+        mes=mes, pais=pais, region=region, defaults={'pendiente': False, 'actualizada': timezone.now()}
+    )
+    resumenes = ResumenMensualUsuario.objects.filter(mes=mes, pais=pais)
+    if region:
+        resumenes = resumenes.filter(region=region)
+    previos = ResumenMensualUsuario.objects.filter(usuario_id=OuterRef('usuario_id'), mes=mes_anterior(mes))
+    filas = list(
+        resumenes.annotate(
+            registros_previos=Subquery(previos.values('numero_registros')[:1]),
+            suma_previa=Subquery(previos.values('suma_huella_total')[:1])
+        ).values_list('id', 'usuario_id', 'numero_registros', 'suma_huella_total', 'kg_reciclados',
+                      'registros_previos', 'suma_previa')
+    )
+    if not filas:
+        return 0
+
+    ids, usuario_ids, numeros, sumas, kg, numeros_previos, sumas_previas = (
+        np.array([valor if valor is not None else np.nan for valor in columna], dtype=float)
+        for columna in zip(*filas)
+    )
+    with np.errstate(divide='ignore', invalid='ignore'):
+        promedio = np.where(numeros > 0, sumas / numeros, np.nan)
+        promedio_previo = np.where(numeros_previos > 0, sumas_previas / numeros_previos, np.nan)
+    columnas = {
+        'huella_promedio': promedio,
+        'mejora': promedio_previo - promedio,
+        'kg_reciclados': np.where(kg > 0, kg, np.nan),
+    }
+    posiciones = {
+        metrica: _posiciones(columnas[campo], usuario_ids, ascendente)
+        for metrica, (campo, ascendente) in METRICAS.items()
+    }
+
+    objetos = []
+    for fila in range(len(filas)):
+        resumen = ResumenMensualUsuario(id=int(ids[fila]))
+        resumen.huella_promedio = None if np.isnan(promedio[fila]) else float(promedio[fila])
+        resumen.mejora = None if np.isnan(columnas['mejora'][fila]) else float(columnas['mejora'][fila])
+        for metrica in METRICAS:
+            setattr(resumen, f'posicion_{metrica}_{ambito}', int(posiciones[metrica][fila]) or None)
+        objetos.append(resumen)
+    actualizar_en_bloque(
+        ResumenMensualUsuario, objetos,
+        ['huella_promedio', 'mejora'] + [f'posicion_{metrica}_{ambito}' for metrica in METRICAS]
+    )
+    return len(objetos)
+
+
+def refrescar_pendientes(al_avanzar=None):
+    # Recalcula todas las particiones pendientes; devuelve cuántas
+    refrescadas = 0
+    pendientes = list(
+        ParticionClasificacion.objects.filter(pendiente=True).order_by('mes', 'pais', 'region')
+        .values_list('mes', 'pais', 'region')
+    )
+    for mes, pais, region in pendientes:
+        with transaction.atomic():
+            refrescar_particion(mes, pais, region)
+        refrescadas += 1
+        if al_avanzar:
+            al_avanzar(refrescadas)
+    return refrescadas
+
+
+def parsear_mes(valor):
+    if not valor:
+        return mes_de(timezone.now())
+    try:
+        return datetime.date.fromisoformat(f'{valor}-01')
+    except ValueError:
+        raise ParametroInvalido("mes debe tener el formato AAAA-MM")
+
+
+def clasificacion(usuario, metrica, ambito, mes, limite=LIMITE_POR_DEFECTO):
+    """
+    Top ``limite`` de la métrica en el país o la región del usuario para el
+    mes dado, y la posición del propio usuario, tal como quedaron en el último
+    refresco de la partición (``actualizada``); ``pendiente`` indica que hubo
+    escrituras después.
+    """
+    if metrica not in METRICAS:
+        raise ParametroInvalido(f"metrica debe ser una de: {', '.join(METRICAS)}")
+    if ambito not in AMBITOS:
+        raise ParametroInvalido(f"ambito debe ser uno de: {', '.join(AMBITOS)}")
+    if not usuario.pais or (ambito == 'region' and not usuario.region):
+        raise ParametroInvalido(f"El usuario no tiene {'región' if ambito == 'region' else 'país'} asignado")
+
+    region = usuario.region if ambito == 'region' else ''
+    particion = ParticionClasificacion.objects.filter(mes=mes, pais=usuario.pais, region=region).first()
+
+    campo, _ = METRICAS[metrica]
+    posicion = f'posicion_{metrica}_{ambito}'
+    resumenes = ResumenMensualUsuario.objects.filter(mes=mes, pais=usuario.pais)
+    if region:
+        resumenes = resumenes.filter(region=region)
+    primeros = (
+        resumenes.filter(**{f'{posicion}__isnull': False}).order_by(posicion)
+        .values_list(posicion, 'usuario__username', campo)[:limite]
+    )
+    propio = (
+        ResumenMensualUsuario.objects.filter(usuario=usuario, mes=mes)
+        .values_list(posicion, campo).first()
+    )
+    return {
+        'metrica': metrica,
+        'ambito': ambito,
+        'mes': mes.strftime('%Y-%m'),
+        'pais': usuario.pais,
+        'region': region,
+        'actualizada': particion.actualizada if particion else None,
+        'pendiente': particion.pendiente if particion else False,
+        'clasificacion': [
+            {'posicion': numero, 'usuario': username, 'valor': valor}
+            for numero, username, valor in primeros
+        ],
+        'usuario': {'posicion': propio[0], 'valor': propio[1]} if propio and propio[0] else None,
+    }
+
+
+def reconstruir_resumenes(al_avanzar=None):
+    """
+    Reconstruye todos los resúmenes mensuales con dos consultas agregadas por
+    mes (huella y reciclaje) y marca todas sus particiones como pendientes.
+    Devuelve el número de resúmenes.
+    """
+    totales = {}
+    huellas = (
+        RegistroHuellaCarbono.objects.annotate(mes=TruncMonth('fecha')).order_by()
+        .values('usuario_id', 'mes')
+        .annotate(registros=Count('id'), suma=Sum('huella_total'))
+        .values_list('usuario_id', 'mes', 'registros', 'suma')
+    )
+    for usuario_id, mes, registros, suma in huellas.iterator():
+        totales[(usuario_id, mes.date())] = [registros, suma, 0.0]
+    reciclaje = (
+        RegistroReciclaje.objects.annotate(mes=TruncMonth('fecha')).order_by()
+        .values('usuario_id', 'mes')
+        .annotate(kg=Sum('kg_total_reciclado'))
+        .values_list('usuario_id', 'mes', 'kg')
+    )
+    for usuario_id, mes, kg in reciclaje.iterator():
+        totales.setdefault((usuario_id, mes.date()), [0, 0.0, 0.0])[2] = kg or 0.0
+
+    ubicaciones = {
+        usuario_id: (pais, region)
+        for usuario_id, pais, region in Usuario.objects.values_list('id', 'pais', 'region').iterator()
+    }
+    with transaction.atomic():
+        ResumenMensualUsuario.objects.all().delete()
+        ParticionClasificacion.objects.all().delete()
+        claves = sorted(totales)
+        for inicio in range(0, len(claves), TAMANO_LOTE_RESUMENES):
+            ResumenMensualUsuario.objects.bulk_create([
+                ResumenMensualUsuario(
+                    usuario_id=usuario_id, mes=mes,
+                    pais=ubicaciones[usuario_id][0], region=ubicaciones[usuario_id][1],
+                    numero_registros=totales[(usuario_id, mes)][0],
+                    suma_huella_total=totales[(usuario_id, mes)][1] or 0.0,
+                    kg_reciclados=totales[(usuario_id, mes)][2]
+                )
+                for usuario_id, mes in claves[inicio:inicio + TAMANO_LOTE_RESUMENES]
+            ])
+            if al_avanzar:
+                al_avanzar(min(inicio + TAMANO_LOTE_RESUMENES, len(claves)))
+        marcar_pendientes(
+            particion for usuario_id, mes in claves for particion in particiones(mes, *ubicaciones[usuario_id])
+        )
+    return len(totales)
@@ -0,0 +1,199 @@
+"""
+Evaluación de escenarios hipotéticos ("¿y si...?") sobre un registro de huella.
+
+Un escenario parte de los detalles de un RegistroHuellaCarbono y modifica
+algunos de sus campos. Los escenarios se definen como una rejilla: cada eje
+modifica un campo con una lista de valores y se evalúa el producto cartesiano
+de todos los ejes en una sola pasada vectorizada de las fórmulas de calculos.
+"""
+
+import math
+
+import numpy as np
+
+from .calculos import DETALLES, calcular_huellas, cargar_columnas
+from .factores import factores_para_usuario
+
+MAX_ESCENARIOS = 50000
+MAX_RESULTADOS = 100
+
+# Campo de detalle -> categoría de DETALLES a la que pertenece
+CATEGORIA_DE_CAMPO = {campo: categoria for categoria, _, campos in DETALLES for campo in campos}
+
+CAMPOS_TEXTO = ('tipo_calefaccion',)
+
+# Tipos de eje admitidos:
+#   valores  -> el campo toma cada valor de la lista
+#   escala   -> el campo se multiplica por cada valor de la lista
+#   traslado -> se mueve cada fracción del campo al campo indicado en "hacia"
+TIPOS_EJE = ('valores', 'escala', 'traslado')
+
+
+class EscenarioInvalido(ValueError):
+    pass
+
+
+def _es_numero(valor):
+    # Número finito representable como float (los enteros enormes desbordan)
+    if isinstance(valor, bool) or not isinstance(valor, (int, float)):
+        return False
+    try:
+        return math.isfinite(valor)
+    except OverflowError:
+        return False
+
+
+def _es_campo(valor):
+    return isinstance(valor, str) and valor in CATEGORIA_DE_CAMPO
+
+
+def _eje(definicion):
+    # Valida un eje y devuelve (campo, tipo, valores, hacia)
+    if not isinstance(definicion, dict):
+        raise EscenarioInvalido("Cada eje debe ser un objeto")
+
+    campo = definicion.get('campo')
+    if not _es_campo(campo):
+        raise EscenarioInvalido(f"Campo desconocido: {campo}")
+
+    tipos = [tipo for tipo in TIPOS_EJE if tipo in definicion]
+    if len(tipos) != 1:
+        raise EscenarioInvalido(f"El eje de {campo} debe indicar exactamente uno de: {', '.join(TIPOS_EJE)}")
+    tipo = tipos[0]
+
+    valores = definicion[tipo]
+    if not isinstance(valores, list) or not valores:
+        raise EscenarioInvalido(f"El eje de {campo} debe tener una lista de valores no vacía")
+
+    if campo in CAMPOS_TEXTO:
+        if tipo != 'valores' or not all(isinstance(valor, str) for valor in valores):
+            raise EscenarioInvalido(f"{campo} solo admite una lista de valores de texto")
+        return campo, tipo, np.array(valores, dtype=object), None
+
+    if not all(_es_numero(valor) for valor in valores):
+        raise EscenarioInvalido(f"El eje de {campo} solo admite valores numéricos")
+
+    hacia = None
+    if tipo == 'traslado':
+        hacia = definicion.get('hacia')
+        if not _es_campo(hacia) or hacia in CAMPOS_TEXTO or hacia == campo:
+            raise EscenarioInvalido(f"El traslado de {campo} debe indicar un campo numérico distinto en 'hacia'")
+        if not all(0 <= valor <= 1 for valor in valores):
+            raise EscenarioInvalido(f"Las fracciones de traslado de {campo} deben estar entre 0 y 1")
+
+    return campo, tipo, np.array(valores, dtype=float), hacia
+
+
+def preparar_ejes(definiciones):
+    if not isinstance(definiciones, list) or not definiciones:
+        raise EscenarioInvalido("Debe enviar una lista de ejes")
+
+    ejes = [_eje(definicion) for definicion in definiciones]
+    total = math.prod(len(valores) for _, _, valores, _ in ejes)
+    if total > MAX_ESCENARIOS:
+        raise EscenarioInvalido(f"La rejilla tiene {total} escenarios; se permiten como máximo {MAX_ESCENARIOS}")
+    return ejes
+
+
+def validar_limite(limite):
+    # Número de escenarios a devolver, acotado entre 1 y MAX_RESULTADOS
+    if isinstance(limite, bool):
+        raise EscenarioInvalido("El límite debe ser un número entero")
+    try:
+        limite = int(limite)
+    except (TypeError, ValueError, OverflowError):
+        raise EscenarioInvalido("El límite debe ser un número entero")
+    return max(1, min(limite, MAX_RESULTADOS))
+
+
+def columnas_de_registro(registro):
+    # Detalles del registro como columnas de longitud 1
+    registro_ids = np.array([registro.id], dtype=np.int64)
+    return {
+        categoria: cargar_columnas(modelo, campos, registro_ids)
+        for categoria, modelo, campos in DETALLES
+    }
+
+
+def aplicar_ejes(base, ejes):
+    """
+    Expande las columnas base (longitud 1) a una fila por escenario y aplica
+    los ejes en orden. Devuelve las columnas y, por eje, el índice del valor
+    usado en cada escenario.
+    """
+    forma = tuple(len(valores) for _, _, valores, _ in ejes)
+    total = math.prod(forma)
+    indices = np.unravel_index(np.arange(total), forma)
+
+    columnas = {
+        categoria: {campo: np.repeat(valores, total) for campo, valores in campos.items()}
+        for categoria, campos in base.items()
+    }
+
+    for (campo, tipo, valores, hacia), indice in zip(ejes, indices):
+        columna = columnas[CATEGORIA_DE_CAMPO[campo]][campo]
+        if tipo == 'valores':
+            columna[:] = valores[indice]
+        elif tipo == 'escala':
+            columna *= valores[indice]
+        else:
+            trasladado = columna * valores[indice]
+            columna -= trasladado
+            columnas[CATEGORIA_DE_CAMPO[hacia]][hacia] += trasladado
+
+    return columnas, indices
+
+
+def evaluar_escenarios(registro, definiciones, limite=20):
+    """
+    Evalúa todos los escenarios de la rejilla sobre el registro y devuelve los
+    ``limite`` con mayor reducción de huella total respecto al registro base.
+    """
+    ejes = preparar_ejes(definiciones)
+    limite = validar_limite(limite)
+
+    factores = factores_para_usuario(registro.usuario, registro.fecha)
+    base = columnas_de_registro(registro)
+    reduccion_reciclaje = np.array([registro.reduccion_por_reciclaje], dtype=float)
+    huella_base = calcular_huellas(base, reduccion_reciclaje, factores)
+
+    columnas, indices = aplicar_ejes(base, ejes)
+    huellas = calcular_huellas(columnas, reduccion_reciclaje, factores)
+
+    total_base = float(huella_base['huella_total'][0])
+    reducciones = total_base - huellas['huella_total']
+
+    # Los mejores escenarios sin ordenar toda la rejilla
+    total = len(reducciones)
+    if limite < total:
+        mejores = np.argpartition(-reducciones, limite - 1)[:limite]
+    else:
+        mejores = np.arange(total)
+    mejores = mejores[np.argsort(-reducciones[mejores], kind='stable')]
+
+    escenarios = []
+    for posicion in mejores.tolist():
+        parametros = {}
+        for (campo, tipo, valores, hacia), indice in zip(ejes, indices):
+            valor = valores[indice[posicion]]
+            parametros[campo] = {tipo: valor if isinstance(valor, str) else float(valor)}
+            if hacia:
+                parametros[campo]['hacia'] = hacia
+        reduccion = float(reducciones[posicion])
+        escenarios.append({
+            'parametros': parametros,
+            'huella_total': float(huellas['huella_total'][posicion]),
+            'huella_consumo': float(huellas['huella_consumo'][posicion]),
+            'huella_transporte': float(huellas['huella_transporte'][posicion]),
+            'huella_energia': float(huellas['huella_energia'][posicion]),
+            'huella_residuos': float(huellas['huella_residuos'][posicion]),
+            'reduccion': reduccion,
+            'reduccion_porcentaje': reduccion / total_base * 100 if total_base else 0,
+        })
+
+    return {
+        'registro': registro.id,
+        'huella_base': total_base,
+        'escenarios_evaluados': total,
+        'escenarios': escenarios,
+    }
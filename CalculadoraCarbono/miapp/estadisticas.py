@@ -0,0 +1,222 @@
+"""
+Mantenimiento incremental de EstadisticasUsuario.
+
+Cada alta, cambio o baja de un RegistroHuellaCarbono ajusta el número de
+registros y las sumas con incrementos F() en una sola sentencia, de modo que
+las altas concurrentes no se pisan. El mínimo, el máximo y el último registro
+se actualizan con LEAST/GREATEST al crecer; solo cuando cambia o desaparece el
+registro que los definía se vuelven a consultar, con subconsultas dentro del
+mismo UPDATE.
+
+Las escrituras en bloque (recalcular_huellas, importación) reconstruyen las
+estadísticas de los usuarios afectados con recalcular_estadisticas.
+"""
+
+from django.db import IntegrityError, transaction
+from django.db.models import (
+    BigIntegerField, Case, Count, DateTimeField, F, FloatField, Max, Min, OuterRef, Q, Subquery,
+    Sum, Value, When
+)
+from django.db.models.functions import Coalesce, Greatest, Least
+
+from .models import EstadisticasUsuario, RegistroHuellaCarbono
+
+CAMPOS_SUMA = (
+    'huella_total', 'huella_consumo', 'huella_transporte',
+    'huella_energia', 'huella_residuos', 'reduccion_por_reciclaje'
+)
+
+# Campos del registro de los que dependen las estadísticas
+CAMPOS_REGISTRO = ('usuario', 'fecha') + CAMPOS_SUMA
+
+# Campos de EstadisticasUsuario que no son sumas -> tipo de sus expresiones CASE
+CAMPOS_EXTREMOS = {
+    'huella_minima': FloatField(),
+    'huella_maxima': FloatField(),
+    'ultimo_registro_id': BigIntegerField(),
+    'fecha_ultimo_registro': DateTimeField(),
+}
+
+TAMANO_LOTE_ESTADISTICAS = 1000
+
+
+def estado_registro(registro):
+    # (usuario_id, fecha, {campo: valor}) de un registro, tal como lo usan estas funciones
+    return registro.usuario_id, registro.fecha, {campo: getattr(registro, campo) for campo in CAMPOS_SUMA}
+
+
+def estado_guardado(registro_id):
+    # El mismo estado leído de la base de datos, o None si el registro no existe
+    fila = (
+        RegistroHuellaCarbono.objects.filter(pk=registro_id)
+        .values_list('usuario_id', 'fecha', *CAMPOS_SUMA)
+        .first()
+    )
+    if fila is None:
+        return None
+    return fila[0], fila[1], dict(zip(CAMPOS_SUMA, fila[2:]))
+
+
+def _posterior_al_ultimo(registro_id, fecha):
+    # El registro pasa a ser el último si es más reciente (a igual fecha, el de mayor id)
+    return (
+        Q(fecha_ultimo_registro__isnull=True)
+        | Q(fecha_ultimo_registro__lt=fecha)
+        | Q(fecha_ultimo_registro=fecha, ultimo_registro_id__lt=registro_id)
+    )
+
+
+def _extremos(usuario_id, alta=None, reemplazado=None):
+    """
+    Asignaciones de mínimo, máximo y último registro para el UPDATE de las
+    estadísticas del usuario. ``alta`` es (minimo, maximo, (registro_id,
+    fecha)) de los registros que se suman o cambian y ``reemplazado``,
+    (registro_id, huella_total) de un registro que cambió o se eliminó: si
+    definía alguno de los extremos, éste se vuelve a consultar dentro de la
+    misma sentencia, que ya ve el registro actualizado.
+    """
+    asignaciones = {campo: F(campo) for campo in CAMPOS_EXTREMOS}
+    if alta is not None:
+        minimo, maximo, (registro_id, fecha) = alta
+        es_ultimo = _posterior_al_ultimo(registro_id, fecha)
+        asignaciones.update({
+            'huella_minima': Coalesce(Least(F('huella_minima'), Value(minimo)), Value(minimo)),
+            'huella_maxima': Coalesce(Greatest(F('huella_maxima'), Value(maximo)), Value(maximo)),
+            'ultimo_registro_id': Case(
+                When(es_ultimo, then=Value(registro_id)), default=F('ultimo_registro_id'), output_field=BigIntegerField()
+            ),
+            'fecha_ultimo_registro': Case(
+                When(es_ultimo, then=Value(fecha)), default=F('fecha_ultimo_registro'), output_field=DateTimeField()
+            ),
+        })
+
+    if reemplazado is not None:
+        registro_id, total = reemplazado
+        registros = RegistroHuellaCarbono.objects.filter(usuario_id=usuario_id)
+        ultimos = registros.order_by('-fecha', '-id')
+        definia_ultimo = Q(ultimo_registro_id=registro_id) | Q(ultimo_registro__isnull=True)
+        consultas = {
+            'huella_minima': (Q(huella_minima=total), registros.order_by('huella_total').values('huella_total')),
+            'huella_maxima': (Q(huella_maxima=total), registros.order_by('-huella_total').values('huella_total')),
+            'ultimo_registro_id': (definia_ultimo, ultimos.values('id')),
+            'fecha_ultimo_registro': (definia_ultimo, ultimos.values('fecha')),
+        }
+        asignaciones = {
+            campo: Case(
+                When(condicion, then=Subquery(consulta[:1])), default=asignaciones[campo],
+                output_field=CAMPOS_EXTREMOS[campo]
+            )
+            for campo, (condicion, consulta) in consultas.items()
+        }
+
+    return asignaciones
+
+
+def aplicar_altas(usuario_id, registros):
+    """
+    Suma a las estadísticas del usuario los registros nuevos, dados como
+    tuplas (registro_id, fecha, {campo: valor}).
+    """
+    if not registros:
+        return
+    totales = [valores['huella_total'] for _, _, valores in registros]
+    registro_id, fecha, _ = max(registros, key=lambda registro: (registro[1], registro[0]))
+    sumas = {campo: sum(valores[campo] for _, _, valores in registros) for campo in CAMPOS_SUMA}
+
+    actualizados = EstadisticasUsuario.objects.filter(usuario_id=usuario_id).update(
+        numero_registros=F('numero_registros') + len(registros),
+        **{f'suma_{campo}': F(f'suma_{campo}') + valor for campo, valor in sumas.items()},
+        **_extremos(usuario_id, alta=(min(totales), max(totales), (registro_id, fecha)))
+    )
+    if actualizados:
+        return
+
+    try:
+        with transaction.atomic():
+            EstadisticasUsuario.objects.create(
+                usuario_id=usuario_id,
+                numero_registros=len(registros),
+                **{f'suma_{campo}': valor for campo, valor in sumas.items()},
+                huella_minima=min(totales),
+                huella_maxima=max(totales),
+                ultimo_registro_id=registro_id,
+                fecha_ultimo_registro=fecha
+            )
+    except IntegrityError:
+        # Otra transacción creó la fila entre la actualización y la inserción
+        aplicar_altas(usuario_id, registros)
+
+
+def aplicar_baja(registro_id, anterior):
+    usuario_id, _, valores = anterior
+    EstadisticasUsuario.objects.filter(usuario_id=usuario_id).update(
+        numero_registros=F('numero_registros') - 1,
+        **{f'suma_{campo}': F(f'suma_{campo}') - valor for campo, valor in valores.items()},
+        **_extremos(usuario_id, reemplazado=(registro_id, valores['huella_total']))
+    )
+
+
+def aplicar_cambio(registro_id, anterior, actual):
+    """
+    Ajusta las estadísticas cuando un registro pasa del estado ``anterior``
+    al ``actual`` (ambos como los devuelve estado_registro), con un solo UPDATE.
+    """
+    if anterior == actual:
+        return
+    usuario_anterior, _, valores_anteriores = anterior
+    usuario_id, fecha, valores = actual
+    if usuario_anterior != usuario_id:
+        aplicar_baja(registro_id, anterior)
+        aplicar_altas(usuario_id, [(registro_id, fecha, valores)])
+        return
+
+    total = valores['huella_total']
+    EstadisticasUsuario.objects.filter(usuario_id=usuario_id).update(
+        **{f'suma_{campo}': F(f'suma_{campo}') + (valores[campo] - valores_anteriores[campo]) for campo in CAMPOS_SUMA},
+        **_extremos(
+            usuario_id, alta=(total, total, (registro_id, fecha)),
+            reemplazado=(registro_id, valores_anteriores['huella_total'])
+        )
+    )
+
+
+def recalcular_estadisticas(usuario_ids):
+    """
+    Reconstruye desde los registros las estadísticas de los usuarios indicados
+    con una consulta agregada por lote de usuarios. Los usuarios sin registros
+    pierden su fila. Devuelve el número de usuarios con estadísticas.
+    """
+    usuario_ids = sorted(set(usuario_ids))
+    reconstruidos = 0
+    for inicio in range(0, len(usuario_ids), TAMANO_LOTE_ESTADISTICAS):
+        lote = usuario_ids[inicio:inicio + TAMANO_LOTE_ESTADISTICAS]
+        reconstruidos += _reconstruir_lote(lote)
+    return reconstruidos
+
+
+def _reconstruir_lote(usuario_ids):
+    ultimos = RegistroHuellaCarbono.objects.filter(usuario_id=OuterRef('usuario_id')).order_by('-fecha', '-id')
+    filas = (
+        RegistroHuellaCarbono.objects.filter(usuario_id__in=usuario_ids)
+        .order_by()
+        .values('usuario_id')
+        .annotate(
+            numero_registros=Count('id'),
+            **{f'suma_{campo}': Sum(campo) for campo in CAMPOS_SUMA},
+            huella_minima=Min('huella_total'),
+            huella_maxima=Max('huella_total'),
+            ultimo_registro_id=Subquery(ultimos.values('id')[:1]),
+            fecha_ultimo_registro=Subquery(ultimos.values('fecha')[:1])
+        )
+    )
+    estadisticas = [EstadisticasUsuario(**fila) for fila in filas]
+    campos = [campo.attname for campo in EstadisticasUsuario._meta.concrete_fields if not campo.primary_key]
+
+    with transaction.atomic():
+        EstadisticasUsuario.objects.filter(usuario_id__in=usuario_ids).exclude(
+            usuario_id__in=[e.usuario_id for e in estadisticas]
+        ).delete()
+        EstadisticasUsuario.objects.bulk_create(
+            estadisticas, update_conflicts=True, unique_fields=['usuario'], update_fields=campos
+        )
+    return len(estadisticas)
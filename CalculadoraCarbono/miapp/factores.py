@@ -0,0 +1,385 @@
+import datetime
+import threading
+import time
+from bisect import bisect_right
+from types import MappingProxyType
+
+from django.db import transaction
+from django.utils import timezone
+
+# Factores de emisión predeterminados (kg CO2 por unidad de actividad)
+# Se usan cuando la tabla FactorEmision no define un valor para la clave.
+FACTORES_PREDETERMINADOS = {
+    # Alimentación (kg CO2 por kg de alimento)
+    'carne_roja': 27.0,
+    'aves': 6.9,
+    'pescado': 5.4,
+    'lacteos': 1.9,
+    'frutas_verduras': 0.5,
+    'importacion': 1.1,  # multiplicador para alimentos importados
+
+    # Compras
+    'ropa': 20,  # kg CO2 por prenda
+    'electronicos': 100,  # kg CO2 por dispositivo
+    'compras_online': 5,  # kg CO2 por compra (incluye envío)
+
+    # Vehículo privado (kg CO2 por km)
+    'gasolina': 0.192,
+    'diesel': 0.171,
+    'hibrido': 0.106,
+    'electrico': 0.053,  # Depende del mix eléctrico
+
+    # Transporte público (kg CO2 por km por pasajero)
+    'autobus': 0.105,
+    'tren_metro': 0.041,
+
+    # Vuelos (kg CO2 por vuelo)
+    'vuelo_corto': 200,  # Aproximadamente para vuelos < 1000km
+    'vuelo_mediano': 600,  # Aproximadamente para vuelos 1000-3000km
+    'vuelo_largo': 1600,  # Aproximadamente para vuelos > 3000km
+
+    # Energía
+    'electricidad': 0.31,  # kg CO2 por kWh, depende del mix eléctrico del país
+    'calefaccion_gas': 0.20,  # kg CO2 por kWh
+    'calefaccion_elec': 0.31,  # kg CO2 por kWh
+    'calefaccion_lena': 0.02,  # kg CO2 por kWh
+    'calefaccion_gasoleo': 0.27,  # kg CO2 por kWh
+    'calefaccion_biomasa': 0.01,  # kg CO2 por kWh
+    'agua': 0.344,  # kg CO2 por m³ (tratamiento y distribución)
+
+    # Residuos (kg CO2 por kg)
+    'residuos': 0.58,
+    'compostaje': 0.24,  # kg CO2 evitados por kg compostado
+}
+
+# Tipo de calefacción (DetalleEnergia.TIPOS_CALEFACCION) -> clave de factor
+# 'NOCALEF' y los tipos desconocidos no generan emisiones
+CLAVES_CALEFACCION = {
+    'GAS': 'calefaccion_gas',
+    'ELEC': 'calefaccion_elec',
+    'LEÑA': 'calefaccion_lena',
+    'GASOLEO': 'calefaccion_gasoleo',
+    'BIOMASA': 'calefaccion_biomasa',
+}
+
+SEMANAS_POR_MES = 4.35
+
+# Clave de factor -> (categoria, subcategoria) en la tabla FactorEmision.
+# Los factores registrados en la base de datos sustituyen a los predeterminados.
+CATALOGO_FACTORES = {
+    'carne_roja': ('Alimentos', 'Carne Roja'),
+    'aves': ('Alimentos', 'Aves'),
+    'pescado': ('Alimentos', 'Pescado'),
+    'lacteos': ('Alimentos', 'Lácteos'),
+    'frutas_verduras': ('Alimentos', 'Frutas y Verduras'),
+    'importacion': ('Alimentos', 'Importación'),
+    'ropa': ('Compras', 'Ropa'),
+    'electronicos': ('Compras', 'Electrónicos'),
+    'compras_online': ('Compras', 'Compras Online'),
+    'gasolina': ('Transporte', 'Automóvil Gasolina'),
+    'diesel': ('Transporte', 'Automóvil Diésel'),
+    'hibrido': ('Transporte', 'Automóvil Híbrido'),
+    'electrico': ('Transporte', 'Automóvil Eléctrico'),
+    'autobus': ('Transporte', 'Autobús'),
+    'tren_metro': ('Transporte', 'Tren'),
+    'vuelo_corto': ('Transporte', 'Vuelo Corto'),
+    'vuelo_mediano': ('Transporte', 'Vuelo Mediano'),
+    'vuelo_largo': ('Transporte', 'Vuelo Largo'),
+    'electricidad': ('Electricidad', 'Red Eléctrica'),
+    'calefaccion_gas': ('Calefacción', 'Gas Natural'),
+    'calefaccion_elec': ('Calefacción', 'Eléctrica'),
+    'calefaccion_lena': ('Calefacción', 'Leña'),
+    'calefaccion_gasoleo': ('Calefacción', 'Gasóleo'),
+    'calefaccion_biomasa': ('Calefacción', 'Biomasa'),
+    'agua': ('Agua', 'Tratamiento y Distribución'),
+    'residuos': ('Residuos', 'Relleno Sanitario'),
+    'compostaje': ('Residuos', 'Compostaje'),
+}
+
+# Regiones de FactorEmision que se consideran el valor por defecto
+REGIONES_POR_DEFECTO = ('', 'Global')
+
+# Segundos entre comprobaciones de la versión vigente en la base de datos
+INTERVALO_VERIFICACION = 1.0
+
+
+def version_factores():
+    # La versión vigente es el último VersionFactores registrado. Se lee de la
+    # base de datos, la única fuente que comparten todos los procesos (workers y
+    # procesos hijos); RegistroFactores la consulta como mucho una vez por
+    # INTERVALO_VERIFICACION.
+    from .models import VersionFactores
+    return VersionFactores.objects.order_by('-id').values_list('id', flat=True).first() or 0
+
+
+def registrar_cambio_factores(motivo=''):
+    """
+    Crea una nueva versión de factores dentro de la transacción en curso.
+
+    Los demás procesos la ven al confirmar, en su siguiente comprobación; el
+    registro de este proceso se invalida al confirmar para no esperarla.
+    """
+    from .models import VersionFactores
+    version = VersionFactores.objects.create(motivo=motivo[:255])
+    transaction.on_commit(lambda: registro_factores.invalidar())
+    return version
+
+
+def ordinal_de(fecha=None):
+    # Día (date.toordinal) en la zona horaria actual; sin fecha, el día de hoy
+    if fecha is None:
+        fecha = timezone.localdate()
+    elif isinstance(fecha, datetime.datetime):
+        fecha = timezone.localdate(fecha) if timezone.is_aware(fecha) else fecha.date()
+    return fecha.toordinal()
+
+
+class LineaTemporal:
+    """
+    Función escalonada en el tiempo.
+
+    ``inicios`` es una lista ordenada de días (ordinales) y ``valores[i]`` es el
+    valor vigente desde ``inicios[i]`` hasta el día anterior a ``inicios[i + 1]``.
+    El primer inicio es 0, es decir, "desde siempre". Un valor None indica que
+    no hay nada vigente en ese intervalo.
+    """
+
+    def __init__(self, inicios, valores):
+        self.inicios = inicios
+        self.valores = valores
+
+    @classmethod
+    def desde_intervalos(cls, intervalos):
+        """
+        Construye la línea a partir de tuplas (desde, hasta, valor), con
+        ``desde`` incluido y ``hasta`` excluido (None = sin límite). Si varios
+        intervalos se solapan gana el último de la lista.
+        """
+        limites = {0}
+        for desde, hasta, _ in intervalos:
+            limites.update(limite for limite in (desde, hasta) if limite is not None)
+
+        inicios = []
+        valores = []
+        # Dentro de cada tramo entre límites consecutivos los intervalos vigentes
+        # no cambian, así que basta con evaluar su inicio
+        for inicio in sorted(limites):
+            valor = None
+            for desde, hasta, candidato in intervalos:
+                if (desde is None or desde <= inicio) and (hasta is None or inicio < hasta):
+                    valor = candidato
+            if not valores or valores[-1] != valor:
+                inicios.append(inicio)
+                valores.append(valor)
+        return cls(inicios, valores)
+
+    def en(self, ordinal):
+        return self.valores[bisect_right(self.inicios, ordinal) - 1]
+
+
+class InstantaneaFactores:
+    """
+    Copia inmutable de la tabla FactorEmision en un momento dado.
+
+    ``lineas`` asocia (region, clave) con la línea temporal de pares (valor,
+    distribución) de esa clave en esa región ('' para el valor por defecto).
+    La distribución es None o (FactorEmision.distribucion, incertidumbre). ``indice`` responde a
+    obtener_factor_por_region: asocia (categoria, subcategoria, region) con la
+    línea temporal de filas de FactorEmision, donde None en subcategoria o
+    region significa "cualquiera". Entre filas vigentes el mismo día gana la de
+    fecha_actualizacion más reciente.
+    """
+
+    def __init__(self, version, factores):
+        claves = {categoria_subcategoria: clave for clave, categoria_subcategoria in CATALOGO_FACTORES.items()}
+        self.version = version
+        self.resueltos = {}
+        self.distribuciones_resueltas = {}
+
+        # Los factores llegan del más antiguo al más reciente, así que los
+        # posteriores tienen prioridad en LineaTemporal.desde_intervalos
+        intervalos_por_clave = {}
+        intervalos_por_indice = {}
+        for factor in factores:
+            desde = factor.vigente_desde.toordinal() if factor.vigente_desde else None
+            hasta = factor.vigente_hasta.toordinal() if factor.vigente_hasta else None
+
+            for subcategoria in (factor.subcategoria, None):
+                for region in (factor.region, None):
+                    intervalos_por_indice.setdefault((factor.categoria, subcategoria, region), []).append((desde, hasta, factor))
+
+            clave = claves.get((factor.categoria, factor.subcategoria))
+            if clave is not None:
+                region = '' if factor.region in REGIONES_POR_DEFECTO else factor.region
+                distribucion = (factor.distribucion, factor.incertidumbre or 0) if factor.distribucion else None
+                intervalos_por_clave.setdefault((region, clave), []).append((desde, hasta, (factor.valor, distribucion)))
+
+        self.lineas = {
+            clave: LineaTemporal.desde_intervalos(intervalos)
+            for clave, intervalos in intervalos_por_clave.items()
+        }
+        self.indice = {
+            clave: LineaTemporal.desde_intervalos(intervalos)
+            for clave, intervalos in intervalos_por_indice.items()
+        }
+
+
+class RegistroFactores:
+    """
+    Factores de emisión del proceso, cargados una sola vez desde FactorEmision.
+
+    Para cada par (región, país) guarda una línea temporal cuyos tramos son
+    diccionarios de solo lectura con todos los factores ya resueltos: región
+    del usuario, luego su país, luego el valor por defecto de la tabla y por
+    último FACTORES_PREDETERMINADOS. Resolver los factores de una fecha es una
+    búsqueda binaria. Se recarga cuando cambia la versión de la base de datos,
+    comprobada como mucho una vez por INTERVALO_VERIFICACION; la instantánea
+    nueva sustituye a la anterior de una sola vez.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._instantanea = None
+        self._vigente = False
+        self._verificado_en = 0.0
+
+    def invalidar(self):
+        self._vigente = False
+
+    def version(self):
+        return self._obtener_instantanea().version
+
+    def linea_factores(self, region='', pais=''):
+        return self._lineas_resueltas(region, pais)[0]
+
+    def linea_distribuciones(self, region='', pais=''):
+        # Mismos tramos que linea_factores; cada tramo asocia las claves con
+        # distribución a su par (distribucion, incertidumbre)
+        return self._lineas_resueltas(region, pais)[1]
+
+    def factores(self, region='', pais='', fecha=None):
+        return self.linea_factores(region, pais).en(ordinal_de(fecha))
+
+    def distribuciones(self, region='', pais='', fecha=None):
+        return self.linea_distribuciones(region, pais).en(ordinal_de(fecha))
+
+    def regiones_con_factor(self, clave):
+        # Regiones y países cuyo propio valor para la clave está vigente en todo momento,
+        # es decir, que nunca recurren a un nivel inferior
+        lineas = self._obtener_instantanea().lineas
+        return [
+            region for (region, clave_linea), linea in lineas.items()
+            if region and clave_linea == clave and None not in linea.valores
+        ]
+
+    def factor_por_region(self, categoria, subcategoria=None, region=None, fecha=None):
+        # Misma semántica que FactorEmision.obtener_factor_por_region: si no hay
+        # factor vigente para la región se usa el de región vacía (valor por defecto)
+        indice = self._obtener_instantanea().indice
+        ordinal = ordinal_de(fecha)
+        subcategoria = subcategoria or None
+
+        linea = indice.get((categoria, subcategoria, region or None))
+        factor = linea.en(ordinal) if linea else None
+        if factor is None and region:
+            linea = indice.get((categoria, subcategoria, ''))
+            factor = linea.en(ordinal) if linea else None
+        return factor
+
+    def _lineas_resueltas(self, region, pais):
+        instantanea = self._obtener_instantanea()
+        clave = (region or '', pais or '')
+        linea = instantanea.resueltos.get(clave)
+        if linea is None:
+            linea, distribuciones = self._resolver(instantanea, *clave)
+            instantanea.distribuciones_resueltas[clave] = distribuciones
+            instantanea.resueltos[clave] = linea
+        return linea, instantanea.distribuciones_resueltas[clave]
+
+    def _resolver(self, instantanea, region, pais):
+        niveles = [nivel for nivel in (region, pais) if nivel and nivel not in REGIONES_POR_DEFECTO]
+        niveles.append('')
+        lineas = {
+            clave: [instantanea.lineas[(nivel, clave)] for nivel in niveles if (nivel, clave) in instantanea.lineas]
+            for clave in FACTORES_PREDETERMINADOS
+        }
+
+        limites = sorted({inicio for lineas_clave in lineas.values() for linea in lineas_clave for inicio in linea.inicios} | {0})
+        inicios = []
+        tramos = []
+        tramos_distribuciones = []
+        for inicio in limites:
+            valores = {}
+            distribuciones = {}
+            for clave, predeterminado in FACTORES_PREDETERMINADOS.items():
+                vigente = None
+                for linea in lineas[clave]:
+                    vigente = linea.en(inicio)
+                    if vigente is not None:
+                        break
+                if vigente is None:
+                    valores[clave] = predeterminado
+                    continue
+                # La distribución es la de la misma fila que aporta el valor
+                valores[clave], distribucion = vigente
+                if distribucion is not None:
+                    distribuciones[clave] = distribucion
+            if not tramos or tramos[-1] != valores or tramos_distribuciones[-1] != distribuciones:
+                inicios.append(inicio)
+                tramos.append(MappingProxyType(valores))
+                tramos_distribuciones.append(MappingProxyType(distribuciones))
+        return LineaTemporal(inicios, tramos), LineaTemporal(inicios, tramos_distribuciones)
+
+    def _obtener_instantanea(self):
+        instantanea = self._instantanea
+        ahora = time.monotonic()
+        if self._vigente and ahora - self._verificado_en < INTERVALO_VERIFICACION:
+            return instantanea
+
+        version = version_factores()
+        if instantanea is None or not self._vigente or version != instantanea.version:
+            with self._lock:
+                instantanea = self._instantanea
+                if instantanea is None or not self._vigente or version != instantanea.version:
+                    instantanea = self._cargar(version)
+        self._verificado_en = ahora
+        self._vigente = True
+        return instantanea
+
+    def _cargar(self, version):
+        from .models import FactorEmision
+
+        factores = list(FactorEmision.objects.order_by('fecha_actualizacion', 'id'))
+        self._instantanea = InstantaneaFactores(version, factores)
+        return self._instantanea
+
+
+registro_factores = RegistroFactores()
+
+
+def obtener_factores(region='', pais='', fecha=None):
+    return registro_factores.factores(region, pais, fecha)
+
+
+def clave_de_factor(categoria, subcategoria):
+    # Clave de cálculo a la que corresponde una fila de FactorEmision (None si no se usa)
+    for clave, categoria_subcategoria in CATALOGO_FACTORES.items():
+        if categoria_subcategoria == (categoria, subcategoria):
+            return clave
+    return None
+
+
+def obtener_factor_por_region(categoria, subcategoria=None, region=None, fecha=None):
+    return registro_factores.factor_por_region(categoria, subcategoria, region, fecha)
+
+
+def factores_para_usuario(usuario, fecha=None):
+    if usuario is None:
+        return registro_factores.factores(fecha=fecha)
+    return registro_factores.factores(usuario.region, usuario.pais, fecha)
+
+
+def distribuciones_para_usuario(usuario, fecha=None):
+    if usuario is None:
+        return registro_factores.distribuciones(fecha=fecha)
+    return registro_factores.distribuciones(usuario.region, usuario.pais, fecha)
@@ -0,0 +1,303 @@
+"""
+Importación masiva de datos de actividad (CSV o NDJSON) en DetalleEnergia y
+DetalleTransporte.
+
+Cada fila identifica al usuario (columna ``usuario`` con su nombre de usuario
+o ``usuario_id``), el día (``fecha``, AAAA-MM-DD) y uno o más campos de
+DetalleEnergia o DetalleTransporte. La fila se aplica al registro de huella
+del usuario en ese día, que se crea si no existe; los campos vacíos o
+ausentes conservan su valor.
+
+El archivo se lee en flujo y se procesa por lotes: cada lote resuelve usuarios,
+registros y detalles con una consulta por tabla, escribe con bulk_create y
+calculos.actualizar_en_bloque y recalcula la huella de los registros
+afectados con el motor vectorizado, todo en una transacción. Las filas inválidas no detienen la
+importación: se cuentan y, si se indica, se escriben en un archivo de rechazos.
+"""
+
+import csv
+import datetime
+import json
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .calculos import (
+    CAMPOS_ENERGIA, CAMPOS_TRANSPORTE, actualizar_en_bloque, aplicar_efectos_registros, recalcular_huellas
+)
+from .estadisticas import estado_registro
+from .models import Usuario, RegistroHuellaCarbono, DetalleEnergia, DetalleTransporte
+
+TAMANO_LOTE_IMPORTACION = 1000
+
+FORMATOS = ('csv', 'ndjson')
+
+# Modelo de detalle y campos importables
+DETALLES_IMPORTABLES = (
+    (DetalleEnergia, CAMPOS_ENERGIA),
+    (DetalleTransporte, CAMPOS_TRANSPORTE),
+)
+
+
+class FormatoInvalido(ValueError):
+    pass
+
+
+def formato_de_archivo(nombre):
+    # Formato según la extensión del archivo, o None si no se reconoce
+    extension = nombre.rsplit('.', 1)[-1].lower() if '.' in nombre else ''
+    if extension in ('ndjson', 'jsonl'):
+        return 'ndjson'
+    if extension == 'csv':
+        return 'csv'
+    return None
+
+
+def leer_filas(archivo, formato):
+    """
+    Genera tuplas (numero_linea, fila) leyendo el archivo de texto en flujo.
+    Las líneas de NDJSON que no son un objeto JSON se generan con fila None.
+    """
+    if formato == 'csv':
+        lector = csv.DictReader(archivo)
+        if lector.fieldnames is None:
+            return
+        for fila in lector:
+            yield lector.line_num, fila
+    elif formato == 'ndjson':
+        for numero, linea in enumerate(archivo, start=1):
+            if not linea.strip():
+                continue
+            try:
+                fila = json.loads(linea)
+            except ValueError:
+                fila = None
+            yield numero, fila if isinstance(fila, dict) else None
+    else:
+        raise FormatoInvalido(f"Formato desconocido: {formato}. Use uno de: {', '.join(FORMATOS)}")
+
+
+def _vacio(valor):
+    return valor is None or (isinstance(valor, str) and not valor.strip())
+
+
+def validar_fila(fila):
+    """
+    Valida una fila contra los campos de los modelos de detalle.
+
+    Devuelve (usuario, fecha, valores) donde usuario es ('id', n) o
+    ('username', texto) y valores asocia cada modelo con los campos de la fila
+    ya convertidos. Lanza ValidationError con los errores por campo.
+    """
+    if fila is None:
+        raise ValidationError("La línea no es un objeto JSON")
+
+    errores = {}
+    usuario = None
+    if not _vacio(fila.get('usuario_id')):
+        try:
+            usuario = ('id', int(fila['usuario_id']))
+        except (TypeError, ValueError):
+            errores['usuario_id'] = ["Debe ser un número entero"]
+    elif not _vacio(fila.get('usuario')):
+        usuario = ('username', str(fila['usuario']).strip())
+    else:
+        errores['usuario'] = ["Debe indicar usuario o usuario_id"]
+
+    fecha = None
+    try:
+        fecha = datetime.date.fromisoformat(str(fila.get('fecha') or '').strip())
+    except ValueError:
+        errores['fecha'] = ["Debe tener el formato AAAA-MM-DD"]
+
+    valores = {}
+    for modelo, campos in DETALLES_IMPORTABLES:
+        for campo in campos:
+            valor = fila.get(campo)
+            if _vacio(valor):
+                continue
+            try:
+                valores.setdefault(modelo, {})[campo] = modelo._meta.get_field(campo).clean(valor, None)
+            except ValidationError as e:
+                errores[campo] = e.messages
+
+    if not errores and not valores:
+        errores['__all__'] = ["La fila no contiene ningún campo de energía ni de transporte"]
+    if errores:
+        raise ValidationError(errores)
+    return usuario, fecha, valores
+
+
+def _resolver_usuarios(claves):
+    ids = {valor for tipo, valor in claves if tipo == 'id'}
+    nombres = {valor for tipo, valor in claves if tipo == 'username'}
+    resueltos = {}
+    if ids:
+        resueltos.update({('id', pk): pk for pk in Usuario.objects.filter(id__in=ids).values_list('id', flat=True)})
+    if nombres:
+        resueltos.update({
+            ('username', username): pk
+            for pk, username in Usuario.objects.filter(username__in=nombres).values_list('id', 'username')
+        })
+    return resueltos
+
+
+def _registros_por_dia(pares):
+    """
+    Asocia cada (usuario_id, fecha) con su registro de huella de ese día,
+    creando los que faltan. Si un usuario tiene varios registros el mismo
+    día se usa el más reciente.
+    """
+    usuarios = {usuario_id for usuario_id, _ in pares}
+    dias = {fecha for _, fecha in pares}
+    existentes = (
+        RegistroHuellaCarbono.objects.filter(usuario_id__in=usuarios, fecha__date__in=dias)
+        .annotate(dia=TruncDate('fecha'))
+        .order_by('id')
+        .values_list('usuario_id', 'dia', 'id')
+    )
+    registros = {}
+    for usuario_id, dia, registro_id in existentes:
+        if (usuario_id, dia) in pares:
+            registros[(usuario_id, dia)] = registro_id
+
+    faltantes = sorted(pares - registros.keys())
+    if faltantes:
+        zona = timezone.get_current_timezone()
+        nuevos = [
+            RegistroHuellaCarbono(
+                usuario_id=usuario_id,
+                fecha=timezone.make_aware(datetime.datetime.combine(fecha, datetime.time.min), zona)
+            )
+            for usuario_id, fecha in faltantes
+        ]
+        RegistroHuellaCarbono.objects.bulk_create(nuevos)
+        registros.update({par: registro.id for par, registro in zip(faltantes, nuevos)})
+
+        # Los registros nuevos entran en los histogramas y en los resúmenes
+        # mensuales con huella 0; el recálculo posterior (importar_lote) los
+        # mueve a su valor y reconstruye las estadísticas de sus usuarios
+        aplicar_efectos_registros({}, {registro.id: estado_registro(registro) for registro in nuevos}, estadisticas=False)
+    return registros
+
+
+def _guardar_detalles(modelo, valores_por_registro):
+    # Crea o actualiza los detalles de un modelo; una consulta y una escritura por tipo
+    existentes = {
+        detalle.registro_huella_id: detalle
+        for detalle in modelo.objects.filter(registro_huella_id__in=list(valores_por_registro))
+    }
+    nuevos = []
+    modificados = []
+    campos = set()
+    for registro_id, valores in valores_por_registro.items():
+        detalle = existentes.get(registro_id)
+        if detalle is None:
+            nuevos.append(modelo(registro_huella_id=registro_id, **valores))
+            continue
+        for campo, valor in valores.items():
+            setattr(detalle, campo, valor)
+        campos.update(valores)
+        modificados.append(detalle)
+
+    if nuevos:
+        modelo.objects.bulk_create(nuevos)
+    if modificados:
+        actualizar_en_bloque(modelo, modificados, sorted(campos))
+
+
+def importar_lote(filas):
+    """
+    Aplica un lote de filas ya validadas, dadas como (numero_linea, fila,
+    (usuario, fecha, valores)). Devuelve (importadas, rechazos), con los
+    rechazos de usuarios inexistentes como (numero_linea, fila, errores).
+    """
+    usuarios = _resolver_usuarios({usuario for _, _, (usuario, _, _) in filas})
+
+    rechazos = []
+    # (usuario_id, fecha) -> modelo -> valores; las filas posteriores prevalecen
+    cambios = {}
+    importadas = 0
+    for numero, fila, (usuario, fecha, valores) in filas:
+        usuario_id = usuarios.get(usuario)
+        if usuario_id is None:
+            rechazos.append((numero, fila, {'usuario': [f"No existe el usuario {usuario[1]}"]}))
+            continue
+        por_modelo = cambios.setdefault((usuario_id, fecha), {})
+        for modelo, campos in valores.items():
+            por_modelo.setdefault(modelo, {}).update(campos)
+        importadas += 1
+
+    if not cambios:
+        return importadas, rechazos
+
+    with transaction.atomic():
+        registros = _registros_por_dia(set(cambios))
+        for modelo, _ in DETALLES_IMPORTABLES:
+            valores_por_registro = {
+                registros[par]: por_modelo[modelo]
+                for par, por_modelo in cambios.items() if modelo in por_modelo
+            }
+            if valores_por_registro:
+                _guardar_detalles(modelo, valores_por_registro)
+
+        recalcular_huellas(RegistroHuellaCarbono.objects.filter(id__in=sorted(registros.values())))
+
+    return importadas, rechazos
+
+
+def importar_actividad(archivo, formato, tamano_lote=TAMANO_LOTE_IMPORTACION, rechazos=None, al_avanzar=None):
+    """
+    Importa un archivo de texto abierto en el formato indicado ('csv' o 'ndjson').
+
+    ``rechazos``, si se indica, es un archivo de texto donde se escribe una
+    línea NDJSON por fila rechazada con su número de línea y sus errores.
+    ``al_avanzar`` recibe el resumen tras cada lote. Devuelve el resumen con
+    las filas leídas, importadas y rechazadas.
+    """
+    resumen = {'leidas': 0, 'importadas': 0, 'rechazadas': 0}
+
+    def rechazar(numero, fila, errores):
+        resumen['rechazadas'] += 1
+        if rechazos is not None:
+            rechazos.write(json.dumps({'linea': numero, 'errores': errores, 'fila': fila}, ensure_ascii=False, default=str) + '\n')
+
+    def procesar(lote):
+        importadas, rechazadas = importar_lote(lote)
+        resumen['importadas'] += importadas
+        for rechazo in rechazadas:
+            rechazar(*rechazo)
+        if al_avanzar:
+            al_avanzar(dict(resumen))
+
+    lote = []
+    for numero, fila in leer_filas(archivo, formato):
+        resumen['leidas'] += 1
+        try:
+            lote.append((numero, fila, validar_fila(fila)))
+        except ValidationError as e:
+            rechazar(numero, fila, e.message_dict if hasattr(e, 'error_dict') else {'__all__': e.messages})
+        if len(lote) >= tamano_lote:
+            procesar(lote)
+            lote = []
+    if lote:
+        procesar(lote)
+
+    return resumen
+
+
+class MuestraRechazos:
+    """
+    Destino de rechazos que conserva solo los ``limite`` primeros, ya
+    decodificados, para devolverlos en una respuesta sin acumular el resto.
+    """
+
+    def __init__(self, limite):
+        self.limite = limite
+        self.rechazos = []
+
+    def write(self, linea):
+        if len(self.rechazos) < self.limite:
+            self.rechazos.append(json.loads(linea))
@@ -0,0 +1,219 @@
+"""
+Bandas de incertidumbre de la huella de carbono por simulación de Monte Carlo.
+
+Los factores con distribución (FactorEmision.distribucion e incertidumbre) se
+muestrean como valor × multiplicador, con multiplicadores de media 1. Cada
+muestra evalúa las fórmulas vectorizadas de calculos, y de las muestras se
+obtienen los percentiles de huella_total y de cada categoría.
+
+Las muestras estándar (normales y uniformes) se generan una sola vez por
+clave de factor y se reutilizan para todos los registros de una misma
+simulación, de modo que el resultado con una semilla dada no depende del
+tamaño de los lotes.
+"""
+
+import math
+
+import numpy as np
+from django.db.models.functions import TruncDate
+
+from .calculos import DETALLES, CAMPOS_HUELLA, TAMANO_LOTE, calcular_huellas, cargar_columnas
+from .factores import FACTORES_PREDETERMINADOS, registro_factores
+
+PERCENTILES = (5, 50, 95)
+MUESTRAS_POR_DEFECTO = 2000
+MAX_MUESTRAS = 20000
+
+# Máximo de registros × muestras evaluados en una sola pasada
+MAX_ELEMENTOS = 250000
+
+DISTRIBUCIONES = ('NORMAL', 'LOGNORMAL', 'TRIANGULAR', 'UNIFORME')
+
+
+class DistribucionInvalida(ValueError):
+    pass
+
+
+def validar_distribuciones(distribuciones):
+    """
+    Convierte {clave: {"distribucion": ..., "incertidumbre": ...}} en
+    {clave: (distribucion, incertidumbre)}. Una distribución vacía deja la
+    clave como estimación puntual.
+    """
+    if not isinstance(distribuciones, dict):
+        raise DistribucionInvalida("Las distribuciones deben ser un objeto clave -> distribución")
+
+    resultado = {}
+    for clave, definicion in distribuciones.items():
+        if clave not in FACTORES_PREDETERMINADOS:
+            raise DistribucionInvalida(f"Factor desconocido: {clave}")
+        if not isinstance(definicion, dict):
+            raise DistribucionInvalida(f"La distribución de {clave} debe ser un objeto")
+
+        distribucion = definicion.get('distribucion') or ''
+        incertidumbre = definicion.get('incertidumbre', 0)
+        if distribucion and distribucion not in DISTRIBUCIONES:
+            raise DistribucionInvalida(f"Distribución desconocida para {clave}: {distribucion}")
+        if (not isinstance(incertidumbre, (int, float)) or isinstance(incertidumbre, bool)
+                or not math.isfinite(incertidumbre) or incertidumbre < 0):
+            raise DistribucionInvalida(f"La incertidumbre de {clave} debe ser un número mayor o igual a 0")
+        resultado[clave] = (distribucion, float(incertidumbre)) if distribucion else None
+    return resultado
+
+
+def muestras_estandar(claves, muestras, rng):
+    # Una normal y una uniforme por clave y muestra, en orden fijo de claves
+    return {
+        clave: (rng.standard_normal(muestras), rng.random(muestras))
+        for clave in sorted(claves)
+    }
+
+
+def multiplicadores(distribucion, incertidumbre, normales, uniformes):
+    """
+    Multiplicadores de media 1 del valor de un factor. Las distribuciones
+    simétricas se truncan en 0, porque un factor de emisión no es negativo.
+    """
+    if distribucion == 'NORMAL':
+        return np.maximum(0, 1 + incertidumbre * normales)
+    if distribucion == 'LOGNORMAL':
+        sigma = math.sqrt(math.log1p(incertidumbre ** 2))
+        return np.exp(sigma * normales - sigma ** 2 / 2)
+    if distribucion == 'TRIANGULAR':
+        # Inversa de la distribución triangular simétrica en [-1, 1]
+        triangular = np.where(uniformes < 0.5, np.sqrt(2 * uniformes) - 1, 1 - np.sqrt(2 * (1 - uniformes)))
+        return np.maximum(0, 1 + incertidumbre * triangular)
+    if distribucion == 'UNIFORME':
+        return np.maximum(0, 1 + incertidumbre * (2 * uniformes - 1))
+    return np.ones(len(normales))
+
+
+def simular(columnas, reduccion_por_reciclaje, factores, distribuciones, estandar):
+    """
+    Percentiles de huella para un grupo de registros que comparten factores.
+
+    ``columnas`` y ``reduccion_por_reciclaje`` son las de calculos.calcular_huellas
+    para g registros; ``estandar`` son las muestras de muestras_estandar. Devuelve
+    por cada campo de CAMPOS_HUELLA un arreglo (g, len(PERCENTILES)).
+    """
+    g = len(reduccion_por_reciclaje)
+    muestras = len(next(iter(estandar.values()))[0])
+
+    factores_muestreados = dict(factores)
+    for clave, (distribucion, incertidumbre) in distribuciones.items():
+        if clave in estandar:
+            valores = factores[clave] * multiplicadores(distribucion, incertidumbre, *estandar[clave])
+            factores_muestreados[clave] = np.tile(valores, g)
+
+    # Una fila por registro y muestra: el registro i ocupa [i * muestras, (i + 1) * muestras)
+    columnas_expandidas = {
+        categoria: {campo: np.repeat(valores, muestras) for campo, valores in campos.items()}
+        for categoria, campos in columnas.items()
+    }
+    huellas = calcular_huellas(
+        columnas_expandidas, np.repeat(reduccion_por_reciclaje, muestras), factores_muestreados
+    )
+    return {
+        campo: np.percentile(huellas[campo].reshape(g, muestras), PERCENTILES, axis=1).T
+        for campo in CAMPOS_HUELLA
+    }
+
+
+def formatear_bandas(percentiles):
+    # {campo: {"p5": ..., "p50": ..., "p95": ...}} para un registro
+    return {
+        campo: {f'p{p}': float(valor) for p, valor in zip(PERCENTILES, valores)}
+        for campo, valores in percentiles.items()
+    }
+
+
+def bandas_registro(registro, muestras=MUESTRAS_POR_DEFECTO, semilla=None, distribuciones=None):
+    """
+    Bandas de incertidumbre de un registro guardado. ``distribuciones``
+    (validadas con validar_distribuciones) sustituyen a las de la tabla para
+    las claves indicadas.
+    """
+    usuario = registro.usuario
+    factores = registro_factores.factores(usuario.region, usuario.pais, registro.fecha)
+    vigentes = dict(registro_factores.distribuciones(usuario.region, usuario.pais, registro.fecha))
+    for clave, distribucion in (distribuciones or {}).items():
+        if distribucion is None:
+            vigentes.pop(clave, None)
+        else:
+            vigentes[clave] = distribucion
+
+    registro_ids = np.array([registro.id], dtype=np.int64)
+    columnas = {
+        categoria: cargar_columnas(modelo, campos, registro_ids)
+        for categoria, modelo, campos in DETALLES
+    }
+    # Mismas muestras estándar que bandas_registros: con la misma semilla, el
+    # registro obtiene las mismas bandas en la API y en los informes
+    estandar = muestras_estandar(FACTORES_PREDETERMINADOS, muestras, np.random.default_rng(semilla))
+    percentiles = simular(
+        columnas, np.array([registro.reduccion_por_reciclaje], dtype=float), factores, vigentes, estandar
+    )
+    return {
+        'muestras': muestras,
+        'semilla': semilla,
+        'distribuciones': {clave: {'distribucion': d, 'incertidumbre': i} for clave, (d, i) in sorted(vigentes.items())},
+        'bandas': formatear_bandas({campo: valores[0] for campo, valores in percentiles.items()}),
+    }
+
+
+def bandas_registros(queryset, muestras=MUESTRAS_POR_DEFECTO, semilla=None, tamano_lote=TAMANO_LOTE):
+    """
+    Bandas de incertidumbre de todos los registros del queryset, para informes.
+
+    Recorre los registros por id en lotes y, dentro de cada lote, simula
+    juntos los registros que comparten factores (misma región, país y tramo
+    temporal). Genera tuplas (registro_id, bandas) en orden de id.
+    """
+    rng = np.random.default_rng(semilla)
+    estandar = muestras_estandar(FACTORES_PREDETERMINADOS, muestras, rng)
+    por_pasada = max(1, MAX_ELEMENTOS // muestras)
+
+    queryset = queryset.annotate(dia=TruncDate('fecha')).order_by('id')
+    ultimo_id = 0
+    while True:
+        filas = list(
+            queryset.filter(id__gt=ultimo_id)
+            .values_list('id', 'reduccion_por_reciclaje', 'usuario__region', 'usuario__pais', 'dia')[:tamano_lote]
+        )
+        if not filas:
+            break
+        ultimo_id = filas[-1][0]
+
+        registro_ids = np.array([fila[0] for fila in filas], dtype=np.int64)
+        reduccion = np.array([fila[1] for fila in filas], dtype=float)
+        columnas = {
+            categoria: cargar_columnas(modelo, campos, registro_ids)
+            for categoria, modelo, campos in DETALLES
+        }
+
+        # Registros agrupados por (región, país, tramo de la línea de factores)
+        grupos = {}
+        for posicion, (_, _, region, pais, dia) in enumerate(filas):
+            par = (region or '', pais or '')
+            linea = registro_factores.linea_factores(*par)
+            tramo = int(np.searchsorted(linea.inicios, dia.toordinal(), side='right')) - 1
+            grupos.setdefault((par, tramo), []).append(posicion)
+
+        resultados = {}
+        for (par, tramo), posiciones in grupos.items():
+            factores = registro_factores.linea_factores(*par).valores[tramo]
+            distribuciones = registro_factores.linea_distribuciones(*par).valores[tramo]
+            for inicio in range(0, len(posiciones), por_pasada):
+                seleccion = np.array(posiciones[inicio:inicio + por_pasada], dtype=np.intp)
+                percentiles = simular(
+                    {
+                        categoria: {campo: valores[seleccion] for campo, valores in campos.items()}
+                        for categoria, campos in columnas.items()
+                    },
+                    reduccion[seleccion], factores, distribuciones, estandar
+                )
+                for fila, posicion in enumerate(seleccion.tolist()):
+                    resultados[posicion] = formatear_bandas({campo: valores[fila] for campo, valores in percentiles.items()})
+
+        for posicion, registro_id in enumerate(registro_ids.tolist()):
+            yield registro_id, resultados[posicion]
@@ -0,0 +1,53 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from miapp.importacion import importar_actividad, formato_de_archivo, FORMATOS, TAMANO_LOTE_IMPORTACION
+
+
+class Command(BaseCommand):
+    help = ('Importa datos de actividad de energía y transporte desde un archivo CSV o NDJSON, '
+            'por lotes y en flujo, y recalcula la huella de los registros afectados')
+
+    def add_arguments(self, parser):
+        parser.add_argument('archivo', help='Ruta del archivo CSV o NDJSON')
+        parser.add_argument('--formato', choices=FORMATOS,
+                            help='Formato del archivo (por defecto, según la extensión)')
+        parser.add_argument('--lote', type=int, default=TAMANO_LOTE_IMPORTACION,
+                            help='Número de filas por lote (por defecto %d)' % TAMANO_LOTE_IMPORTACION)
+        parser.add_argument('--rechazos',
+                            help='Archivo NDJSON donde escribir las filas rechazadas y sus errores')
+
+    def handle(self, *args, **options):
+        formato = options['formato'] or formato_de_archivo(options['archivo'])
+        if formato is None:
+            raise CommandError("No se reconoce el formato del archivo; indíquelo con --formato")
+
+        inicio = time.monotonic()
+
+        def al_avanzar(resumen):
+            velocidad = resumen['leidas'] / (time.monotonic() - inicio)
+            self.stdout.write(
+                f"  {resumen['leidas']} filas leídas, {resumen['importadas']} importadas, "
+                f"{resumen['rechazadas']} rechazadas ({velocidad:.0f} filas/s)"
+            )
+
+        rechazos = open(options['rechazos'], 'w', encoding='utf-8') if options['rechazos'] else None
+        try:
+            with open(options['archivo'], encoding='utf-8-sig', newline='') as archivo:
+                resumen = importar_actividad(
+                    archivo, formato, tamano_lote=options['lote'], rechazos=rechazos, al_avanzar=al_avanzar
+                )
+        except OSError as e:
+            raise CommandError(f"No se pudo leer {options['archivo']}: {e}")
+        finally:
+            if rechazos:
+                rechazos.close()
+
+        duracion = time.monotonic() - inicio
+        self.stdout.write(self.style.SUCCESS(
+            f"✅ {resumen['importadas']} filas importadas y {resumen['rechazadas']} rechazadas "
+            f"de {resumen['leidas']} en {duracion:.1f} s"
+        ))
+        if resumen['rechazadas'] and options['rechazos']:
+            self.stdout.write(f"Las filas rechazadas se escribieron en {options['rechazos']}")
@@ -0,0 +1,32 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from miapp.calculos import propagar_cambios_factores, TAMANO_LOTE
+
+
+class Command(BaseCommand):
+    help = (
+        'Recalcula los registros de huella afectados por los cambios de factores de emisión '
+        'pendientes. Si se interrumpe, volver a ejecutarlo continúa con los registros que faltan'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lote', type=int, default=TAMANO_LOTE,
+                            help='Número de registros por lote (por defecto %d)' % TAMANO_LOTE)
+
+    def handle(self, *args, **options):
+        inicio = time.monotonic()
+
+        def al_avanzar(procesados):
+            self.stdout.write(f"  {procesados} registros recalculados")
+
+        cambios, procesados = propagar_cambios_factores(tamano_lote=options['lote'], al_avanzar=al_avanzar)
+        if not cambios:
+            self.stdout.write("No hay cambios de factores pendientes")
+            return
+
+        duracion = time.monotonic() - inicio
+        self.stdout.write(self.style.SUCCESS(
+            f"✅ {cambios} cambios de factores propagados: {procesados} registros recalculados en {duracion:.1f} s"
+        ))
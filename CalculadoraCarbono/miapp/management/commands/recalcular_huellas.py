@@ -0,0 +1,36 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from miapp.calculos import recalcular_huellas, TAMANO_LOTE
+from miapp.models import RegistroHuellaCarbono
+
+
+class Command(BaseCommand):
+    help = 'Recalcula la huella de carbono de todos los registros con el motor vectorizado por lotes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lote', type=int, default=TAMANO_LOTE,
+                            help='Número de registros por lote (por defecto %d)' % TAMANO_LOTE)
+        parser.add_argument('--usuario', type=int, action='append',
+                            help='Limitar el recálculo a los registros de este usuario (se puede repetir)')
+
+    def handle(self, *args, **options):
+        queryset = RegistroHuellaCarbono.objects.all()
+        if options['usuario']:
+            queryset = queryset.filter(usuario_id__in=options['usuario'])
+
+        total = queryset.count()
+        self.stdout.write(f"Recalculando {total} registros en lotes de {options['lote']}...")
+        inicio = time.monotonic()
+
+        def al_avanzar(procesados):
+            self.stdout.write(f"  {procesados}/{total} registros")
+
+        procesados = recalcular_huellas(queryset, tamano_lote=options['lote'], al_avanzar=al_avanzar)
+
+        duracion = time.monotonic() - inicio
+        velocidad = procesados / duracion if duracion else 0
+        self.stdout.write(self.style.SUCCESS(
+            f"✅ {procesados} registros recalculados en {duracion:.1f} s ({velocidad:.0f} registros/s)"
+        ))
@@ -0,0 +1,205 @@
+import json
+import os
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.db.models import Count
+
+from miapp.calculos import recalcular_huellas, TAMANO_LOTE
+from miapp.clasificaciones import reconstruir_resumenes
+from miapp.models import RegistroHuellaCarbono
+from miapp.percentiles import reconstruir_histogramas
+
+
+def planear_fragmentos(registros_por_fragmento):
+    """
+    Reparte el espacio de usuario_id en rangos [inicio, fin] contiguos con
+    aproximadamente el mismo número de registros. Cada rango empieza en el fin
+    del anterior + 1 y el primero y el último no tienen límite (None), de modo
+    que al reanudar también se recalculan los usuarios que no tenían registros
+    cuando se hizo el plan.
+    """
+    conteos = (
+        RegistroHuellaCarbono.objects.values('usuario_id')
+        .annotate(registros=Count('id'))
+        .order_by('usuario_id')
+        .values_list('usuario_id', 'registros')
+    )
+
+    fragmentos = []
+    inicio = None
+    acumulado = 0
+    for usuario_id, registros in conteos:
+        acumulado += registros
+        if acumulado >= registros_por_fragmento:
+            fragmentos.append([inicio, usuario_id])
+            inicio = usuario_id + 1
+            acumulado = 0
+    fragmentos.append([inicio, None])
+    return fragmentos
+
+
+def describir_rango(usuario_inicio, usuario_fin):
+    if usuario_inicio is None and usuario_fin is None:
+        return 'todos los usuarios'
+    if usuario_inicio is None:
+        return f'usuarios hasta {usuario_fin}'
+    if usuario_fin is None:
+        return f'usuarios desde {usuario_inicio}'
+    return f'usuarios {usuario_inicio}-{usuario_fin}'
+
+
+def inicializar_proceso():
+    # Con el método "spawn" el proceso hijo no hereda Django configurado;
+    # con "fork" no debe reutilizar las conexiones del proceso padre
+    import django
+    django.setup()
+    connections.close_all()
+
+
+def recalcular_fragmento(indice, usuario_inicio, usuario_fin, tamano_lote):
+    # Histogramas y resúmenes mensuales son filas compartidas entre fragmentos:
+    # los procesos no los tocan y el proceso principal los reconstruye al final
+    inicio = time.monotonic()
+    queryset = RegistroHuellaCarbono.objects.all()
+    if usuario_inicio is not None:
+        queryset = queryset.filter(usuario_id__gte=usuario_inicio)
+    if usuario_fin is not None:
+        queryset = queryset.filter(usuario_id__lte=usuario_fin)
+    procesados = recalcular_huellas(queryset, tamano_lote=tamano_lote, actualizar_agregados=False)
+    return indice, procesados, time.monotonic() - inicio, os.getpid()
+
+
+class Command(BaseCommand):
+    help = ('Recalcula la huella de carbono en paralelo, repartiendo rangos de usuario_id entre procesos. '
+            'Los fragmentos terminados se guardan en un archivo de control para poder reanudar. '
+            'Los histogramas de percentiles y los resúmenes mensuales se reconstruyen al final.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--procesos', type=int, default=os.cpu_count() or 1,
+                            help='Número de procesos de trabajo (por defecto, uno por CPU)')
+        parser.add_argument('--registros-por-fragmento', type=int, default=50000,
+                            help='Tamaño aproximado de cada fragmento en registros')
+        parser.add_argument('--lote', type=int, default=TAMANO_LOTE,
+                            help='Número de registros por lote dentro de cada fragmento')
+        parser.add_argument('--checkpoint', default='recalculo_huellas.checkpoint.json',
+                            help='Archivo de control con el plan de fragmentos y los terminados')
+        parser.add_argument('--reiniciar', action='store_true',
+                            help='Descartar el archivo de control y empezar desde cero')
+
+    def handle(self, *args, **options):
+        ruta = options['checkpoint']
+        if options['reiniciar'] and os.path.exists(ruta):
+            os.remove(ruta)
+
+        estado = self.cargar_estado(ruta)
+        if estado is None:
+            estado = {
+                'fragmentos': planear_fragmentos(options['registros_por_fragmento']),
+                'completados': [],
+                'agregados_reconstruidos': False,
+            }
+            self.guardar_estado(ruta, estado)
+        else:
+            self.stdout.write(f"Reanudando desde {ruta}: {len(estado['completados'])}/{len(estado['fragmentos'])} fragmentos ya terminados")
+
+        completados = set(estado['completados'])
+        pendientes = [
+            (indice, inicio, fin) for indice, (inicio, fin) in enumerate(estado['fragmentos'])
+            if indice not in completados
+        ]
+        if not pendientes:
+            # Una ejecución anterior pudo terminar todos los fragmentos y cortarse antes de reconstruir
+            if not estado.get('agregados_reconstruidos', True):
+                self.reconstruir_agregados(ruta, estado)
+            self.stdout.write(self.style.SUCCESS("✅ No hay fragmentos pendientes"))
+            return
+
+        self.stdout.write(f"Recalculando {len(pendientes)} fragmentos con {options['procesos']} procesos...")
+
+        por_proceso = defaultdict(lambda: {'registros': 0, 'segundos': 0.0, 'fragmentos': 0})
+        fallidos = []
+        inicio = time.monotonic()
+
+        # Las conexiones abiertas no deben heredarse en los procesos hijos
+        connections.close_all()
+        with ProcessPoolExecutor(max_workers=options['procesos'], initializer=inicializar_proceso) as executor:
+            futuros = {
+                executor.submit(recalcular_fragmento, indice, usuario_inicio, usuario_fin, options['lote']): indice
+                for indice, usuario_inicio, usuario_fin in pendientes
+            }
+            for futuro in as_completed(futuros):
+                usuario_inicio, usuario_fin = estado['fragmentos'][futuros[futuro]]
+                try:
+                    indice, procesados, segundos, pid = futuro.result()
+                except Exception as e:
+                    # Los demás fragmentos siguen; este queda pendiente para la próxima ejecución
+                    fallidos.append((futuros[futuro], e))
+                    self.stderr.write(
+                        f"  Fragmento {futuros[futuro]} ({describir_rango(usuario_inicio, usuario_fin)}) falló: {e!r}"
+                    )
+                    continue
+
+                estado['completados'].append(indice)
+                estado['agregados_reconstruidos'] = False
+                self.guardar_estado(ruta, estado)
+
+                stats = por_proceso[pid]
+                stats['registros'] += procesados
+                stats['segundos'] += segundos
+                stats['fragmentos'] += 1
+
+                self.stdout.write(
+                    f"  Fragmento {indice} ({describir_rango(usuario_inicio, usuario_fin)}): "
+                    f"{procesados} registros en {segundos:.1f} s [proceso {pid}] "
+                    f"- {len(estado['completados'])}/{len(estado['fragmentos'])}"
+                )
+
+        # Con los registros ya escritos, histogramas y resúmenes se rehacen una sola vez
+        if not estado.get('agregados_reconstruidos'):
+            self.reconstruir_agregados(ruta, estado)
+
+        duracion = time.monotonic() - inicio
+        self.stdout.write("Rendimiento por proceso:")
+        for pid, stats in sorted(por_proceso.items()):
+            velocidad = stats['registros'] / stats['segundos'] if stats['segundos'] else 0
+            self.stdout.write(
+                f"  Proceso {pid}: {stats['fragmentos']} fragmentos, "
+                f"{stats['registros']} registros, {velocidad:.0f} registros/s"
+            )
+
+        total = sum(stats['registros'] for stats in por_proceso.values())
+        if fallidos:
+            raise CommandError(
+                f"{len(fallidos)} fragmentos fallaron ({', '.join(str(indice) for indice, _ in sorted(fallidos))}); "
+                f"{total} registros recalculados en {duracion:.1f} s. Vuelva a ejecutar el comando para reintentarlos."
+            )
+        self.stdout.write(self.style.SUCCESS(
+            f"✅ {total} registros recalculados en {duracion:.1f} s ({total / duracion if duracion else 0:.0f} registros/s)"
+        ))
+
+    def reconstruir_agregados(self, ruta, estado):
+        self.stdout.write("Reconstruyendo histogramas de percentiles y resúmenes mensuales...")
+        reconstruir_histogramas()
+        reconstruir_resumenes()
+        estado['agregados_reconstruidos'] = True
+        self.guardar_estado(ruta, estado)
+
+    def cargar_estado(self, ruta):
+        if not os.path.exists(ruta):
+            return None
+        try:
+            with open(ruta) as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            raise CommandError(f"No se pudo leer el archivo de control {ruta}: {e}")
+
+    def guardar_estado(self, ruta, estado):
+        # Escritura atómica: un corte a mitad de escritura no corrompe el archivo
+        temporal = ruta + '.tmp'
+        with open(temporal, 'w') as f:
+            json.dump(estado, f)
+        os.replace(temporal, ruta)
@@ -0,0 +1,35 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from miapp.estadisticas import recalcular_estadisticas, TAMANO_LOTE_ESTADISTICAS
+from miapp.models import Usuario
+
+
+class Command(BaseCommand):
+    help = ('Reconstruye desde los registros de huella las estadísticas por usuario '
+            '(número de registros, sumas, mínimo, máximo y último registro)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lote', type=int, default=TAMANO_LOTE_ESTADISTICAS,
+                            help='Número de usuarios por lote (por defecto %d)' % TAMANO_LOTE_ESTADISTICAS)
+        parser.add_argument('--usuario', type=int, action='append',
+                            help='Limitar la reconstrucción a este usuario (se puede repetir)')
+
+    def handle(self, *args, **options):
+        if options['usuario']:
+            usuario_ids = sorted(set(options['usuario']))
+        else:
+            usuario_ids = list(Usuario.objects.order_by('id').values_list('id', flat=True))
+
+        self.stdout.write(f"Reconstruyendo estadísticas de {len(usuario_ids)} usuarios en lotes de {options['lote']}...")
+        inicio = time.monotonic()
+        con_registros = 0
+        for posicion in range(0, len(usuario_ids), options['lote']):
+            con_registros += recalcular_estadisticas(usuario_ids[posicion:posicion + options['lote']])
+            self.stdout.write(f"  {min(posicion + options['lote'], len(usuario_ids))}/{len(usuario_ids)} usuarios")
+
+        duracion = time.monotonic() - inicio
+        self.stdout.write(self.style.SUCCESS(
+            f"✅ Estadísticas de {con_registros} usuarios con registros reconstruidas en {duracion:.1f} s"
+        ))
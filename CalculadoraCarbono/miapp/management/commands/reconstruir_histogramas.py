@@ -0,0 +1,30 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from miapp.percentiles import reconstruir_histogramas, TAMANO_LOTE_HISTOGRAMAS
+from miapp.models import EstadisticasUsuario
+
+
+class Command(BaseCommand):
+    help = ('Reconstruye desde las estadísticas de los usuarios los histogramas por país y región '
+            'usados para calcular percentiles')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lote', type=int, default=TAMANO_LOTE_HISTOGRAMAS,
+                            help='Número de usuarios por lote (por defecto %d)' % TAMANO_LOTE_HISTOGRAMAS)
+
+    def handle(self, *args, **options):
+        total = EstadisticasUsuario.objects.filter(numero_registros__gt=0).count()
+        self.stdout.write(f"Reconstruyendo histogramas con {total} usuarios en lotes de {options['lote']}...")
+        inicio = time.monotonic()
+
+        def al_avanzar(procesados):
+            self.stdout.write(f"  {procesados}/{total} usuarios")
+
+        procesados = reconstruir_histogramas(options['lote'], al_avanzar=al_avanzar)
+
+        duracion = time.monotonic() - inicio
+        self.stdout.write(self.style.SUCCESS(
+            f"✅ Histogramas reconstruidos con {procesados} usuarios en {duracion:.1f} s"
+        ))
@@ -0,0 +1,35 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from miapp.clasificaciones import refrescar_pendientes, reconstruir_resumenes
+from miapp.models import ParticionClasificacion
+
+
+class Command(BaseCommand):
+    help = ('Recalcula las posiciones de las clasificaciones mensuales pendientes. '
+            'Con --reconstruir vuelve a generar antes los resúmenes desde los registros.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reconstruir', action='store_true',
+                            help='Reconstruir los resúmenes mensuales desde los registros de huella y reciclaje')
+
+    def handle(self, *args, **options):
+        inicio = time.monotonic()
+        if options['reconstruir']:
+            resumenes = reconstruir_resumenes()
+            self.stdout.write(f"{resumenes} resúmenes mensuales reconstruidos")
+
+        total = ParticionClasificacion.objects.filter(pendiente=True).count()
+        self.stdout.write(f"Recalculando {total} particiones pendientes...")
+
+        def al_avanzar(refrescadas):
+            if refrescadas % 100 == 0 or refrescadas == total:
+                self.stdout.write(f"  {refrescadas}/{total} particiones")
+
+        refrescadas = refrescar_pendientes(al_avanzar=al_avanzar)
+
+        duracion = time.monotonic() - inicio
+        self.stdout.write(self.style.SUCCESS(
+            f"✅ {refrescadas} particiones recalculadas en {duracion:.1f} s"
+        ))
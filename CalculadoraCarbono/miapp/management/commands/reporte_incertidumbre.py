@@ -0,0 +1,50 @@
+import csv
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from miapp.calculos import CAMPOS_HUELLA, TAMANO_LOTE
+from miapp.incertidumbre import bandas_registros, MUESTRAS_POR_DEFECTO, MAX_MUESTRAS, PERCENTILES
+from miapp.models import RegistroHuellaCarbono
+
+
+class Command(BaseCommand):
+    help = ('Genera un CSV con las bandas de incertidumbre (Monte Carlo) de la huella de cada registro. '
+            'Con la misma semilla el informe es reproducible.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--muestras', type=int, default=MUESTRAS_POR_DEFECTO,
+                            help='Número de muestras por registro (por defecto %d)' % MUESTRAS_POR_DEFECTO)
+        parser.add_argument('--semilla', type=int, help='Semilla del generador aleatorio')
+        parser.add_argument('--lote', type=int, default=TAMANO_LOTE,
+                            help='Número de registros por lote (por defecto %d)' % TAMANO_LOTE)
+        parser.add_argument('--usuario', type=int, action='append',
+                            help='Limitar el informe a los registros de este usuario (se puede repetir)')
+        parser.add_argument('--salida', help='Archivo CSV de salida (por defecto, la salida estándar)')
+
+    def handle(self, *args, **options):
+        if not 1 <= options['muestras'] <= MAX_MUESTRAS:
+            raise CommandError(f"--muestras debe estar entre 1 y {MAX_MUESTRAS}")
+
+        queryset = RegistroHuellaCarbono.objects.all()
+        if options['usuario']:
+            queryset = queryset.filter(usuario_id__in=options['usuario'])
+
+        salida = open(options['salida'], 'w', newline='') if options['salida'] else self.stdout
+        inicio = time.monotonic()
+        procesados = 0
+        try:
+            escritor = csv.writer(salida, lineterminator='\n')
+            escritor.writerow(['registro_id'] + [f'{campo}_p{p}' for campo in CAMPOS_HUELLA for p in PERCENTILES])
+            for registro_id, bandas in bandas_registros(queryset, options['muestras'], options['semilla'], options['lote']):
+                escritor.writerow([registro_id] + [bandas[campo][f'p{p}'] for campo in CAMPOS_HUELLA for p in PERCENTILES])
+                procesados += 1
+        finally:
+            if options['salida']:
+                salida.close()
+
+        # El resumen va a stderr para no mezclarse con el CSV en la salida estándar
+        duracion = time.monotonic() - inicio
+        self.stderr.write(self.style.SUCCESS(
+            f"✅ Bandas de {procesados} registros con {options['muestras']} muestras en {duracion:.1f} s"
+        ))
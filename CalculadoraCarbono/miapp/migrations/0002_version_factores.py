@@ -0,0 +1,32 @@
+# Generated by Django 5.1.7 on 2026-10-18 01:18
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('miapp', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VersionFactores',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fecha', models.DateTimeField(default=django.utils.timezone.now)),
+                ('motivo', models.CharField(blank=True, max_length=255)),
+            ],
+            options={
+                'verbose_name': 'Versión de Factores',
+                'verbose_name_plural': 'Versiones de Factores',
+                'ordering': ['-id'],
+            },
+        ),
+        migrations.AddField(
+            model_name='registrohuellacarbono',
+            name='version_factores',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.1.7 on 2026-10-18 01:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('miapp', '0002_version_factores'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='factoremision',
+            name='vigente_desde',
+            field=models.DateField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='factoremision',
+            name='vigente_hasta',
+            field=models.DateField(blank=True, null=True),
+        ),
+    ]
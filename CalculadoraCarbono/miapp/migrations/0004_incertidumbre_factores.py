@@ -0,0 +1,23 @@
+# Generated by Django 5.1.7 on 2026-10-18 01:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('miapp', '0003_vigencia_factores'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='factoremision',
+            name='distribucion',
+            field=models.CharField(blank=True, choices=[('NORMAL', 'Normal'), ('LOGNORMAL', 'Lognormal'), ('TRIANGULAR', 'Triangular'), ('UNIFORME', 'Uniforme')], max_length=10),
+        ),
+        migrations.AddField(
+            model_name='factoremision',
+            name='incertidumbre',
+            field=models.FloatField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.1.7 on 2026-10-18 01:32
+
+import miapp.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('miapp', '0004_incertidumbre_factores'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='usuario',
+            name='zona_horaria',
+            field=models.CharField(blank=True, max_length=64, validators=[miapp.models.validar_zona_horaria]),
+        ),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 5.1.7 on 2026-10-18 01:38
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Max, Min, OuterRef, Subquery, Sum
+
+
+def poblar_estadisticas(apps, schema_editor):
+    # Estadísticas iniciales de los registros existentes; después se mantienen al guardar
+    RegistroHuellaCarbono = apps.get_model('miapp', 'RegistroHuellaCarbono')
+    EstadisticasUsuario = apps.get_model('miapp', 'EstadisticasUsuario')
+    campos = ('huella_total', 'huella_consumo', 'huella_transporte', 'huella_energia', 'huella_residuos', 'reduccion_por_reciclaje')
+    ultimos = RegistroHuellaCarbono.objects.filter(usuario_id=OuterRef('usuario_id')).order_by('-fecha', '-id')
+    filas = (
+        RegistroHuellaCarbono.objects.order_by()
+        .values('usuario_id')
+        .annotate(
+            numero_registros=Count('id'),
+            **{f'suma_{campo}': Sum(campo) for campo in campos},
+            huella_minima=Min('huella_total'),
+            huella_maxima=Max('huella_total'),
+            ultimo_registro_id=Subquery(ultimos.values('id')[:1]),
+            fecha_ultimo_registro=Subquery(ultimos.values('fecha')[:1])
+        )
+    )
+    EstadisticasUsuario.objects.bulk_create((EstadisticasUsuario(**fila) for fila in filas.iterator()), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('miapp', '0005_zona_horaria_usuario'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EstadisticasUsuario',
+            fields=[
+                ('usuario', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='estadisticas', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('numero_registros', models.PositiveIntegerField(default=0)),
+                ('suma_huella_total', models.FloatField(default=0)),
+                ('suma_huella_consumo', models.FloatField(default=0)),
+                ('suma_huella_transporte', models.FloatField(default=0)),
+                ('suma_huella_energia', models.FloatField(default=0)),
+                ('suma_huella_residuos', models.FloatField(default=0)),
+                ('suma_reduccion_por_reciclaje', models.FloatField(default=0)),
+                ('huella_minima', models.FloatField(blank=True, null=True)),
+                ('huella_maxima', models.FloatField(blank=True, null=True)),
+                ('fecha_ultimo_registro', models.DateTimeField(blank=True, null=True)),
+                ('ultimo_registro', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='miapp.registrohuellacarbono')),
+            ],
+            options={
+                'verbose_name': 'Estadísticas de Usuario',
+                'verbose_name_plural': 'Estadísticas de Usuarios',
+            },
+        ),
+        migrations.RunPython(poblar_estadisticas, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 5.1.7 on 2026-10-18 01:40
+
+from collections import Counter
+
+from django.db import migrations, models
+
+
+def poblar_histogramas(apps, schema_editor):
+    # Histogramas iniciales de los registros existentes; después se mantienen al guardar
+    from miapp.percentiles import CAMPOS_PERCENTIL, ambitos, indice
+
+    RegistroHuellaCarbono = apps.get_model('miapp', 'RegistroHuellaCarbono')
+    HistogramaHuella = apps.get_model('miapp', 'HistogramaHuella')
+    conteos = Counter()
+    filas = RegistroHuellaCarbono.objects.values_list('usuario__pais', 'usuario__region', *CAMPOS_PERCENTIL)
+    for pais, region, *valores in filas.iterator(chunk_size=5000):
+        for ambito in ambitos(pais, region):
+            for campo, valor in zip(CAMPOS_PERCENTIL, valores):
+                conteos[(*ambito, campo, indice(valor))] += 1
+    HistogramaHuella.objects.bulk_create(
+        [
+            HistogramaHuella(pais=pais, region=region, campo=campo, indice=i, conteo=conteo)
+            for (pais, region, campo, i), conteo in conteos.items()
+        ],
+        batch_size=1000
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('miapp', '0006_estadisticas_usuario'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HistogramaHuella',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('pais', models.CharField(max_length=100)),
+                ('region', models.CharField(blank=True, max_length=100)),
+                ('campo', models.CharField(max_length=30)),
+                ('indice', models.PositiveSmallIntegerField()),
+                ('conteo', models.IntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'Contenedor de Histograma de Huella',
+                'verbose_name_plural': 'Contenedores de Histogramas de Huella',
+                'unique_together': {('pais', 'region', 'campo', 'indice')},
+            },
+        ),
+        migrations.RunPython(poblar_histogramas, migrations.RunPython.noop),
+    ]
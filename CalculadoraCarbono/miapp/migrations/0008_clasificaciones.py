@@ -0,0 +1,115 @@
+# Generated by Django 5.1.7 on 2026-10-18 01:44
+
+import datetime
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncMonth
+
+
+def poblar_resumenes(apps, schema_editor):
+    # Resúmenes mensuales de los datos existentes; las posiciones se calculan
+    # al consultar cada partición, que queda pendiente
+    Usuario = apps.get_model('miapp', 'Usuario')
+    RegistroHuellaCarbono = apps.get_model('miapp', 'RegistroHuellaCarbono')
+    RegistroReciclaje = apps.get_model('miapp', 'RegistroReciclaje')
+    ResumenMensualUsuario = apps.get_model('miapp', 'ResumenMensualUsuario')
+    ParticionClasificacion = apps.get_model('miapp', 'ParticionClasificacion')
+
+    totales = {}
+    huellas = (
+        RegistroHuellaCarbono.objects.annotate(mes=TruncMonth('fecha')).order_by()
+        .values('usuario_id', 'mes').annotate(registros=Count('id'), suma=Sum('huella_total'))
+        .values_list('usuario_id', 'mes', 'registros', 'suma')
+    )
+    for usuario_id, mes, registros, suma in huellas:
+        totales[(usuario_id, mes.date())] = [registros, suma or 0.0, 0.0]
+    reciclaje = (
+        RegistroReciclaje.objects.annotate(mes=TruncMonth('fecha')).order_by()
+        .values('usuario_id', 'mes').annotate(kg=Sum('kg_total_reciclado'))
+        .values_list('usuario_id', 'mes', 'kg')
+    )
+    for usuario_id, mes, kg in reciclaje:
+        totales.setdefault((usuario_id, mes.date()), [0, 0.0, 0.0])[2] = kg or 0.0
+
+    ubicaciones = {usuario_id: (pais, region) for usuario_id, pais, region in Usuario.objects.values_list('id', 'pais', 'region')}
+    ResumenMensualUsuario.objects.bulk_create(
+        [
+            ResumenMensualUsuario(
+                usuario_id=usuario_id, mes=mes, pais=ubicaciones[usuario_id][0], region=ubicaciones[usuario_id][1],
+                numero_registros=registros, suma_huella_total=suma, kg_reciclados=kg
+            )
+            for (usuario_id, mes), (registros, suma, kg) in totales.items()
+        ],
+        batch_size=1000
+    )
+    particiones = set()
+    for usuario_id, mes in totales:
+        pais, region = ubicaciones[usuario_id]
+        siguiente = (mes.replace(day=28) + datetime.timedelta(days=4)).replace(day=1)
+        for fecha in (mes, siguiente):
+            if pais:
+                particiones.add((fecha, pais, ''))
+            if region:
+                particiones.add((fecha, pais, region))
+    ParticionClasificacion.objects.bulk_create(
+        [ParticionClasificacion(mes=mes, pais=pais, region=region) for mes, pais, region in particiones],
+        batch_size=1000
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('miapp', '0007_histogramas_huella'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ParticionClasificacion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('mes', models.DateField()),
+                ('pais', models.CharField(max_length=100)),
+                ('region', models.CharField(blank=True, max_length=100)),
+                ('pendiente', models.BooleanField(default=True)),
+                ('actualizada', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'verbose_name': 'Partición de Clasificación',
+                'verbose_name_plural': 'Particiones de Clasificación',
+                'indexes': [models.Index(fields=['pendiente', 'mes'], name='miapp_parti_pendien_ce09fe_idx')],
+                'unique_together': {('mes', 'pais', 'region')},
+            },
+        ),
+        migrations.CreateModel(
+            name='ResumenMensualUsuario',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('mes', models.DateField()),
+                ('pais', models.CharField(blank=True, max_length=100)),
+                ('region', models.CharField(blank=True, max_length=100)),
+                ('numero_registros', models.IntegerField(default=0)),
+                ('suma_huella_total', models.FloatField(default=0)),
+                ('kg_reciclados', models.FloatField(default=0)),
+                ('huella_promedio', models.FloatField(blank=True, null=True)),
+                ('mejora', models.FloatField(blank=True, null=True)),
+                ('posicion_huella_pais', models.PositiveIntegerField(blank=True, null=True)),
+                ('posicion_huella_region', models.PositiveIntegerField(blank=True, null=True)),
+                ('posicion_mejora_pais', models.PositiveIntegerField(blank=True, null=True)),
+                ('posicion_mejora_region', models.PositiveIntegerField(blank=True, null=True)),
+                ('posicion_reciclaje_pais', models.PositiveIntegerField(blank=True, null=True)),
+                ('posicion_reciclaje_region', models.PositiveIntegerField(blank=True, null=True)),
+                ('usuario', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='resumenes_mensuales', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Resumen Mensual de Usuario',
+                'verbose_name_plural': 'Resúmenes Mensuales de Usuarios',
+                'indexes': [models.Index(fields=['mes', 'pais', 'posicion_huella_pais'], name='miapp_resum_mes_071f39_idx'), models.Index(fields=['mes', 'pais', 'region', 'posicion_huella_region'], name='miapp_resum_mes_c6e340_idx'), models.Index(fields=['mes', 'pais', 'posicion_mejora_pais'], name='miapp_resum_mes_4e8572_idx'), models.Index(fields=['mes', 'pais', 'region', 'posicion_mejora_region'], name='miapp_resum_mes_2543ca_idx'), models.Index(fields=['mes', 'pais', 'posicion_reciclaje_pais'], name='miapp_resum_mes_f1ee8b_idx'), models.Index(fields=['mes', 'pais', 'region', 'posicion_reciclaje_region'], name='miapp_resum_mes_29fe29_idx')],
+                'unique_together': {('usuario', 'mes')},
+            },
+        ),
+        migrations.RunPython(poblar_resumenes, migrations.RunPython.noop),
+    ]
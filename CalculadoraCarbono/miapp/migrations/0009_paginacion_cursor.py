@@ -0,0 +1,25 @@
+# Generated by Django 5.1.7 on 2026-10-18 01:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('miapp', '0008_clasificaciones'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='recomendacionusuario',
+            index=models.Index(fields=['usuario', 'id'], name='miapp_recom_usuario_5b8ae4_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='registrohuellacarbono',
+            index=models.Index(fields=['usuario', '-fecha', '-id'], name='miapp_regis_usuario_d9423f_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='registroreciclaje',
+            index=models.Index(fields=['usuario', '-fecha', '-id'], name='miapp_regis_usuario_a1fe48_idx'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.1.7 on 2026-10-18 01:54
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('miapp', '0009_paginacion_cursor'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VersionDatosUsuario',
+            fields=[
+                ('usuario', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='version_datos', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('version', models.PositiveBigIntegerField(default=0)),
+                ('modificado', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'verbose_name': 'Versión de Datos de Usuario',
+                'verbose_name_plural': 'Versiones de Datos de Usuarios',
+            },
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.1.7 on 2026-10-18 02:14
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('miapp', '0011_version_catalogo'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CambioFactorPendiente',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('categoria', models.CharField(max_length=100)),
+                ('subcategoria', models.CharField(blank=True, max_length=100)),
+                ('region', models.CharField(blank=True, max_length=100)),
+                ('vigente_desde', models.DateField(blank=True, null=True)),
+                ('vigente_hasta', models.DateField(blank=True, null=True)),
+                ('version', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='cambios_pendientes', to='miapp.versionfactores')),
+            ],
+            options={
+                'verbose_name': 'Cambio de Factor Pendiente',
+                'verbose_name_plural': 'Cambios de Factores Pendientes',
+            },
+        ),
+    ]
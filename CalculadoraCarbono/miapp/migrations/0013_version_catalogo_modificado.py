@@ -0,0 +1,19 @@
+# Generated by Django 5.1.7 on 2026-10-18 02:21
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('miapp', '0012_cambios_factores_pendientes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='versioncatalogo',
+            name='modificado',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.1.7 on 2026-10-18 09:12
+
+from collections import Counter
+
+from django.db import migrations
+
+
+def histogramas_por_usuario(apps, schema_editor):
+    # Los histogramas pasan de contar registros a contar la huella media de cada usuario
+    from miapp.percentiles import CAMPOS_PERCENTIL, ambitos, indice
+
+    EstadisticasUsuario = apps.get_model('miapp', 'EstadisticasUsuario')
+    HistogramaHuella = apps.get_model('miapp', 'HistogramaHuella')
+    conteos = Counter()
+    filas = EstadisticasUsuario.objects.filter(numero_registros__gt=0).values_list(
+        'usuario__pais', 'usuario__region', 'numero_registros', *[f'suma_{campo}' for campo in CAMPOS_PERCENTIL]
+    )
+    for pais, region, numero, *sumas in filas.iterator(chunk_size=5000):
+        for ambito in ambitos(pais, region):
+            for campo, suma in zip(CAMPOS_PERCENTIL, sumas):
+                conteos[(*ambito, campo, indice(suma / numero))] += 1
+    HistogramaHuella.objects.all().delete()
+    HistogramaHuella.objects.bulk_create(
+        [
+            HistogramaHuella(pais=pais, region=region, campo=campo, indice=i, conteo=conteo)
+            for (pais, region, campo, i), conteo in conteos.items()
+        ],
+        batch_size=1000
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('miapp', '0013_version_catalogo_modificado'),
+    ]
+
+    operations = [
+        migrations.RunPython(histogramas_por_usuario, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.1.7 on 2026-10-18 03:00
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('miapp', '0014_histogramas_por_usuario'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cambiofactorpendiente',
+            name='usuario',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='cambios_factores_pendientes', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='cambiofactorpendiente',
+            name='categoria',
+            field=models.CharField(blank=True, max_length=100),
+        ),
+        migrations.AlterField(
+            model_name='cambiofactorpendiente',
+            name='version',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='cambios_pendientes', to='miapp.versionfactores'),
+        ),
+    ]
@@ -1,20 +1,33 @@
-from django.db import models
+import zoneinfo
+
+from django.db import models, transaction
 from django.contrib.auth.models import AbstractUser
+from django.core.exceptions import ValidationError
 from django.utils import timezone
 
+from .factores import CLAVES_CALEFACCION, SEMANAS_POR_MES, factores_para_usuario, obtener_factor_por_region
+
+def validar_zona_horaria(valor):
+    try:
+        zoneinfo.ZoneInfo(valor)
+    except (zoneinfo.ZoneInfoNotFoundError, ValueError):
+        raise ValidationError(f"Zona horaria desconocida: {valor}")
+
 # Model for User
 class Usuario(AbstractUser):
     nombre_completo = models.CharField(max_length=255, blank=True)
     fecha_registro = models.DateField(default=timezone.now)
     region = models.CharField(max_length=100, blank=True)
     pais = models.CharField(max_length=100, blank=True)
+    zona_horaria = models.CharField(max_length=64, blank=True, validators=[validar_zona_horaria])  # IANA; vacío = TIME_ZONE
+    
+    def obtener_zona_horaria(self):
+        return zoneinfo.ZoneInfo(self.zona_horaria) if self.zona_horaria else timezone.get_default_timezone()
     
     def obtener_huella_promedio(self):
-        registros = self.registrohuellacarbono_set.all()
-        if not registros:
-            return 0
-        total = sum(registro.huella_total for registro in registros)
-        return total / len(registros)
+        # EstadisticasUsuario se mantiene al guardar registros: una lectura por clave
+        estadisticas = EstadisticasUsuario.objects.filter(usuario=self).first()
+        return estadisticas.huella_promedio() if estadisticas else 0
     
     class Meta:
         verbose_name = 'Usuario'
@@ -30,6 +43,7 @@ class RegistroHuellaCarbono(models.Model):
     huella_energia = models.FloatField(default=0)
     huella_residuos = models.FloatField(default=0)
     reduccion_por_reciclaje = models.FloatField(default=0)
+    version_factores = models.PositiveIntegerField(default=0)  # VersionFactores usada en el cálculo (0 = desconocida)
     
     def calcular_huella_total(self):
         self.huella_total = (
@@ -47,20 +61,169 @@ class RegistroHuellaCarbono(models.Model):
         ).order_by('fecha')
     
     def comparar_con_promedio(self):
+        from .percentiles import CAMPOS_PERCENTIL, percentiles
+        
         promedio_usuario = self.usuario.obtener_huella_promedio()
+        ubicacion = (self.usuario.pais, self.usuario.region)
         return {
             'huella_actual': self.huella_total,
             'promedio_personal': promedio_usuario,
-            'diferencia': self.huella_total - promedio_usuario
+            'diferencia': self.huella_total - promedio_usuario,
+            'percentiles': percentiles(ubicacion, {campo: getattr(self, campo) for campo in CAMPOS_PERCENTIL})
         }
     
     class Meta:
         verbose_name = 'Registro de Huella de Carbono'
         verbose_name_plural = 'Registros de Huella de Carbono'
         ordering = ['-fecha']
+        indexes = [models.Index(fields=['usuario', '-fecha', '-id'])]  # RegistrosPaginacion
+
+# Model for User Statistics
+class EstadisticasUsuario(models.Model):
+    """
+    Agregados de los registros de huella de un usuario, mantenidos de forma
+    incremental por estadisticas.py y reconstruibles con el comando
+    reconstruir_estadisticas.
+    """
+    usuario = models.OneToOneField(Usuario, on_delete=models.CASCADE, primary_key=True, related_name='estadisticas')
+    numero_registros = models.PositiveIntegerField(default=0)
+    suma_huella_total = models.FloatField(default=0)
+    suma_huella_consumo = models.FloatField(default=0)
+    suma_huella_transporte = models.FloatField(default=0)
+    suma_huella_energia = models.FloatField(default=0)
+    suma_huella_residuos = models.FloatField(default=0)
+    suma_reduccion_por_reciclaje = models.FloatField(default=0)
+    huella_minima = models.FloatField(null=True, blank=True)
+    huella_maxima = models.FloatField(null=True, blank=True)
+    ultimo_registro = models.ForeignKey(RegistroHuellaCarbono, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    fecha_ultimo_registro = models.DateTimeField(null=True, blank=True)
+    
+    def huella_promedio(self):
+        if not self.numero_registros:
+            return 0
+        return self.suma_huella_total / self.numero_registros
+    
+    def __str__(self):
+        return f"Estadísticas de {self.usuario_id}"
+    
+    class Meta:
+        verbose_name = 'Estadísticas de Usuario'
+        verbose_name_plural = 'Estadísticas de Usuarios'
+
+# Model for User Data Version
+class VersionDatosUsuario(models.Model):
+    """
+    Contador que sube con cada escritura en la huella, el reciclaje o las
+    recomendaciones de un usuario. versiones.py lo usa para responder 304 a
+    las lecturas condicionales sin volver a consultar los datos.
+    """
+    usuario = models.OneToOneField(Usuario, on_delete=models.CASCADE, primary_key=True, related_name='version_datos')
+    version = models.PositiveBigIntegerField(default=0)
+    modificado = models.DateTimeField(default=timezone.now)
+    
+    def __str__(self):
+        return f"Versión {self.version} de {self.usuario_id}"
+    
+    class Meta:
+        verbose_name = 'Versión de Datos de Usuario'
+        verbose_name_plural = 'Versiones de Datos de Usuarios'
+
+# Model for Footprint Histogram
+class HistogramaHuella(models.Model):
+    """
+    Contenedor de un histograma de huella por país (region vacía) o por región
+    dentro de un país. Lo mantiene percentiles.py.
+    """
+    pais = models.CharField(max_length=100)
+    region = models.CharField(max_length=100, blank=True)
+    campo = models.CharField(max_length=30)  # huella_total o huella_<categoría>
+    indice = models.PositiveSmallIntegerField()  # contenedor logarítmico
+    conteo = models.IntegerField(default=0)
+    
+    def __str__(self):
+        return f"{self.pais}/{self.region} {self.campo}[{self.indice}] = {self.conteo}"
+    
+    class Meta:
+        verbose_name = 'Contenedor de Histograma de Huella'
+        verbose_name_plural = 'Contenedores de Histogramas de Huella'
+        unique_together = ('pais', 'region', 'campo', 'indice')
+
+# Model for Monthly User Summary
+class ResumenMensualUsuario(models.Model):
+    """
+    Totales de un usuario en un mes (en la zona horaria del proyecto) para las
+    clasificaciones. Los totales se mantienen de forma incremental y las
+    posiciones se recalculan por partición en clasificaciones.py.
+    """
+    usuario = models.ForeignKey(Usuario, on_delete=models.CASCADE, related_name='resumenes_mensuales')
+    mes = models.DateField()  # primer día del mes
+    pais = models.CharField(max_length=100, blank=True)
+    region = models.CharField(max_length=100, blank=True)
+    numero_registros = models.IntegerField(default=0)
+    suma_huella_total = models.FloatField(default=0)
+    kg_reciclados = models.FloatField(default=0)
+    huella_promedio = models.FloatField(null=True, blank=True)
+    mejora = models.FloatField(null=True, blank=True)  # huella promedio del mes anterior menos la de este mes
+    posicion_huella_pais = models.PositiveIntegerField(null=True, blank=True)
+    posicion_huella_region = models.PositiveIntegerField(null=True, blank=True)
+    posicion_mejora_pais = models.PositiveIntegerField(null=True, blank=True)
+    posicion_mejora_region = models.PositiveIntegerField(null=True, blank=True)
+    posicion_reciclaje_pais = models.PositiveIntegerField(null=True, blank=True)
+    posicion_reciclaje_region = models.PositiveIntegerField(null=True, blank=True)
+    
+    def __str__(self):
+        return f"{self.usuario_id} {self.mes:%Y-%m}"
+    
+    class Meta:
+        verbose_name = 'Resumen Mensual de Usuario'
+        verbose_name_plural = 'Resúmenes Mensuales de Usuarios'
+        unique_together = ('usuario', 'mes')
+        indexes = [
+            models.Index(fields=['mes', 'pais', 'posicion_huella_pais']),
+            models.Index(fields=['mes', 'pais', 'region', 'posicion_huella_region']),
+            models.Index(fields=['mes', 'pais', 'posicion_mejora_pais']),
+            models.Index(fields=['mes', 'pais', 'region', 'posicion_mejora_region']),
+            models.Index(fields=['mes', 'pais', 'posicion_reciclaje_pais']),
+            models.Index(fields=['mes', 'pais', 'region', 'posicion_reciclaje_region']),
+        ]
+
+# Model for Leaderboard Partition
+class ParticionClasificacion(models.Model):
+    """
+    Estado de las posiciones de un mes en un país (region vacía) o en una
+    región. ``pendiente`` indica que los totales cambiaron desde el último
+    cálculo de posiciones.
+    """
+    mes = models.DateField()
+    pais = models.CharField(max_length=100)
+    region = models.CharField(max_length=100, blank=True)
+    pendiente = models.BooleanField(default=True)
+    actualizada = models.DateTimeField(null=True, blank=True)
+    
+    def __str__(self):
+        return f"{self.mes:%Y-%m} {self.pais}/{self.region}"
+    
+    class Meta:
+        verbose_name = 'Partición de Clasificación'
+        verbose_name_plural = 'Particiones de Clasificación'
+        unique_together = ('mes', 'pais', 'region')
+        indexes = [models.Index(fields=['pendiente', 'mes'])]
+
+# Base for the Detalle* models
+class DetalleHuella(models.Model):
+    def obtener_factores(self):
+        # Factores de emisión vigentes en la fecha del registro, según la región
+        # y el país de su dueño
+        if self.registro_huella_id is None:
+            return factores_para_usuario(None)
+        registro = self.registro_huella
+        return factores_para_usuario(registro.usuario, registro.fecha)
+    
+    class Meta:
+        abstract = True
 
 # Model for Consumption Details
-class DetalleConsumo(models.Model):
+class DetalleConsumo(DetalleHuella):
     registro_huella = models.OneToOneField(RegistroHuellaCarbono, on_delete=models.CASCADE, related_name='detalle_consumo')
     consumo_carne_roja = models.FloatField(default=0)  # en kg/semana
     consumo_aves = models.FloatField(default=0)  # en kg/semana
@@ -72,37 +235,30 @@ class DetalleConsumo(models.Model):
     compras_electronicos = models.IntegerField(default=0)  # dispositivos/año
     compras_online = models.IntegerField(default=0)  # compras/mes
     
-    def calcular_emisiones_alimentacion(self):
-        # Valores de ejemplo para factores de emisión (kg CO2 por kg de alimento)
-        factor_carne_roja = 27.0
-        factor_aves = 6.9
-        factor_pescado = 5.4
-        factor_lacteos = 1.9
-        factor_frutas_verduras = 0.5
-        factor_importacion = 1.1  # multiplicador para alimentos importados
+    def calcular_emisiones_alimentacion(self, factores=None):
+        # Factores de emisión (kg CO2 por kg de alimento)
+        factores = factores or self.obtener_factores()
         
         emisiones_base = (
-            self.consumo_carne_roja * factor_carne_roja +
-            self.consumo_aves * factor_aves +
-            self.consumo_pescado * factor_pescado +
-            self.consumo_lacteos * factor_lacteos +
-            self.consumo_frutas_verduras * factor_frutas_verduras
+            self.consumo_carne_roja * factores['carne_roja'] +
+            self.consumo_aves * factores['aves'] +
+            self.consumo_pescado * factores['pescado'] +
+            self.consumo_lacteos * factores['lacteos'] +
+            self.consumo_frutas_verduras * factores['frutas_verduras']
         )
         
         # Ajustar por porcentaje de alimentos importados
-        factor_ajuste = 1 + (self.porcentaje_alimentos_importados / 100) * (factor_importacion - 1)
-        return emisiones_base * factor_ajuste * 4.35  # Convertir a mensual (4.35 semanas/mes)
+        factor_ajuste = 1 + (self.porcentaje_alimentos_importados / 100) * (factores['importacion'] - 1)
+        return emisiones_base * factor_ajuste * SEMANAS_POR_MES  # Convertir a mensual
     
-    def calcular_emisiones_compras(self):
+    def calcular_emisiones_compras(self, factores=None):
         # Factores de emisión para productos
-        factor_ropa = 20  # kg CO2 por prenda
-        factor_electronicos = 100  # kg CO2 por dispositivo
-        factor_compras_online = 5  # kg CO2 por compra (incluye envío)
+        factores = factores or self.obtener_factores()
         
         return (
-            self.compras_ropa_nuevas * factor_ropa +
-            self.compras_electronicos * factor_electronicos / 12 +  # Anualizar
-            self.compras_online * factor_compras_online
+            self.compras_ropa_nuevas * factores['ropa'] +
+            self.compras_electronicos * factores['electronicos'] / 12 +  # Anualizar
+            self.compras_online * factores['compras_online']
         )
     
     class Meta:
@@ -110,7 +266,7 @@ class DetalleConsumo(models.Model):
         verbose_name_plural = 'Detalles de Consumo'
 
 # Model for Transport Details
-class DetalleTransporte(models.Model):
+class DetalleTransporte(DetalleHuella):
     registro_huella = models.OneToOneField(RegistroHuellaCarbono, on_delete=models.CASCADE, related_name='detalle_transporte')
     km_vehiculo_gasolina = models.FloatField(default=0)  # km/mes
     km_vehiculo_diesel = models.FloatField(default=0)  # km/mes
@@ -122,40 +278,34 @@ class DetalleTransporte(models.Model):
     vuelos_medianos = models.IntegerField(default=0)  # número de vuelos 1000-3000km/año
     vuelos_largos = models.IntegerField(default=0)  # número de vuelos > 3000km/año
     
-    def calcular_emisiones_vehiculo_privado(self):
+    def calcular_emisiones_vehiculo_privado(self, factores=None):
         # Factores de emisión (kg CO2 por km)
-        factor_gasolina = 0.192
-        factor_diesel = 0.171
-        factor_hibrido = 0.106
-        factor_electrico = 0.053  # Depende del mix eléctrico
+        factores = factores or self.obtener_factores()
         
         return (
-            self.km_vehiculo_gasolina * factor_gasolina +
-            self.km_vehiculo_diesel * factor_diesel +
-            self.km_vehiculo_hibrido * factor_hibrido +
-            self.km_vehiculo_electrico * factor_electrico
+            self.km_vehiculo_gasolina * factores['gasolina'] +
+            self.km_vehiculo_diesel * factores['diesel'] +
+            self.km_vehiculo_hibrido * factores['hibrido'] +
+            self.km_vehiculo_electrico * factores['electrico']
         )
     
-    def calcular_emisiones_transporte_publico(self):
+    def calcular_emisiones_transporte_publico(self, factores=None):
         # Factores de emisión (kg CO2 por km por pasajero)
-        factor_autobus = 0.105
-        factor_tren_metro = 0.041
+        factores = factores or self.obtener_factores()
         
         return (
-            self.km_autobus * factor_autobus +
-            self.km_tren_metro * factor_tren_metro
+            self.km_autobus * factores['autobus'] +
+            self.km_tren_metro * factores['tren_metro']
         )
     
-    def calcular_emisiones_vuelos(self):
+    def calcular_emisiones_vuelos(self, factores=None):
         # Factores de emisión (kg CO2 por vuelo)
-        factor_vuelo_corto = 200  # Aproximadamente para vuelos < 1000km
-        factor_vuelo_mediano = 600  # Aproximadamente para vuelos 1000-3000km
-        factor_vuelo_largo = 1600  # Aproximadamente para vuelos > 3000km
+        factores = factores or self.obtener_factores()
         
         emision_anual = (
-            self.vuelos_cortos * factor_vuelo_corto +
-            self.vuelos_medianos * factor_vuelo_mediano +
-            self.vuelos_largos * factor_vuelo_largo
+            self.vuelos_cortos * factores['vuelo_corto'] +
+            self.vuelos_medianos * factores['vuelo_mediano'] +
+            self.vuelos_largos * factores['vuelo_largo']
         )
         
         # Convertir a mensual
@@ -166,7 +316,7 @@ class DetalleTransporte(models.Model):
         verbose_name_plural = 'Detalles de Transporte'
 
 # Model for Energy Details
-class DetalleEnergia(models.Model):
+class DetalleEnergia(DetalleHuella):
     TIPOS_CALEFACCION = [
         ('GAS', 'Gas Natural'),
         ('ELEC', 'Eléctrica'),
@@ -184,31 +334,29 @@ class DetalleEnergia(models.Model):
     tipo_calefaccion = models.CharField(max_length=10, choices=TIPOS_CALEFACCION, default='NOCALEF')
     consumo_calefaccion = models.FloatField(default=0)  # depende del tipo (kWh o m³)
     
-    def calcular_emisiones_electricidad(self):
+    def calcular_emisiones_electricidad(self, factores=None):
+        factores = factores or self.obtener_factores()
         # Factor de emisión estándar para electricidad (kg CO2 por kWh)
-        factor_electricidad = 0.31  # Depende del mix eléctrico del país
+        factor_electricidad = factores['electricidad']
         
         # Ajustar por porcentaje de energía renovable
         factor_ajustado = factor_electricidad * (1 - self.porcentaje_energia_renovable / 100)
         
         return self.consumo_electricidad_kwh * factor_ajustado
     
-    def calcular_emisiones_calefaccion(self):
-        # Factores de emisión para diferentes tipos de calefacción
-        factores = {
-            'GAS': 0.20,  # kg CO2 por kWh
-            'ELEC': 0.31,  # kg CO2 por kWh
-            'LEÑA': 0.02,  # kg CO2 por kWh
-            'GASOLEO': 0.27,  # kg CO2 por kWh
-            'BIOMASA': 0.01,  # kg CO2 por kWh
-            'NOCALEF': 0,  # Sin emisiones
-        }
+    def calcular_emisiones_calefaccion(self, factores=None):
+        factores = factores or self.obtener_factores()
+        # Factor de emisión según el tipo de calefacción (Sin Calefacción no emite)
+        clave = CLAVES_CALEFACCION.get(self.tipo_calefaccion)
+        if clave is None:
+            return 0
         
-        return self.consumo_calefaccion * factores.get(self.tipo_calefaccion, 0)
+        return self.consumo_calefaccion * factores[clave]
     
-    def calcular_emisiones_agua(self):
+    def calcular_emisiones_agua(self, factores=None):
+        factores = factores or self.obtener_factores()
         # Factor de emisión para tratamiento y distribución de agua (kg CO2 por m³)
-        factor_agua = 0.344
+        factor_agua = factores['agua']
         
         return self.consumo_agua_m3 * factor_agua
     
@@ -217,23 +365,25 @@ class DetalleEnergia(models.Model):
         verbose_name_plural = 'Detalles de Energía'
 
 # Model for Waste Details
-class DetalleResiduos(models.Model):
+class DetalleResiduos(DetalleHuella):
     registro_huella = models.OneToOneField(RegistroHuellaCarbono, on_delete=models.CASCADE, related_name='detalle_residuos')
     kg_residuos_totales = models.FloatField(default=0)  # kg/mes
     kg_compostaje = models.FloatField(default=0)  # kg/mes
     
-    def calcular_emisiones_residuos(self):
+    def calcular_emisiones_residuos(self, factores=None):
+        factores = factores or self.obtener_factores()
         # Factor de emisión para residuos (kg CO2 por kg de residuos)
-        factor_residuos = 0.58
+        factor_residuos = factores['residuos']
         
         # Calcular residuos netos (excluyendo compostaje)
         residuos_netos = max(0, self.kg_residuos_totales - self.kg_compostaje)
         
         return residuos_netos * factor_residuos
     
-    def calcular_reduccion_compostaje(self):
+    def calcular_reduccion_compostaje(self, factores=None):
+        factores = factores or self.obtener_factores()
         # Factor de reducción por compostaje (kg CO2 evitados por kg compostado)
-        factor_compostaje = 0.24
+        factor_compostaje = factores['compostaje']
         
         return self.kg_compostaje * factor_compostaje
     
@@ -262,6 +412,11 @@ class RegistroReciclaje(models.Model):
         self.reduccion_co2_total = total
         return total
     
+    def agregar_materiales(self, materiales):
+        # Ver calculos.agregar_materiales_reciclaje
+        from .calculos import agregar_materiales_reciclaje
+        return agregar_materiales_reciclaje(self, materiales)
+    
     def obtener_estadisticas_reciclaje(self):
         materiales = self.materialreciclable_set.all()
         estadisticas = {}
@@ -285,6 +440,7 @@ class RegistroReciclaje(models.Model):
         verbose_name = 'Registro de Reciclaje'
         verbose_name_plural = 'Registros de Reciclaje'
         ordering = ['-fecha']
+        indexes = [models.Index(fields=['usuario', '-fecha', '-id'])]  # RegistrosPaginacion
 
 # Model for Material
 class Material(models.Model):
@@ -344,6 +500,14 @@ class MaterialReciclable(models.Model):
 
 # Model for Emission Factor
 class FactorEmision(models.Model):
+    # Distribución del valor real alrededor de "valor"; vacío = estimación puntual
+    DISTRIBUCIONES = [
+        ('NORMAL', 'Normal'),
+        ('LOGNORMAL', 'Lognormal'),
+        ('TRIANGULAR', 'Triangular'),
+        ('UNIFORME', 'Uniforme')
+    ]
+    
     categoria = models.CharField(max_length=100)
     subcategoria = models.CharField(max_length=100, blank=True)
     descripcion = models.TextField(blank=True)
@@ -352,22 +516,43 @@ class FactorEmision(models.Model):
     region = models.CharField(max_length=100, blank=True)
     fecha_actualizacion = models.DateField(default=timezone.now)
     fuente = models.CharField(max_length=255, blank=True)
+    vigente_desde = models.DateField(null=True, blank=True)  # vacío = desde siempre
+    vigente_hasta = models.DateField(null=True, blank=True)  # excluido; vacío = sin fin
+    distribucion = models.CharField(max_length=10, choices=DISTRIBUCIONES, blank=True)
+    # Relativa al valor: coeficiente de variación (normal, lognormal) o
+    # semiamplitud (triangular, uniforme), p. ej. 0.2 = ±20%
+    incertidumbre = models.FloatField(null=True, blank=True)
+    
+    def clean(self):
+        if self.vigente_desde and self.vigente_hasta and self.vigente_hasta <= self.vigente_desde:
+            raise ValidationError({'vigente_hasta': 'La fecha de fin de vigencia debe ser posterior a la de inicio.'})
+        if self.distribucion and (self.incertidumbre is None or self.incertidumbre < 0):
+            raise ValidationError({'incertidumbre': 'Una distribución requiere una incertidumbre mayor o igual a 0.'})
+    
+    def crear_revision(self, valor, vigente_desde, **cambios):
+        # Cierra la vigencia de este factor y crea el que lo sustituye a partir de
+        # vigente_desde, de modo que los registros anteriores conservan su factor
+        campos = {
+            campo.name: getattr(self, campo.name)
+            for campo in self._meta.concrete_fields if not campo.primary_key
+        }
+        campos.update(
+            valor=valor, vigente_desde=vigente_desde, vigente_hasta=None,
+            fecha_actualizacion=timezone.localdate(), **cambios
+        )
+        
+        with transaction.atomic():
+            self.vigente_hasta = vigente_desde
+            self.save()
+            return FactorEmision.objects.create(**campos)
     
     @classmethod
-    def obtener_factor_por_region(cls, categoria, subcategoria=None, region=None):
-        query = cls.objects.filter(categoria=categoria)
-        
-        if subcategoria:
-            query = query.filter(subcategoria=subcategoria)
-        
-        if region:
-            query = query.filter(region=region)
-            if query.count() == 0:  # Si no hay factor específico para la región
-                query = cls.objects.filter(categoria=categoria, region='')  # Factor por defecto
-                if subcategoria:
-                    query = query.filter(subcategoria=subcategoria)
-        
-        return query.order_by('-fecha_actualizacion').first()
+    def obtener_factor_por_region(cls, categoria, subcategoria=None, region=None, fecha=None):
+        # Se resuelve con el índice temporal en memoria del registro de factores:
+        # el factor vigente en la fecha (hoy si no se indica) con la
+        # fecha_actualizacion más reciente, y el factor por defecto (region vacía)
+        # cuando no hay uno regional
+        return obtener_factor_por_region(categoria, subcategoria, region, fecha)
     
     def __str__(self):
         return f"{self.categoria} - {self.subcategoria} ({self.region}): {self.valor} {self.unidad}"
@@ -377,6 +562,70 @@ class FactorEmision(models.Model):
         verbose_name_plural = 'Factores de Emisión'
         ordering = ['-fecha_actualizacion']
 
+# Model for Emission Factor Version
+class VersionFactores(models.Model):
+    # Cada cambio en FactorEmision crea una versión nueva; los registros de huella
+    # guardan la versión con la que se calcularon
+    fecha = models.DateTimeField(default=timezone.now)
+    motivo = models.CharField(max_length=255, blank=True)
+    
+    def __str__(self):
+        return f"Versión {self.id} ({self.fecha:%Y-%m-%d %H:%M}): {self.motivo}"
+    
+    class Meta:
+        verbose_name = 'Versión de Factores'
+        verbose_name_plural = 'Versiones de Factores'
+        ordering = ['-id']
+
+# Model for Pending Factor Change
+class CambioFactorPendiente(models.Model):
+    """
+    Combinación de FactorEmision (categoría, subcategoría, región y vigencia)
+    que cambió y cuyos registros de huella dependientes aún no se han
+    recalculado, o usuario que cambió de país o región y cuyos registros deben
+    recalcularse con los factores de su nueva ubicación. Se crea en la misma
+    transacción que el cambio (signals.py) y la consume el comando
+    propagar_factores.
+    """
+    version = models.ForeignKey(
+        VersionFactores, on_delete=models.CASCADE, related_name='cambios_pendientes', null=True, blank=True
+    )
+    usuario = models.ForeignKey(
+        Usuario, on_delete=models.CASCADE, related_name='cambios_factores_pendientes', null=True, blank=True
+    )
+    categoria = models.CharField(max_length=100, blank=True)
+    subcategoria = models.CharField(max_length=100, blank=True)
+    region = models.CharField(max_length=100, blank=True)
+    vigente_desde = models.DateField(null=True, blank=True)
+    vigente_hasta = models.DateField(null=True, blank=True)
+    
+    def clave(self):
+        return self.categoria, self.subcategoria, self.region, self.vigente_desde, self.vigente_hasta
+    
+    def __str__(self):
+        if self.usuario_id is not None:
+            return f"Cambio de ubicación del usuario {self.usuario_id}"
+        return f"{self.categoria} - {self.subcategoria} ({self.region}) en la versión {self.version_id}"
+    
+    class Meta:
+        verbose_name = 'Cambio de Factor Pendiente'
+        verbose_name_plural = 'Cambios de Factores Pendientes'
+
+# Model for Catalog Version
+class VersionCatalogo(models.Model):
+    # Sube con cada cambio en el catálogo; catalogos.py la usa como sello de sus
+    # instantáneas (los factores de emisión usan VersionFactores)
+    catalogo = models.CharField(max_length=30, primary_key=True)
+    version = models.PositiveIntegerField(default=0)
+    modificado = models.DateTimeField(default=timezone.now)
+    
+    def __str__(self):
+        return f"{self.catalogo} v{self.version}"
+    
+    class Meta:
+        verbose_name = 'Versión de Catálogo'
+        verbose_name_plural = 'Versiones de Catálogos'
+
 # Model for Recommendation
 class Recomendacion(models.Model):
     CATEGORIAS = [
@@ -396,55 +645,16 @@ class Recomendacion(models.Model):
     
     @classmethod
     def obtener_recomendaciones_para_usuario(cls, usuario, limite=5):
-        # Obtener el último registro de huella de carbono
-        ultimo_registro = RegistroHuellaCarbono.objects.filter(usuario=usuario).order_by('-fecha').first()
-        
-        if not ultimo_registro:
-            return cls.objects.filter(categoria='GENERAL').order_by('-impacto_potencial')[:limite]
-        
-        # Identificar el área con mayor huella
-        emisiones = {
-            'CONSUMO': ultimo_registro.huella_consumo,
-            'TRANSPORTE': ultimo_registro.huella_transporte,
-            'ENERGIA': ultimo_registro.huella_energia,
-            'RESIDUOS': ultimo_registro.huella_residuos,
-            'RECICLAJE': -ultimo_registro.reduccion_por_reciclaje
-        }
-        
-        area_prioritaria = max(emisiones, key=emisiones.get)
-        
-        # Obtener recomendaciones personalizadas
-        recomendaciones_prioritarias = cls.objects.filter(categoria=area_prioritaria).order_by('-impacto_potencial')[:limite]
-        
-        # Si no hay suficientes recomendaciones específicas, añadir generales
-        if recomendaciones_prioritarias.count() < limite:
-            recomendaciones_generales = cls.objects.filter(categoria='GENERAL').order_by('-impacto_potencial')
-            return list(recomendaciones_prioritarias) + list(recomendaciones_generales[:limite - recomendaciones_prioritarias.count()])
-        
-        return recomendaciones_prioritarias
+        # Ranking de recomendador.py (sin las ya asignadas), en el mismo orden
+        from .recomendador import recomendar
+        ids = [fila['id'] for fila in recomendar(usuario, limite)]
+        encontradas = cls.objects.in_bulk(ids)
+        return [encontradas[pk] for pk in ids if pk in encontradas]
     
     def calcular_impacto_potencial_para_usuario(self, usuario):
-        # Implementación básica, se podría mejorar con datos reales del usuario
-        ultimo_registro = RegistroHuellaCarbono.objects.filter(usuario=usuario).order_by('-fecha').first()
-        
-        if not ultimo_registro:
-            return self.impacto_potencial
-        
-        # Ajustar el impacto potencial según la categoría y la huella del usuario
-        factor_ajuste = 1.0
-        
-        if self.categoria == 'CONSUMO':
-            factor_ajuste = min(2.0, max(0.5, ultimo_registro.huella_consumo / 100))
-        elif self.categoria == 'TRANSPORTE':
-            factor_ajuste = min(2.0, max(0.5, ultimo_registro.huella_transporte / 150))
-        elif self.categoria == 'ENERGIA':
-            factor_ajuste = min(2.0, max(0.5, ultimo_registro.huella_energia / 120))
-        elif self.categoria == 'RESIDUOS':
-            factor_ajuste = min(2.0, max(0.5, ultimo_registro.huella_residuos / 50))
-        elif self.categoria == 'RECICLAJE':
-            factor_ajuste = min(2.0, max(0.5, 30 / (ultimo_registro.reduccion_por_reciclaje + 1)))
-        
-        return self.impacto_potencial * factor_ajuste
+        # Ajuste según la categoría y la huella del último registro del usuario
+        from .recomendador import ajustes_por_categoria, huellas_recientes
+        return self.impacto_potencial * ajustes_por_categoria(huellas_recientes(usuario)).get(self.categoria, 1.0)
     
     def __str__(self):
         return f"{self.get_categoria_display()}: {self.descripcion[:50]}..."
@@ -497,3 +707,4 @@ class RecomendacionUsuario(models.Model):
         verbose_name = 'Recomendación de Usuario'
         verbose_name_plural = 'Recomendaciones de Usuario'
         unique_together = ('usuario', 'recomendacion')
+        indexes = [models.Index(fields=['usuario', 'id'])]  # PaginacionCursor
@@ -0,0 +1,22 @@
+from rest_framework.pagination import CursorPagination
+
+
+# Paginación por clave (cursor): el coste de cada página no depende de cuántas
+# haya antes, a diferencia de la paginación por desplazamiento. El orden debe
+# terminar en una columna única y tener un índice compuesto que lo sirva
+class PaginacionCursor(CursorPagination):
+    ordering = ('id',)
+    page_size = 50
+    page_size_query_param = 'limite'
+    max_page_size = 200
+
+
+# Registros de un usuario, del más reciente al más antiguo; índice (usuario, -fecha, -id)
+class RegistrosPaginacion(PaginacionCursor):
+    ordering = ('-fecha', '-id')
+
+
+# El histórico devuelve filas planas sin detalles, así que admite páginas mayores
+class HistoricoPaginacion(RegistrosPaginacion):
+    page_size = 100
+    max_page_size = 1000
@@ -0,0 +1,72 @@
+"""
+Instantánea del dashboard de cada usuario guardada en la caché de Django.
+
+El dashboard se construye una vez y se sirve desde la caché hasta que cambia
+alguno de los datos que muestra: las señales de signals.py y las rutas de
+escritura masiva (que no disparan señales) llaman a invalidar_paneles al
+confirmar la transacción. Los cambios globales (catálogo de recomendaciones o
+de materiales) invalidan todos los paneles a la vez subiendo una generación.
+"""
+
+from django.core.cache import cache
+from django.db import transaction
+
+from .models import RegistroHuellaCarbono, RegistroReciclaje
+from .precarga import optimizar_queryset
+from .recomendador import recomendar
+
+PREFIJO_PANEL = 'panel_usuario'
+CLAVE_GENERACION = 'panel_usuario:generacion'
+
+# Límite de vida de una instantánea aunque no se invalide, en segundos
+DURACION_PANEL = 60 * 60
+
+
+def clave_panel(usuario_id):
+    return f'{PREFIJO_PANEL}:{usuario_id}'
+
+
+def construir_panel(usuario):
+    # serializers y calculos importan este módulo para invalidar paneles
+    from .serializers import RegistroHuellaCarbonoSerializer, RegistroReciclajeSerializer
+
+    ultimo_registro = optimizar_queryset(
+        RegistroHuellaCarbono.objects.filter(usuario=usuario), RegistroHuellaCarbonoSerializer()
+    ).order_by('-fecha').first()
+    registros_reciclaje = optimizar_queryset(
+        RegistroReciclaje.objects.filter(usuario=usuario), RegistroReciclajeSerializer()
+    ).order_by('-fecha')[:5]
+
+    return {
+        'huella_carbono': RegistroHuellaCarbonoSerializer(ultimo_registro).data if ultimo_registro else None,
+        'reciclaje_reciente': RegistroReciclajeSerializer(registros_reciclaje, many=True).data,
+        'recomendaciones': recomendar(usuario)
+    }
+
+
+def obtener_panel(usuario):
+    # Una sola lectura de la caché trae la instantánea y la generación vigente
+    clave = clave_panel(usuario.id)
+    guardados = cache.get_many([clave, CLAVE_GENERACION])
+    generacion = guardados.get(CLAVE_GENERACION, 0)
+    instantanea = guardados.get(clave)
+    if instantanea is not None and instantanea[0] == generacion:
+        return instantanea[1]
+
+    datos = construir_panel(usuario)
+    cache.set(clave, (generacion, datos), DURACION_PANEL)
+    return datos
+
+
+def invalidar_paneles(usuario_ids):
+    claves = [clave_panel(usuario_id) for usuario_id in set(usuario_ids) if usuario_id is not None]
+    if claves:
+        transaction.on_commit(lambda: cache.delete_many(claves))
+
+
+def invalidar_todos_los_paneles():
+    def subir_generacion():
+        cache.add(CLAVE_GENERACION, 0, None)
+        cache.incr(CLAVE_GENERACION)
+
+    transaction.on_commit(subir_generacion)
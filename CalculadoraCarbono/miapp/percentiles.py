@@ -0,0 +1,266 @@
+"""
+Percentiles regionales y nacionales de la huella mediante histogramas fijos.
+
+Cada usuario con registros suma una unidad, por cada campo de CAMPOS_PERCENTIL,
+al contenedor de su huella media (suma / número de registros de
+EstadisticasUsuario) en el histograma de su país y en el de su región
+(identificada por país y región). Así un usuario con muchos registros pesa lo
+mismo que uno con pocos. Los contenedores son logarítmicos (cada uno
+CRECIMIENTO veces más ancho que el anterior), así que el percentil se estima
+con un error relativo acotado sin recorrer la tabla de registros.
+
+A diferencia de un t-digest, un histograma fijo admite restar: cuando cambian
+las estadísticas o la ubicación de un usuario se resta su contribución
+anterior y se suma la nueva. Los histogramas se guardan en HistogramaHuella y
+se pueden reconstruir por lotes con reconstruir_histogramas.
+"""
+
+import math
+from collections import Counter
+
+import numpy as np
+from django.db import transaction
+from django.db.models import Case, F, Q, Sum, Value, When
+
+from .models import EstadisticasUsuario, HistogramaHuella, Usuario
+
+CAMPOS_PERCENTIL = ('huella_total', 'huella_consumo', 'huella_transporte', 'huella_energia', 'huella_residuos')
+
+# Los valores hasta MINIMO (incluidos los negativos) caen en el contenedor 0
+MINIMO = 0.01
+CRECIMIENTO = 1.05
+MAX_INDICE = 500
+
+# Incrementos aplicados por sentencia UPDATE
+MAX_INCREMENTOS_POR_SENTENCIA = 200
+
+TAMANO_LOTE_HISTOGRAMAS = 5000
+
+
+def indice(valor):
+    if not valor > MINIMO:
+        return 0
+    return min(MAX_INDICE, 1 + int(math.log(valor / MINIMO) / math.log(CRECIMIENTO)))
+
+
+def indices(valores):
+    # indice() sobre un arreglo de NumPy
+    valores = np.asarray(valores, dtype=float)
+    resultado = np.zeros(len(valores), dtype=np.int64)
+    positivos = valores > MINIMO
+    resultado[positivos] = 1 + np.floor(np.log(valores[positivos] / MINIMO) / math.log(CRECIMIENTO)).astype(np.int64)
+    return np.minimum(resultado, MAX_INDICE)
+
+
+def ambitos(pais, region):
+    # Histogramas a los que contribuye un usuario: su país y su región dentro del país
+    pais, region = pais or '', region or ''
+    resultado = []
+    if pais:
+        resultado.append((pais, ''))
+    if region:
+        resultado.append((pais, region))
+    return resultado
+
+
+def ubicacion_usuario(usuario_id):
+    return Usuario.objects.filter(pk=usuario_id).values_list('pais', 'region').first() or ('', '')
+
+
+def contribucion(ubicacion, valores, signo=1, incrementos=None):
+    """
+    Añade a ``incrementos`` (Counter de (pais, region, campo, indice)) la
+    contribución de un usuario con las huellas medias ``valores`` ({campo: valor}).
+    """
+    incrementos = Counter() if incrementos is None else incrementos
+    for pais, region in ambitos(*ubicacion):
+        for campo in CAMPOS_PERCENTIL:
+            incrementos[(pais, region, campo, indice(valores[campo]))] += signo
+    return incrementos
+
+
+def promedios_usuarios(usuario_ids, bloquear=False):
+    """
+    {usuario_id: ((pais, region), {campo: media} o None)} de los usuarios
+    indicados, leído de EstadisticasUsuario con una consulta; None si el
+    usuario no tiene registros. Con ``bloquear`` las filas de los usuarios
+    quedan bloqueadas hasta el final de la transacción, de modo que dos
+    escrituras del mismo usuario no partan de la misma media.
+    """
+    consulta = Usuario.objects.filter(id__in=list(usuario_ids)).order_by('id')
+    if bloquear:
+        consulta = consulta.select_for_update(of=('self',))
+    filas = consulta.values_list(
+        'id', 'pais', 'region', 'estadisticas__numero_registros',
+        *[f'estadisticas__suma_{campo}' for campo in CAMPOS_PERCENTIL]
+    )
+    return {
+        usuario_id: (
+            (pais or '', region or ''),
+            dict(zip(CAMPOS_PERCENTIL, (suma / numero for suma in sumas))) if numero else None
+        )
+        for usuario_id, pais, region, numero, *sumas in filas
+    }
+
+
+def cambiar_promedios(anteriores, actuales):
+    """
+    Pasa la contribución de cada usuario de sus medias ``anteriores`` a las
+    ``actuales`` (ambos como los devuelve promedios_usuarios).
+    """
+    incrementos = Counter()
+    for promedios, signo in ((anteriores, -1), (actuales, 1)):
+        for ubicacion, valores in promedios.values():
+            if valores is not None:
+                contribucion(ubicacion, valores, signo, incrementos)
+    aplicar_incrementos(incrementos)
+
+
+def aplicar_incrementos(incrementos):
+    """
+    Suma los incrementos a los contenedores con una sola sentencia INSERT ...
+    ON CONFLICT (calculos.sumar_en_bloque). Si la base de datos no la admite,
+    con una inserción de los que faltan y una actualización con CASE por cada
+    MAX_INCREMENTOS_POR_SENTENCIA.
+    """
+    # calculos importa este módulo
+    from .calculos import sumar_en_bloque
+
+    incrementos = {clave: cantidad for clave, cantidad in incrementos.items() if cantidad}
+    if not incrementos:
+        return
+    claves = sorted(incrementos)
+    contenedores = [
+        HistogramaHuella(pais=pais, region=region, campo=campo, indice=i, conteo=incrementos[(pais, region, campo, i)])
+        for pais, region, campo, i in claves
+    ]
+    if sumar_en_bloque(HistogramaHuella, contenedores, ('pais', 'region', 'campo', 'indice'), ('conteo',)):
+        return
+    with transaction.atomic(savepoint=False):
+        HistogramaHuella.objects.bulk_create(
+            [HistogramaHuella(pais=pais, region=region, campo=campo, indice=i) for pais, region, campo, i in claves],
+            ignore_conflicts=True
+        )
+        for inicio in range(0, len(claves), MAX_INCREMENTOS_POR_SENTENCIA):
+            condiciones = [
+                (Q(pais=pais, region=region, campo=campo, indice=i), incrementos[(pais, region, campo, i)])
+                for pais, region, campo, i in claves[inicio:inicio + MAX_INCREMENTOS_POR_SENTENCIA]
+            ]
+            filtro = Q()
+            for condicion, _ in condiciones:
+                filtro |= condicion
+            HistogramaHuella.objects.filter(filtro).update(conteo=F('conteo') + Case(
+                *[When(condicion, then=Value(cantidad)) for condicion, cantidad in condiciones], default=Value(0)
+            ))
+
+
+def incrementos_de_columnas(paises, regiones, columnas, signo=1, incrementos=None):
+    """
+    Contribución de un lote de usuarios dados como columnas: ``paises`` y
+    ``regiones`` por usuario y ``columnas`` {campo: arreglo de medias}.
+    """
+    incrementos = Counter() if incrementos is None else incrementos
+    grupos = {}
+    for posicion, (pais, region) in enumerate(zip(paises, regiones)):
+        for ambito in ambitos(pais, region):
+            grupos.setdefault(ambito, []).append(posicion)
+    for (pais, region), posiciones in grupos.items():
+        seleccion = np.array(posiciones, dtype=np.intp)
+        for campo in CAMPOS_PERCENTIL:
+            contenedores, conteos = np.unique(indices(columnas[campo][seleccion]), return_counts=True)
+            for i, conteo in zip(contenedores.tolist(), conteos.tolist()):
+                incrementos[(pais, region, campo, i)] += signo * conteo
+    return incrementos
+
+
+def mover_usuario(usuario_id, anterior, actual):
+    # Pasa la contribución del usuario de la ubicación anterior a la actual
+    _, valores = promedios_usuarios([usuario_id]).get(usuario_id, (None, None))
+    if valores is None:
+        return
+    incrementos = contribucion(anterior, valores, signo=-1)
+    contribucion(actual, valores, incrementos=incrementos)
+    aplicar_incrementos(incrementos)
+
+
+def percentiles(ubicacion, valores):
+    """
+    Percentil (0-100) de cada valor entre las huellas medias de los usuarios
+    del país y de la región de ``ubicacion``, con una sola consulta agregada. Devuelve
+    {'pais': ..., 'region': ...} con None para los ámbitos sin datos.
+    """
+    resultado = {'pais': None, 'region': None}
+    lista_ambitos = ambitos(*ubicacion)
+    if not lista_ambitos:
+        return resultado
+
+    agregados = {}
+    for numero, (pais, region) in enumerate(lista_ambitos):
+        base = Q(pais=pais, region=region)
+        agregados[f'total_{numero}'] = Sum('conteo', filter=base & Q(campo='huella_total'))
+        for campo in CAMPOS_PERCENTIL:
+            i = indice(valores[campo])
+            agregados[f'debajo_{numero}_{campo}'] = Sum('conteo', filter=base & Q(campo=campo, indice__lt=i))
+            agregados[f'igual_{numero}_{campo}'] = Sum('conteo', filter=base & Q(campo=campo, indice=i))
+
+    filtro = Q()
+    for pais, region in lista_ambitos:
+        filtro |= Q(pais=pais, region=region)
+    sumas = HistogramaHuella.objects.filter(filtro).aggregate(**agregados)
+
+    for numero, (pais, region) in enumerate(lista_ambitos):
+        total = sumas[f'total_{numero}'] or 0
+        if total <= 0:
+            continue
+        resultado['region' if region else 'pais'] = {
+            'pais': pais,
+            'region': region,
+            'usuarios': total,
+            'percentiles': {
+                # La mitad del contenedor propio cuenta como por debajo
+                campo: 100 * ((sumas[f'debajo_{numero}_{campo}'] or 0) + (sumas[f'igual_{numero}_{campo}'] or 0) / 2) / total
+                for campo in CAMPOS_PERCENTIL
+            },
+        }
+    return resultado
+
+
+def reconstruir_histogramas(tamano_lote=TAMANO_LOTE_HISTOGRAMAS, al_avanzar=None):
+    """
+    Reconstruye todos los histogramas desde EstadisticasUsuario, recorriendo
+    los usuarios por id en lotes. Las estadísticas deben estar al día
+    (reconstruir_estadisticas). Devuelve el número de usuarios procesados.
+    """
+    incrementos = Counter()
+    procesados = 0
+    ultimo_id = 0
+    while True:
+        filas = list(
+            EstadisticasUsuario.objects.filter(usuario_id__gt=ultimo_id, numero_registros__gt=0)
+            .order_by('usuario_id')
+            .values_list(
+                'usuario_id', 'usuario__pais', 'usuario__region', 'numero_registros',
+                *[f'suma_{campo}' for campo in CAMPOS_PERCENTIL]
+            )[:tamano_lote]
+        )
+        if not filas:
+            break
+        ids, paises, regiones, numeros, *sumas = zip(*filas)
+        numeros = np.array(numeros, dtype=float)
+        columnas = {campo: np.array(columna, dtype=float) / numeros for campo, columna in zip(CAMPOS_PERCENTIL, sumas)}
+        incrementos_de_columnas(paises, regiones, columnas, incrementos=incrementos)
+        procesados += len(ids)
+        ultimo_id = ids[-1]
+        if al_avanzar:
+            al_avanzar(procesados)
+
+    with transaction.atomic():
+        HistogramaHuella.objects.all().delete()
+        HistogramaHuella.objects.bulk_create(
+            [
+                HistogramaHuella(pais=pais, region=region, campo=campo, indice=i, conteo=conteo)
+                for (pais, region, campo, i), conteo in sorted(incrementos.items()) if conteo
+            ],
+            batch_size=1000
+        )
+    return procesados
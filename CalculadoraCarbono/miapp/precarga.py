@@ -0,0 +1,185 @@
+"""
+Precarga de relaciones a partir del árbol de campos de un serializer.
+
+optimizar_queryset recorre los campos que el serializer va a leer: las
+relaciones a uno (claves foráneas y uno a uno en cualquier sentido) se unen con
+select_related y las relaciones a muchos se cargan con un Prefetch cuyo
+queryset se optimiza a su vez con el serializer hijo. El número de consultas de
+una respuesta depende así de la forma del serializer y no de cuántas filas o
+hijos tenga.
+
+PrecargaMixin lo aplica en las acciones de lectura de un ViewSet y vigila que
+cada petición respete su presupuesto: la autenticación, la consulta principal
+y una consulta por cada Prefetch. Un exceso solo se registra en el log; la
+respuesta ya está construida y no se descarta.
+"""
+
+import logging
+import re
+
+from django.db import connection
+from django.db.models import Prefetch
+from rest_framework import serializers
+
+logger = logging.getLogger(__name__)
+
+# Autenticación (JWT) y consulta principal de la acción
+CONSULTAS_BASE = 2
+
+
+def _relacion(modelo, nombre):
+    # Campo o relación inversa de ``modelo`` accesible como atributo ``nombre``
+    for campo in modelo._meta.get_fields():
+        accesor = campo.get_accessor_name() if campo.auto_created and not campo.concrete else campo.name
+        if accesor == nombre:
+            return campo
+    return None
+
+
+def _saltos(campo):
+    # Atributos de source que el campo recorre como relaciones
+    if isinstance(campo, (serializers.BaseSerializer, serializers.ManyRelatedField)):
+        return campo.source_attrs
+    if isinstance(campo, serializers.RelatedField) and not campo.use_pk_only_optimization():
+        return campo.source_attrs
+    # Un campo simple o una clave primaria (que se lee de la columna *_id)
+    return campo.source_attrs[:-1]
+
+
+def _recorrer(serializer, modelo):
+    """
+    Devuelve (select_related, prefetches, consultas) para serializar
+    instancias de ``modelo`` con ``serializer``; ``consultas`` cuenta las que
+    añaden los Prefetch, incluidos los anidados.
+    """
+    if isinstance(serializer, serializers.ListSerializer):
+        serializer = serializer.child
+    unir, precargar, consultas = [], [], 0
+
+    for campo in serializer.fields.values():
+        if campo.write_only or campo.source == '*':
+            continue
+        actual, ruta = modelo, []
+        for atributo in _saltos(campo):
+            relacion = _relacion(actual, atributo)
+            if relacion is None or not relacion.is_relation:
+                break
+            ruta.append(atributo)
+            actual = relacion.related_model
+            if relacion.one_to_many or relacion.many_to_many:
+                hijo = campo.child if isinstance(campo, serializers.ListSerializer) else None
+                queryset = actual._default_manager.all()
+                if hijo is not None:
+                    hijo_unir, hijo_precargar, hijo_consultas = _recorrer(hijo, actual)
+                    queryset = queryset.select_related(*hijo_unir).prefetch_related(*hijo_precargar)
+                    consultas += hijo_consultas
+                precargar.append(Prefetch('__'.join(ruta), queryset=queryset))
+                consultas += 1
+                ruta = []
+                break
+        else:
+            if ruta and isinstance(campo, serializers.BaseSerializer):
+                # Serializer anidado de una relación a uno: sus relaciones cuelgan de la ruta
+                prefijo = '__'.join(ruta)
+                hijo_unir, hijo_precargar, hijo_consultas = _recorrer(campo, actual)
+                unir.extend(f'{prefijo}__{lookup}' for lookup in hijo_unir)
+                precargar.extend(
+                    Prefetch(f'{prefijo}__{p.prefetch_through}', queryset=p.queryset) for p in hijo_precargar
+                )
+                consultas += hijo_consultas
+        if ruta:
+            unir.append('__'.join(ruta))
+
+    return unir, precargar, consultas
+
+
+def columnas(serializer, modelo):
+    """
+    Campos de ``modelo`` que lee el serializer, para queryset.only(). Devuelve
+    None si algún campo parte de un atributo que no es una columna ni una
+    relación: una propiedad o un método podrían leer cualquier columna.
+    """
+    if isinstance(serializer, serializers.ListSerializer):
+        serializer = serializer.child
+    resultado = []
+    for campo in serializer.fields.values():
+        if campo.write_only:
+            continue
+        if campo.source == '*':
+            return None
+        atributo = campo.source_attrs[0]
+        display = re.fullmatch(r'get_(\w+)_display', atributo)
+        relacion = _relacion(modelo, display.group(1) if display else atributo)
+        if relacion is None:
+            return None
+        if relacion.concrete:
+            resultado.append(relacion.name)
+    return resultado
+
+
+def _aplicar(queryset, serializer, orden=()):
+    """
+    Queryset optimizado y número de consultas que añaden sus Prefetch. Solo
+    se leen las columnas que usa el serializer, las de ``orden`` y las de las
+    relaciones unidas.
+    """
+    unir, precargar, consultas = _recorrer(serializer, queryset.model)
+    if unir:
+        queryset = queryset.select_related(*unir)
+    if precargar:
+        queryset = queryset.prefetch_related(*precargar)
+    campos = columnas(serializer, queryset.model)
+    if campos is not None:
+        raices = {ruta.split('__')[0] for ruta in unir}
+        queryset = queryset.only(*campos, *raices, *(campo.lstrip('-') for campo in orden))
+    return queryset, consultas
+
+
+def optimizar_queryset(queryset, serializer):
+    return _aplicar(queryset, serializer)[0]
+
+
+class ContadorConsultas:
+    # Envoltorio para connection.execute_wrapper que solo cuenta las sentencias
+    def __init__(self):
+        self.total = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.total += 1
+        return execute(sql, params, many, context)
+
+
+class PrecargaMixin:
+    """
+    Para ViewSets: en las acciones de ``acciones_precarga`` el queryset se
+    optimiza con el serializer de la acción y solo lee las columnas que este
+    usa (más las del orden de la paginación). La respuesta que supere su
+    presupuesto de consultas se registra como aviso. Lo que
+    se ejecute aparte de la acción (como la lectura de la versión de datos en
+    versiones.py) se suma a ``consultas_adicionales``.
+    """
+    acciones_precarga = ('list', 'retrieve')
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        if self.action in self.acciones_precarga:
+            orden = getattr(self.paginator, 'ordering', None) or ()
+            orden = (orden,) if isinstance(orden, str) else orden
+            queryset, consultas = _aplicar(queryset, self.get_serializer(), orden)
+            self.presupuesto_consultas = CONSULTAS_BASE + consultas
+        return queryset
+
+    def dispatch(self, request, *args, **kwargs):
+        self.presupuesto_consultas = None
+        self.consultas_adicionales = 0
+        contador = ContadorConsultas()
+        with connection.execute_wrapper(contador):
+            respuesta = super().dispatch(request, *args, **kwargs)
+
+        presupuesto = self.presupuesto_consultas
+        if presupuesto is not None and contador.total > presupuesto + self.consultas_adicionales:
+            logger.warning(
+                "%s.%s ejecutó %s consultas (presupuesto: %s más %s adicionales)",
+                type(self).__name__, self.action, contador.total, presupuesto, self.consultas_adicionales
+            )
+        return respuesta
@@ -0,0 +1,133 @@
+"""
+Ranking personalizado de recomendaciones.
+
+El catálogo de recomendaciones se toma de su instantánea (catalogos.py) y se
+guarda como arreglos de NumPy: ids, impacto potencial y categoría. Para un
+usuario, una sola consulta trae su huella más reciente por categoría (la del
+último registro que mantiene EstadisticasUsuario) y las recomendaciones que ya
+tiene asignadas. Después se puntúan todas de una vez: el impacto potencial por
+el ajuste de su categoría según la huella del usuario. Las asignadas se
+descartan y las k mejores se eligen con un montículo.
+"""
+
+import heapq
+
+import numpy as np
+
+from .catalogos import registro_catalogos
+from .models import Recomendacion, Usuario
+
+# Categoría -> (campo del registro de huella, huella de referencia). El ajuste es
+# huella / referencia, acotado entre AJUSTE_MINIMO y AJUSTE_MAXIMO
+REFERENCIAS_CATEGORIA = {
+    'CONSUMO': ('huella_consumo', 100),
+    'TRANSPORTE': ('huella_transporte', 150),
+    'ENERGIA': ('huella_energia', 120),
+    'RESIDUOS': ('huella_residuos', 50),
+}
+# En reciclaje el ajuste crece cuanto menos reduce el usuario: referencia / (reducción + 1)
+REFERENCIA_RECICLAJE = 30
+
+AJUSTE_MINIMO = 0.5
+AJUSTE_MAXIMO = 2.0
+
+CAMPOS_HUELLA = tuple(campo for campo, _ in REFERENCIAS_CATEGORIA.values()) + ('reduccion_por_reciclaje',)
+
+CODIGOS_CATEGORIA = [codigo for codigo, _ in Recomendacion.CATEGORIAS]
+
+LIMITE_POR_DEFECTO = 5
+MAX_LIMITE = 50
+
+# (instantánea del catálogo, arreglos) de la última versión usada
+_arreglos = (None, None)
+
+
+def ajustes_por_categoria(huellas):
+    """
+    Factor por el que se multiplica el impacto potencial en cada categoría.
+    ``huellas`` es {campo: valor} del último registro, o None si no hay
+    registros; en ese caso (y en GENERAL) el factor es 1.
+    """
+    ajustes = dict.fromkeys(CODIGOS_CATEGORIA, 1.0)
+    if huellas is None:
+        return ajustes
+    for categoria, (campo, referencia) in REFERENCIAS_CATEGORIA.items():
+        ajustes[categoria] = huellas[campo] / referencia
+    ajustes['RECICLAJE'] = REFERENCIA_RECICLAJE / (huellas['reduccion_por_reciclaje'] + 1)
+    for categoria in REFERENCIAS_CATEGORIA.keys() | {'RECICLAJE'}:
+        ajustes[categoria] = min(AJUSTE_MAXIMO, max(AJUSTE_MINIMO, ajustes[categoria]))
+    return ajustes
+
+
+def _huellas(fila):
+    # Las huellas del registro no admiten nulos: todo None significa que no hay último registro
+    if all(valor is None for valor in fila):
+        return None
+    return dict(zip(CAMPOS_HUELLA, fila))
+
+
+def huellas_recientes(usuario):
+    fila = (
+        Usuario.objects.filter(pk=usuario.pk)
+        .values_list(*(f'estadisticas__ultimo_registro__{campo}' for campo in CAMPOS_HUELLA))
+        .first()
+    )
+    return _huellas(fila) if fila else None
+
+
+def datos_usuario(usuario):
+    """
+    (huellas, ids asignados) en una sola consulta: una fila por recomendación
+    asignada (o una sola sin asignación), todas con las huellas del último registro.
+    """
+    filas = list(
+        Usuario.objects.filter(pk=usuario.pk).values_list(
+            'recomendacionusuario__recomendacion_id',
+            *(f'estadisticas__ultimo_registro__{campo}' for campo in CAMPOS_HUELLA)
+        )
+    )
+    if not filas:
+        return None, set()
+    asignadas = {fila[0] for fila in filas if fila[0] is not None}
+    return _huellas(filas[0][1:]), asignadas
+
+
+def _arreglos_catalogo():
+    global _arreglos
+    instantanea = registro_catalogos.instantanea('recomendaciones')
+    actual, arreglos = _arreglos
+    if actual is not instantanea:
+        indices = {codigo: i for i, codigo in enumerate(CODIGOS_CATEGORIA)}
+        datos = instantanea.datos
+        arreglos = (
+            np.array([fila['id'] for fila in datos], dtype=np.int64),
+            np.array([fila['impacto_potencial'] for fila in datos], dtype=float),
+            # Las categorías fuera de CATEGORIAS se puntúan como GENERAL
+            np.array([indices.get(fila['categoria'], indices['GENERAL']) for fila in datos], dtype=np.intp),
+        )
+        _arreglos = (instantanea, arreglos)
+    return instantanea, arreglos
+
+
+def recomendar(usuario, limite=LIMITE_POR_DEFECTO):
+    """
+    Las ``limite`` recomendaciones no asignadas de mayor impacto estimado para
+    el usuario, como los datos serializados del catálogo más
+    ``impacto_estimado``. A igual impacto gana la de menor id.
+    """
+    huellas, asignadas = datos_usuario(usuario)
+    instantanea, (ids, impactos, categorias) = _arreglos_catalogo()
+    if not len(ids):
+        return []
+
+    ajustes = ajustes_por_categoria(huellas)
+    puntuaciones = impactos * np.array([ajustes[codigo] for codigo in CODIGOS_CATEGORIA])[categorias]
+    candidatas = np.flatnonzero(~np.isin(ids, list(asignadas))) if asignadas else np.arange(len(ids))
+
+    mejores = heapq.nlargest(
+        limite, zip(puntuaciones[candidatas].tolist(), (-ids[candidatas]).tolist(), candidatas.tolist())
+    )
+    return [
+        dict(instantanea.datos[posicion], impacto_estimado=puntuacion)
+        for puntuacion, _, posicion in mejores
+    ]
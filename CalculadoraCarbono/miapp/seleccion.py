@@ -0,0 +1,83 @@
+"""
+Selección de campos de la respuesta con ?fields= y ?expand=.
+
+Sin ninguno de los dos parámetros la respuesta no cambia. Con ``fields`` solo
+se devuelven los campos nombrados; las relaciones anidadas de
+``Meta.expandibles`` solo se incluyen si se nombran en ``fields`` o en
+``expand``. El serializer podado es el que usa PrecargaMixin para decidir qué
+unir, precargar y leer, así que los campos no pedidos tampoco se consultan.
+"""
+
+from rest_framework import status
+from rest_framework.response import Response
+
+from .agregaciones import ParametroInvalido
+
+# Acciones en las que se atienden los parámetros; las escrituras usan siempre todos los campos
+ACCIONES_SELECCION = ('list', 'retrieve')
+
+
+def parsear_lista(valor):
+    # "a, b,c" -> ['a', 'b', 'c']; None si el parámetro no se envió
+    if valor is None:
+        return None
+    return [nombre.strip() for nombre in valor.split(',') if nombre.strip()]
+
+
+class CamposDinamicosMixin:
+    """
+    Para serializers: aplica la selección (campos, expandir) que la vista deja
+    en el contexto como ``seleccion``.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        seleccion = self.context.get('seleccion')
+        if seleccion is None:
+            return
+        campos, expandir = seleccion
+        expandibles = set(getattr(self.Meta, 'expandibles', ()))
+        for nombre in list(self.fields):
+            if nombre in expandibles:
+                incluir = nombre in expandir or (campos is not None and nombre in campos)
+            else:
+                incluir = campos is None or nombre in campos
+            if not incluir:
+                self.fields.pop(nombre)
+
+
+class SeleccionCamposMixin:
+    """
+    Para ViewSets: valida ?fields= y ?expand= contra el serializer de la vista
+    y pasa la selección al contexto. Un parámetro inválido devuelve 400.
+    """
+
+    def get_serializer_context(self):
+        contexto = super().get_serializer_context()
+        if self.action in ACCIONES_SELECCION:
+            contexto['seleccion'] = self.seleccion_campos()
+        return contexto
+
+    def seleccion_campos(self):
+        campos = parsear_lista(self.request.query_params.get('fields'))
+        expandir = parsear_lista(self.request.query_params.get('expand'))
+        if campos is None and expandir is None:
+            return None
+
+        serializer_class = self.get_serializer_class()
+        disponibles = serializer_class().fields
+        expandibles = getattr(serializer_class.Meta, 'expandibles', ())
+        desconocidos = [nombre for nombre in campos or () if nombre not in disponibles]
+        if desconocidos:
+            raise ParametroInvalido(f"fields contiene campos desconocidos: {', '.join(desconocidos)}")
+        no_expandibles = [nombre for nombre in expandir or () if nombre not in expandibles]
+        if no_expandibles:
+            raise ParametroInvalido(
+                f"expand solo admite: {', '.join(expandibles)}" if expandibles else "Este recurso no admite expand"
+            )
+        return campos, expandir or []
+
+    def handle_exception(self, exc):
+        if isinstance(exc, ParametroInvalido):
+            return Response({"error": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        return super().handle_exception(exc)
@@ -1,11 +1,16 @@
 from rest_framework import serializers
 from django.contrib.auth import get_user_model
+from django.db import transaction
 from .models import (
     RegistroHuellaCarbono, DetalleConsumo, DetalleTransporte, 
     DetalleEnergia, DetalleResiduos, RegistroReciclaje, 
     Material, MaterialReciclable, FactorEmision, 
     Recomendacion, RecomendacionUsuario
 )
+from .calculos import agregar_materiales_reciclaje, aplicar_efectos_registros
+from .factores import factores_para_usuario, registro_factores
+from .estadisticas import estado_registro
+from .seleccion import CamposDinamicosMixin
 
 Usuario = get_user_model()
 
@@ -13,7 +18,7 @@ Usuario = get_user_model()
 class UsuarioSerializer(serializers.ModelSerializer):
     class Meta:
         model = Usuario
-        fields = ('id', 'username', 'email', 'nombre_completo', 'fecha_registro', 'region', 'pais')
+        fields = ('id', 'username', 'email', 'nombre_completo', 'fecha_registro', 'region', 'pais', 'zona_horaria')
         read_only_fields = ('fecha_registro',)
 
 class UsuarioRegistroSerializer(serializers.ModelSerializer):
@@ -21,7 +26,7 @@ class UsuarioRegistroSerializer(serializers.ModelSerializer):
     
     class Meta:
         model = Usuario
-        fields = ('id', 'username', 'email', 'password', 'nombre_completo', 'region', 'pais')
+        fields = ('id', 'username', 'email', 'password', 'nombre_completo', 'region', 'pais', 'zona_horaria')
     
     def create(self, validated_data):
         password = validated_data.pop('password')
@@ -35,27 +40,39 @@ class DetalleConsumoSerializer(serializers.ModelSerializer):
     class Meta:
         model = DetalleConsumo
         fields = '__all__'
+        read_only_fields = ('registro_huella',)
 
 # DetalleTransporte Serializer
 class DetalleTransporteSerializer(serializers.ModelSerializer):
     class Meta:
         model = DetalleTransporte
         fields = '__all__'
+        read_only_fields = ('registro_huella',)
 
 # DetalleEnergia Serializer
 class DetalleEnergiaSerializer(serializers.ModelSerializer):
     class Meta:
         model = DetalleEnergia
         fields = '__all__'
+        read_only_fields = ('registro_huella',)
 
 # DetalleResiduos Serializer
 class DetalleResiduosSerializer(serializers.ModelSerializer):
     class Meta:
         model = DetalleResiduos
         fields = '__all__'
+        read_only_fields = ('registro_huella',)
+
+# Relaciones de detalle de RegistroHuellaCarbono y su modelo
+DETALLES_REGISTRO = (
+    ('detalle_consumo', DetalleConsumo),
+    ('detalle_transporte', DetalleTransporte),
+    ('detalle_energia', DetalleEnergia),
+    ('detalle_residuos', DetalleResiduos),
+)
 
 # RegistroHuellaCarbono Serializer
-class RegistroHuellaCarbonoSerializer(serializers.ModelSerializer):
+class RegistroHuellaCarbonoSerializer(CamposDinamicosMixin, serializers.ModelSerializer):
     detalle_consumo = DetalleConsumoSerializer(required=False)
     detalle_transporte = DetalleTransporteSerializer(required=False)
     detalle_energia = DetalleEnergiaSerializer(required=False)
@@ -64,7 +81,118 @@ class RegistroHuellaCarbonoSerializer(serializers.ModelSerializer):
     class Meta:
         model = RegistroHuellaCarbono
         fields = '__all__'
-        read_only_fields = ('huella_total', 'huella_consumo', 'huella_transporte', 'huella_energia', 'huella_residuos', 'reduccion_por_reciclaje')
+        read_only_fields = ('usuario', 'huella_total', 'huella_consumo', 'huella_transporte', 'huella_energia', 'huella_residuos', 'reduccion_por_reciclaje', 'version_factores')
+        expandibles = tuple(campo for campo, _ in DETALLES_REGISTRO)
+    
+    def calcular_desglose(self, usuario):
+        # Calcula la huella con los datos validados sin escribir en la base de datos:
+        # los detalles se instancian en memoria y los factores salen del registro en memoria
+        registro, _, desglose = self._construir_en_memoria(self.validated_data, usuario)
+        
+        return {
+            'huella_total': registro.huella_total,
+            'huella_consumo': registro.huella_consumo,
+            'huella_transporte': registro.huella_transporte,
+            'huella_energia': registro.huella_energia,
+            'huella_residuos': registro.huella_residuos,
+            'reduccion_por_reciclaje': registro.reduccion_por_reciclaje,
+            'desglose': desglose,
+        }
+    
+    def crear_lote(self, items, usuario):
+        """
+        Valida y crea varios registros con sus detalles anidados.
+        
+        Cada elemento se valida por separado con los campos de este serializer
+        (construidos una sola vez), la huella se calcula en memoria y todos los
+        válidos se guardan con bulk_create en una sola transacción: una
+        inserción por tabla y no seis sentencias por registro. Devuelve los
+        registros creados y los errores como listas de (indice, ...).
+        """
+        validos = []
+        errores = []
+        for indice, item in enumerate(items):
+            try:
+                validos.append((indice, self.run_validation(item)))
+            except serializers.ValidationError as e:
+                errores.append((indice, e.detail))
+        
+        construidos = [
+            (indice, *self._construir_en_memoria(datos, usuario)[:2])
+            for indice, datos in validos
+        ]
+        version = registro_factores.version()
+        
+        with transaction.atomic():
+            registros = [registro for _, registro, _ in construidos]
+            for registro in registros:
+                registro.version_factores = version
+            RegistroHuellaCarbono.objects.bulk_create(registros)
+            
+            detalles_por_modelo = {}
+            for _, registro, detalles in construidos:
+                for detalle in detalles:
+                    detalle.registro_huella = registro
+                    detalles_por_modelo.setdefault(type(detalle), []).append(detalle)
+            for modelo, detalles in detalles_por_modelo.items():
+                modelo.objects.bulk_create(detalles)
+            # bulk_create no envía señales: los efectos de las altas se aplican aquí
+            if registros:
+                aplicar_efectos_registros({}, {registro.id: estado_registro(registro) for registro in registros})
+        
+        creados = [(indice, registro) for indice, registro, _ in construidos]
+        return creados, errores
+    
+    def _construir_en_memoria(self, datos, usuario):
+        # Registro y detalles sin guardar, con la huella ya calculada. Los
+        # detalles solo se devuelven si venían en los datos, como en create()
+        datos = dict(datos)
+        datos_detalles = {
+            campo: datos.pop(campo, None)
+            for campo in ('detalle_consumo', 'detalle_transporte', 'detalle_energia', 'detalle_residuos')
+        }
+        registro = RegistroHuellaCarbono(usuario=usuario, **datos)
+        factores = factores_para_usuario(usuario, registro.fecha)
+        
+        consumo = DetalleConsumo(**(datos_detalles['detalle_consumo'] or {}))
+        transporte = DetalleTransporte(**(datos_detalles['detalle_transporte'] or {}))
+        energia = DetalleEnergia(**(datos_detalles['detalle_energia'] or {}))
+        residuos = DetalleResiduos(**(datos_detalles['detalle_residuos'] or {}))
+        
+        desglose = {
+            'consumo': {
+                'alimentacion': consumo.calcular_emisiones_alimentacion(factores),
+                'compras': consumo.calcular_emisiones_compras(factores),
+            },
+            'transporte': {
+                'vehiculo_privado': transporte.calcular_emisiones_vehiculo_privado(factores),
+                'transporte_publico': transporte.calcular_emisiones_transporte_publico(factores),
+                'vuelos': transporte.calcular_emisiones_vuelos(factores),
+            },
+            'energia': {
+                'electricidad': energia.calcular_emisiones_electricidad(factores),
+                'calefaccion': energia.calcular_emisiones_calefaccion(factores),
+                'agua': energia.calcular_emisiones_agua(factores),
+            },
+            'residuos': {
+                'residuos': residuos.calcular_emisiones_residuos(factores),
+            },
+        }
+        
+        registro.huella_consumo = sum(desglose['consumo'].values())
+        registro.huella_transporte = sum(desglose['transporte'].values())
+        registro.huella_energia = sum(desglose['energia'].values())
+        registro.huella_residuos = sum(desglose['residuos'].values())
+        registro.calcular_huella_total()
+        
+        detalles = [
+            detalle for detalle, campo in (
+                (consumo, 'detalle_consumo'), (transporte, 'detalle_transporte'),
+                (energia, 'detalle_energia'), (residuos, 'detalle_residuos'),
+            )
+            if datos_detalles[campo]
+        ]
+        return registro, detalles, desglose
     
     def create(self, validated_data):
         detalle_consumo_data = validated_data.pop('detalle_consumo', None)
@@ -94,85 +222,80 @@ class RegistroHuellaCarbonoSerializer(serializers.ModelSerializer):
         
         # Calcular la huella total
         registro.calcular_huella_total()
+        registro.version_factores = registro_factores.version()
         registro.save()
         
         return registro
     
     def update(self, instance, validated_data):
-        detalle_consumo_data = validated_data.pop('detalle_consumo', None)
-        detalle_transporte_data = validated_data.pop('detalle_transporte', None)
-        detalle_energia_data = validated_data.pop('detalle_energia', None)
-        detalle_residuos_data = validated_data.pop('detalle_residuos', None)
+        # Todo en una transacción. La vista entrega el registro con usuario y
+        # detalles ya cargados (select_related), los cambios se aplican en
+        # memoria y cada tabla recibe como mucho un UPDATE con las columnas que
+        # cambiaron de verdad
+        detalles_data = {campo: validated_data.pop(campo, None) for campo, _ in DETALLES_REGISTRO}
+        # Estado previo para las estadísticas (signals.recordar_estado_registro)
+        instance._estado_cargado = estado_registro(instance)
+        campos_cambiados = self._asignar(instance, validated_data)
         
-        # Actualizar campos básicos
-        for attr, value in validated_data.items():
-            setattr(instance, attr, value)
-        
-        # Actualizar o crear detalles
-        if detalle_consumo_data:
-            detalle_consumo, created = DetalleConsumo.objects.get_or_create(
-                registro_huella=instance,
-                defaults=detalle_consumo_data
-            )
-            if not created:
-                for attr, value in detalle_consumo_data.items():
-                    setattr(detalle_consumo, attr, value)
-                detalle_consumo.save()
-            instance.huella_consumo = self._calcular_huella_consumo(instance)
-        
-        if detalle_transporte_data:
-            detalle_transporte, created = DetalleTransporte.objects.get_or_create(
-                registro_huella=instance,
-                defaults=detalle_transporte_data
-            )
-            if not created:
-                for attr, value in detalle_transporte_data.items():
-                    setattr(detalle_transporte, attr, value)
-                detalle_transporte.save()
-            instance.huella_transporte = self._calcular_huella_transporte(instance)
-        
-        if detalle_energia_data:
-            detalle_energia, created = DetalleEnergia.objects.get_or_create(
-                registro_huella=instance,
-                defaults=detalle_energia_data
-            )
-            if not created:
-                for attr, value in detalle_energia_data.items():
-                    setattr(detalle_energia, attr, value)
-                detalle_energia.save()
-            instance.huella_energia = self._calcular_huella_energia(instance)
-        
-        if detalle_residuos_data:
-            detalle_residuos, created = DetalleResiduos.objects.get_or_create(
-                registro_huella=instance,
-                defaults=detalle_residuos_data
-            )
-            if not created:
-                for attr, value in detalle_residuos_data.items():
-                    setattr(detalle_residuos, attr, value)
-                detalle_residuos.save()
-            instance.huella_residuos = self._calcular_huella_residuos(instance)
-        
-        # Calcular la huella total
-        instance.calcular_huella_total()
-        instance.save()
+        with transaction.atomic():
+            for campo, modelo in DETALLES_REGISTRO:
+                datos = detalles_data[campo]
+                if not datos:
+                    continue
+                try:
+                    detalle = getattr(instance, campo)
+                except modelo.DoesNotExist:
+                    setattr(instance, campo, modelo.objects.create(registro_huella=instance, **datos))
+                    continue
+                cambiados = self._asignar(detalle, datos)
+                if cambiados:
+                    detalle.save(update_fields=cambiados)
+            
+            # Todas las categorías se recalculan con los detalles en memoria, de modo
+            # que la huella completa corresponde a la versión de factores guardada
+            huella_total = instance.huella_total
+            campos_cambiados += self._asignar(instance, {
+                'huella_consumo': self._calcular_huella_consumo(instance),
+                'huella_transporte': self._calcular_huella_transporte(instance),
+                'huella_energia': self._calcular_huella_energia(instance),
+                'huella_residuos': self._calcular_huella_residuos(instance),
+                'version_factores': registro_factores.version(),
+            })
+            if instance.calcular_huella_total() != huella_total:
+                campos_cambiados.append('huella_total')
+            
+            if campos_cambiados:
+                instance.save(update_fields=campos_cambiados)
+            else:
+                del instance._estado_cargado
         
         return instance
     
+    def _asignar(self, objeto, valores):
+        # Asigna los valores y devuelve los nombres de los campos que cambiaron
+        cambiados = []
+        for attr, value in valores.items():
+            if getattr(objeto, attr) != value:
+                setattr(objeto, attr, value)
+                cambiados.append(attr)
+        return cambiados
+    
     def _calcular_huella_consumo(self, registro):
         try:
             detalle_consumo = registro.detalle_consumo
-            return detalle_consumo.calcular_emisiones_alimentacion() + detalle_consumo.calcular_emisiones_compras()
+            factores = factores_para_usuario(registro.usuario, registro.fecha)
+            return detalle_consumo.calcular_emisiones_alimentacion(factores) + detalle_consumo.calcular_emisiones_compras(factores)
         except DetalleConsumo.DoesNotExist:
             return 0
     
     def _calcular_huella_transporte(self, registro):
         try:
             detalle_transporte = registro.detalle_transporte
+            factores = factores_para_usuario(registro.usuario, registro.fecha)
             return (
-                detalle_transporte.calcular_emisiones_vehiculo_privado() +
-                detalle_transporte.calcular_emisiones_transporte_publico() +
-                detalle_transporte.calcular_emisiones_vuelos()
+                detalle_transporte.calcular_emisiones_vehiculo_privado(factores) +
+                detalle_transporte.calcular_emisiones_transporte_publico(factores) +
+                detalle_transporte.calcular_emisiones_vuelos(factores)
             )
         except DetalleTransporte.DoesNotExist:
             return 0
@@ -180,10 +303,11 @@ class RegistroHuellaCarbonoSerializer(serializers.ModelSerializer):
     def _calcular_huella_energia(self, registro):
         try:
             detalle_energia = registro.detalle_energia
+            factores = factores_para_usuario(registro.usuario, registro.fecha)
             return (
-                detalle_energia.calcular_emisiones_electricidad() +
-                detalle_energia.calcular_emisiones_calefaccion() +
-                detalle_energia.calcular_emisiones_agua()
+                detalle_energia.calcular_emisiones_electricidad(factores) +
+                detalle_energia.calcular_emisiones_calefaccion(factores) +
+                detalle_energia.calcular_emisiones_agua(factores)
             )
         except DetalleEnergia.DoesNotExist:
             return 0
@@ -191,7 +315,7 @@ class RegistroHuellaCarbonoSerializer(serializers.ModelSerializer):
     def _calcular_huella_residuos(self, registro):
         try:
             detalle_residuos = registro.detalle_residuos
-            return detalle_residuos.calcular_emisiones_residuos()
+            return detalle_residuos.calcular_emisiones_residuos(factores_para_usuario(registro.usuario, registro.fecha))
         except DetalleResiduos.DoesNotExist:
             return 0
 
@@ -209,6 +333,7 @@ class MaterialReciclableSerializer(serializers.ModelSerializer):
     class Meta:
         model = MaterialReciclable
         fields = '__all__'
+        read_only_fields = ('registro_reciclaje', 'valor_economico', 'reduccion_co2')
     
     def create(self, validated_data):
         material_reciclable = MaterialReciclable.objects.create(**validated_data)
@@ -219,27 +344,22 @@ class MaterialReciclableSerializer(serializers.ModelSerializer):
         return material_reciclable
 
 # RegistroReciclaje Serializer
-class RegistroReciclajeSerializer(serializers.ModelSerializer):
+class RegistroReciclajeSerializer(CamposDinamicosMixin, serializers.ModelSerializer):
     materiales = MaterialReciclableSerializer(source='materialreciclable_set', many=True, required=False)
     
     class Meta:
         model = RegistroReciclaje
         fields = '__all__'
-        read_only_fields = ('kg_total_reciclado', 'valor_economico_total', 'reduccion_co2_total')
+        read_only_fields = ('usuario', 'kg_total_reciclado', 'valor_economico_total', 'reduccion_co2_total')
+        expandibles = ('materiales',)
     
     def create(self, validated_data):
         materiales_data = validated_data.pop('materialreciclable_set', [])
         registro = RegistroReciclaje.objects.create(**validated_data)
         
-        # Crear materiales asociados
-        for material_data in materiales_data:
-            MaterialReciclable.objects.create(registro_reciclaje=registro, **material_data)
-        
-        # Actualizar valores calculados
-        registro.kg_total_reciclado = sum(m.cantidad for m in registro.materialreciclable_set.all())
-        registro.calcular_valor_economico()
-        registro.calcular_reduccion_co2()
-        registro.save()
+        # Crear materiales asociados y actualizar los totales
+        if materiales_data:
+            agregar_materiales_reciclaje(registro, materiales_data)
         
         return registro
 
@@ -258,7 +378,7 @@ class RecomendacionSerializer(serializers.ModelSerializer):
         fields = '__all__'
 
 # RecomendacionUsuario Serializer
-class RecomendacionUsuarioSerializer(serializers.ModelSerializer):
+class RecomendacionUsuarioSerializer(CamposDinamicosMixin, serializers.ModelSerializer):
     recomendacion_detalle = RecomendacionSerializer(source='recomendacion', read_only=True)
     estado_display = serializers.CharField(source='get_estado_display', read_only=True)
     
@@ -266,6 +386,7 @@ class RecomendacionUsuarioSerializer(serializers.ModelSerializer):
         model = RecomendacionUsuario
         fields = '__all__'
         read_only_fields = ('fecha_asignacion', 'impacto_real')
+        expandibles = ('recomendacion_detalle',)
     
     def update(self, instance, validated_data):
         if 'estado' in validated_data and validated_data['estado'] != instance.estado:
@@ -0,0 +1,193 @@
+from django.db import transaction
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+
+from .factores import registrar_cambio_factores
+from .models import (
+    Usuario, CambioFactorPendiente, FactorEmision, RegistroHuellaCarbono, DetalleConsumo, DetalleTransporte,
+    DetalleEnergia, DetalleResiduos, RegistroReciclaje, MaterialReciclable, Material, Recomendacion, RecomendacionUsuario
+)
+from .panel import invalidar_todos_los_paneles
+from .catalogos import registro_catalogos, subir_version_catalogo
+from .calculos import aplicar_efectos_registros, datos_cambiados
+from .estadisticas import CAMPOS_REGISTRO, estado_guardado, estado_registro
+from .percentiles import mover_usuario, ubicacion_usuario
+from . import clasificaciones
+
+
+@receiver(pre_save, sender=FactorEmision)
+def recordar_factor_anterior(sender, instance, raw=False, **kwargs):
+    # Si la edición cambia categoría, subcategoría, región o vigencia, los
+    # registros que usaban la combinación anterior también deben recalcularse
+    instance._clave_anterior = None
+    if raw or instance.pk is None:
+        return
+    instance._clave_anterior = (
+        sender.objects.filter(pk=instance.pk)
+        .values_list('categoria', 'subcategoria', 'region', 'vigente_desde', 'vigente_hasta')
+        .first()
+    )
+
+
+# Cualquier cambio en FactorEmision crea una nueva versión de factores y deja
+# en CambioFactorPendiente las combinaciones afectadas, en la misma
+# transacción: si se revierte, no queda nada pendiente. Los registros de huella
+# dependientes no se recalculan en la petición que guarda el factor (un factor
+# por defecto afecta a casi todos) sino con el comando propagar_factores, que
+# puede repetirse si falla.
+@receiver([post_save, post_delete], sender=FactorEmision)
+def propagar_cambio_factor(sender, instance, raw=False, **kwargs):
+    accion = 'eliminado' if kwargs.get('signal') is post_delete else 'guardado'
+    version = registrar_cambio_factores(f"FactorEmision {instance.pk} {accion}: {instance}")
+
+    # Las cargas de fixtures (raw) solo cambian la versión
+    if raw:
+        return
+
+    claves = {(
+        instance.categoria, instance.subcategoria, instance.region,
+        instance.vigente_desde, instance.vigente_hasta
+    )}
+    clave_anterior = getattr(instance, '_clave_anterior', None)
+    if clave_anterior:
+        claves.add(clave_anterior)
+    CambioFactorPendiente.objects.bulk_create([
+        CambioFactorPendiente(
+            version=version, categoria=categoria, subcategoria=subcategoria, region=region,
+            vigente_desde=vigente_desde, vigente_hasta=vigente_hasta
+        )
+        for categoria, subcategoria, region, vigente_desde, vigente_hasta in claves
+    ])
+    transaction.on_commit(lambda: registro_catalogos.invalidar('factores'))
+
+
+def _usuario_de(instance, relacion, modelo):
+    # usuario_id del registro padre, sin consulta si la relación ya está cargada
+    if relacion in instance._state.fields_cache:
+        padre = instance._state.fields_cache[relacion]
+        return padre.usuario_id if padre is not None else None
+    return modelo.objects.filter(pk=getattr(instance, f'{relacion}_id')).values_list('usuario_id', flat=True).first()
+
+
+# El dashboard de cada usuario se sirve desde la caché (panel.py) y las
+# lecturas condicionales comparan su versión de datos (versiones.py): cualquier
+# cambio en los datos del usuario invalida su instantánea al confirmar y sube
+# su versión. Los registros de huella lo hacen con el resto de sus efectos
+# (calculos.aplicar_efectos_registros), como las escrituras en bloque.
+@receiver([post_save, post_delete], sender=RegistroReciclaje)
+@receiver([post_save, post_delete], sender=RecomendacionUsuario)
+def invalidar_panel_usuario(sender, instance, **kwargs):
+    datos_cambiados([instance.usuario_id])
+
+
+@receiver([post_save, post_delete], sender=DetalleConsumo)
+@receiver([post_save, post_delete], sender=DetalleTransporte)
+@receiver([post_save, post_delete], sender=DetalleEnergia)
+@receiver([post_save, post_delete], sender=DetalleResiduos)
+def invalidar_panel_por_detalle(sender, instance, **kwargs):
+    datos_cambiados([_usuario_de(instance, 'registro_huella', RegistroHuellaCarbono)])
+
+
+@receiver([post_save, post_delete], sender=MaterialReciclable)
+def invalidar_panel_por_material(sender, instance, **kwargs):
+    datos_cambiados([_usuario_de(instance, 'registro_reciclaje', RegistroReciclaje)])
+
+
+# Los catálogos de recomendaciones y materiales se muestran en todos los
+# paneles y se sirven como instantáneas (catalogos.py). Su versión entra en la
+# ETag de las lecturas condicionales que los muestran (versiones.py)
+@receiver([post_save, post_delete], sender=Recomendacion)
+@receiver([post_save, post_delete], sender=Material)
+def invalidar_todos_los_paneles_por_catalogo(sender, instance, **kwargs):
+    invalidar_todos_los_paneles()
+    subir_version_catalogo('recomendaciones' if sender is Recomendacion else 'materiales')
+
+
+# EstadisticasUsuario, los histogramas y los resúmenes se ajustan en la misma
+# transacción que el registro (calculos.aplicar_efectos_registros). Las
+# cargas de fixtures (raw) requieren el comando reconstruir_estadisticas.
+@receiver(pre_save, sender=RegistroHuellaCarbono)
+def recordar_estado_registro(sender, instance, raw=False, update_fields=None, **kwargs):
+    # Quien ya tiene el registro cargado (RegistroHuellaCarbonoSerializer.update)
+    # deja su estado previo en _estado_cargado y se evita volver a leerlo
+    cargado = instance.__dict__.pop('_estado_cargado', None)
+    instance._estado_anterior = None
+    if raw or instance._state.adding or instance.pk is None:
+        return
+    if update_fields is not None and not set(update_fields) & set(CAMPOS_REGISTRO):
+        return
+    instance._estado_anterior = cargado if cargado is not None else estado_guardado(instance.pk)
+
+
+@receiver(post_save, sender=RegistroHuellaCarbono)
+def actualizar_estadisticas_registro(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        datos_cambiados([instance.usuario_id])
+        return
+    actual = estado_registro(instance)
+    # Sin estado anterior (un guardado que no toca los campos de las
+    # estadísticas) solo cambian el panel y la versión de datos
+    anterior = None if created else getattr(instance, '_estado_anterior', None) or actual
+    aplicar_efectos_registros({} if created else {instance.pk: anterior}, {instance.pk: actual})
+
+
+@receiver(post_delete, sender=RegistroHuellaCarbono)
+def descontar_estadisticas_registro(sender, instance, **kwargs):
+    aplicar_efectos_registros({instance.pk: estado_registro(instance)}, {})
+
+
+# Los kg reciclados de cada mes alimentan la clasificación de reciclaje
+def _estado_reciclaje(registro):
+    return registro.usuario_id, registro.fecha, registro.kg_total_reciclado
+
+
+@receiver(pre_save, sender=RegistroReciclaje)
+def recordar_estado_reciclaje(sender, instance, raw=False, update_fields=None, **kwargs):
+    instance._estado_anterior = None
+    if raw or instance._state.adding or instance.pk is None:
+        return
+    if update_fields is not None and not {'usuario', 'fecha', 'kg_total_reciclado'} & set(update_fields):
+        return
+    instance._estado_anterior = (
+        sender.objects.filter(pk=instance.pk).values_list('usuario_id', 'fecha', 'kg_total_reciclado').first()
+    )
+
+
+@receiver(post_save, sender=RegistroReciclaje)
+def actualizar_resumen_reciclaje(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    anterior = None if created else getattr(instance, '_estado_anterior', None)
+    if not created and anterior is None:
+        return
+    clasificaciones.aplicar_incrementos(clasificaciones.incrementos_reciclaje(anterior, _estado_reciclaje(instance)))
+
+
+@receiver(post_delete, sender=RegistroReciclaje)
+def descontar_resumen_reciclaje(sender, instance, **kwargs):
+    clasificaciones.aplicar_incrementos(clasificaciones.incrementos_reciclaje(_estado_reciclaje(instance), None))
+
+
+# Si un usuario cambia de país o región, su contribución cambia de histograma
+# y de clasificación, y sus registros quedan pendientes de recalcular con los
+# factores de la nueva ubicación (propagar_factores)
+@receiver(pre_save, sender=Usuario)
+def recordar_ubicacion_usuario(sender, instance, raw=False, update_fields=None, **kwargs):
+    instance._ubicacion_anterior = None
+    if raw or instance._state.adding or instance.pk is None:
+        return
+    if update_fields is not None and not {'pais', 'region'} & set(update_fields):
+        return
+    instance._ubicacion_anterior = ubicacion_usuario(instance.pk)
+
+
+@receiver(post_save, sender=Usuario)
+def mover_histogramas_usuario(sender, instance, created, raw=False, **kwargs):
+    anterior = getattr(instance, '_ubicacion_anterior', None)
+    if raw or created or anterior is None:
+        return
+    actual = (instance.pais, instance.region)
+    if tuple(anterior) != actual:
+        mover_usuario(instance.pk, anterior, actual)
+        clasificaciones.mover_usuario(instance.pk, actual)
+        CambioFactorPendiente.objects.create(usuario=instance)
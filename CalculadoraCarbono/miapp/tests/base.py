@@ -0,0 +1,88 @@
+from django.core.cache import cache
+from django.test import TestCase
+from rest_framework.test import APIClient
+
+from ..catalogos import registro_catalogos
+from ..factores import registro_factores
+from ..models import EstadisticasUsuario, HistogramaHuella, ResumenMensualUsuario
+
+CAMPOS_HUELLA = ('huella_total', 'huella_consumo', 'huella_transporte', 'huella_energia', 'huella_residuos')
+CAMPOS_ESTADISTICAS = (
+    'numero_registros', 'suma_huella_total', 'suma_huella_transporte',
+    'huella_minima', 'huella_maxima', 'ultimo_registro_id', 'fecha_ultimo_registro'
+)
+
+
+def datos_aleatorios(generador):
+    # Detalles de un registro de huella; cada categoría falta con probabilidad 0.2
+    datos = {
+        'detalle_consumo': {
+            'consumo_carne_roja': generador.random() * 5, 'consumo_aves': generador.random() * 5,
+            'consumo_pescado': generador.random() * 5, 'consumo_lacteos': generador.random() * 5,
+            'consumo_frutas_verduras': generador.random() * 5,
+            'porcentaje_alimentos_importados': generador.random() * 100,
+            'compras_ropa_nuevas': generador.randint(0, 5), 'compras_electronicos': generador.randint(0, 3),
+            'compras_online': generador.randint(0, 9),
+        },
+        'detalle_transporte': {
+            'km_vehiculo_gasolina': generador.random() * 500, 'km_vehiculo_diesel': generador.random() * 500,
+            'km_vehiculo_hibrido': generador.random() * 500, 'km_vehiculo_electrico': generador.random() * 500,
+            'km_autobus': generador.random() * 500, 'km_tren_metro': generador.random() * 500,
+            'vuelos_cortos': generador.randint(0, 4), 'vuelos_medianos': generador.randint(0, 3),
+            'vuelos_largos': generador.randint(0, 2),
+        },
+        'detalle_energia': {
+            'consumo_electricidad_kwh': generador.random() * 300,
+            'porcentaje_energia_renovable': generador.random() * 100,
+            'consumo_gas_natural_m3': generador.random() * 40, 'consumo_agua_m3': generador.random() * 20,
+            'tipo_calefaccion': generador.choice(['GAS', 'ELEC', 'LEÑA', 'GASOLEO', 'BIOMASA', 'NOCALEF']),
+            'consumo_calefaccion': generador.random() * 200,
+        },
+        'detalle_residuos': {'kg_residuos_totales': generador.random() * 50, 'kg_compostaje': generador.random() * 30},
+    }
+    return {campo: detalle for campo, detalle in datos.items() if generador.random() >= 0.2}
+
+
+def huellas(registro):
+    return [getattr(registro, campo) for campo in CAMPOS_HUELLA]
+
+
+def agregados():
+    # Estadísticas, histogramas y resúmenes mensuales tal como están guardados
+    estadisticas = {
+        fila['usuario_id']: fila for fila in EstadisticasUsuario.objects.values('usuario_id', *CAMPOS_ESTADISTICAS)
+    }
+    histogramas = {
+        (h.pais, h.region, h.campo, h.indice): h.conteo for h in HistogramaHuella.objects.all() if h.conteo
+    }
+    resumenes = {
+        (r.usuario_id, r.mes): (r.numero_registros, round(r.suma_huella_total, 6), round(r.kg_reciclados, 6))
+        for r in ResumenMensualUsuario.objects.all() if r.numero_registros or r.kg_reciclados
+    }
+    return estadisticas, histogramas, resumenes
+
+
+class BaseTests(TestCase):
+    def setUp(self):
+        # Las versiones de factores y catálogos se repiten entre pruebas (cada
+        # una revierte su transacción), así que los registros en memoria se
+        # vacían del todo, no solo se invalidan
+        cache.clear()
+        registro_factores.__init__()
+        registro_catalogos.__init__()
+
+    def cliente(self, usuario):
+        cliente = APIClient()
+        cliente.force_authenticate(usuario)
+        return cliente
+
+    def assertAgregadosIguales(self, incrementales, reconstruidos):
+        for usuario_id, esperadas in reconstruidos[0].items():
+            for campo in CAMPOS_ESTADISTICAS:
+                if isinstance(esperadas[campo], float):
+                    self.assertAlmostEqual(incrementales[0][usuario_id][campo], esperadas[campo], places=6)
+                else:
+                    self.assertEqual(incrementales[0][usuario_id][campo], esperadas[campo], (usuario_id, campo))
+        self.assertEqual(incrementales[0].keys(), reconstruidos[0].keys())
+        self.assertEqual(incrementales[1], reconstruidos[1])
+        self.assertEqual(incrementales[2], reconstruidos[2])
@@ -0,0 +1,18 @@
+from ..models import Usuario
+from .base import BaseTests
+
+
+class ActualizacionRegistroTests(BaseTests):
+    def test_patch_de_un_detalle_no_relee_ni_repite_updates(self):
+        usuario = Usuario.objects.create(username='usuario', pais='MX')
+        cliente = self.cliente(usuario)
+        registro_id = cliente.post('/api/huella-carbono/', {
+            'detalle_transporte': {'km_vehiculo_gasolina': 100}
+        }, format='json').json()['id']
+
+        with self.captureOnCommitCallbacks(execute=True), self.assertNumQueries(12):
+            respuesta = cliente.patch(f'/api/huella-carbono/{registro_id}/', {
+                'detalle_transporte': {'km_vehiculo_gasolina': 250}
+            }, format='json')
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertEqual(respuesta.json()['detalle_transporte']['km_vehiculo_gasolina'], 250)
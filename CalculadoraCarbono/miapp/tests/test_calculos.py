@@ -0,0 +1,56 @@
+import datetime
+import random
+
+import numpy as np
+from django.utils import timezone
+
+from ..calculos import DETALLES, calcular_huellas, cargar_columnas, recalcular_huellas
+from ..factores import factores_para_usuario
+from ..models import FactorEmision, RegistroHuellaCarbono, Usuario
+from ..serializers import RegistroHuellaCarbonoSerializer
+from .base import CAMPOS_HUELLA, BaseTests, datos_aleatorios, huellas
+
+
+# Motor vectorizado frente a los métodos calcular_* de cada modelo
+class CalculoVectorizadoTests(BaseTests):
+    def setUp(self):
+        super().setUp()
+        FactorEmision.objects.create(
+            categoria='Transporte', subcategoria='Automóvil Gasolina', valor=0.3, unidad='kg CO2/km', region='México'
+        )
+        FactorEmision.objects.create(
+            categoria='Electricidad', subcategoria='Red Eléctrica', valor=0.9, unidad='kg CO2/kWh', region='CDMX',
+            vigente_desde=datetime.date(2024, 3, 1), vigente_hasta=datetime.date(2024, 6, 1)
+        )
+        generador = random.Random(1)
+        self.registros = []
+        for i, (region, pais) in enumerate([('CDMX', 'México'), ('Jalisco', 'México'), ('', 'Chile'), ('', '')]):
+            usuario = Usuario.objects.create(username=f'usuario{i}', region=region, pais=pais)
+            for _ in range(15):
+                fecha = timezone.make_aware(datetime.datetime(2024, 1, 1) + datetime.timedelta(days=generador.randint(0, 240)))
+                self.registros.append(RegistroHuellaCarbonoSerializer().create(
+                    dict(datos_aleatorios(generador), usuario=usuario, fecha=fecha)
+                ))
+
+    def test_calcular_huellas_coincide_con_los_metodos_por_registro(self):
+        for registro in self.registros:
+            registro_ids = np.array([registro.id])
+            columnas = {
+                categoria: cargar_columnas(modelo, campos, registro_ids)
+                for categoria, modelo, campos in DETALLES
+            }
+            resultado = calcular_huellas(
+                columnas, [registro.reduccion_por_reciclaje], factores_para_usuario(registro.usuario, registro.fecha)
+            )
+            for campo in CAMPOS_HUELLA:
+                self.assertAlmostEqual(float(resultado[campo][0]), getattr(registro, campo), places=6)
+
+    def test_recalcular_huellas_restaura_las_huellas_por_registro(self):
+        esperadas = {registro.id: huellas(registro) for registro in self.registros}
+        RegistroHuellaCarbono.objects.update(huella_total=0, huella_consumo=0, huella_transporte=0)
+
+        recalcular_huellas(tamano_lote=7)
+
+        for registro in RegistroHuellaCarbono.objects.all():
+            for obtenido, esperado in zip(huellas(registro), esperadas[registro.id]):
+                self.assertAlmostEqual(obtenido, esperado, places=6)
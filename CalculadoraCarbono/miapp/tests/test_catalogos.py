@@ -0,0 +1,17 @@
+from ..models import Material, Usuario
+from .base import BaseTests
+
+
+class CatalogosTests(BaseTests):
+    def test_304_sin_consultas_hasta_que_cambia_el_catalogo(self):
+        cliente = self.cliente(Usuario.objects.create(username='usuario'))
+        Material.objects.create(nombre='Vidrio', tipo='VIDRIO', valor_por_unidad=1, factor_reduccion_co2=0.3)
+        etag = cliente.get('/api/materiales/')['ETag']
+        with self.assertNumQueries(0):
+            self.assertEqual(cliente.get('/api/materiales/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Material.objects.create(nombre='PET', tipo='PLASTICO', valor_por_unidad=3, factor_reduccion_co2=1.5)
+        respuesta = cliente.get('/api/materiales/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertEqual(len(respuesta.json()), 2)
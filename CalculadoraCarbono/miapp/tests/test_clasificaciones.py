@@ -0,0 +1,68 @@
+import datetime
+from collections import Counter
+from io import StringIO
+from unittest import mock
+
+from django.core.management import call_command
+
+from .. import clasificaciones
+from ..models import ParticionClasificacion, ResumenMensualUsuario, Usuario
+from .base import BaseTests
+
+MES = datetime.date(2024, 3, 1)
+
+
+class AplicarIncrementosTests(BaseTests):
+    def setUp(self):
+        super().setUp()
+        self.usuario = Usuario.objects.create(username='usuario', pais='MX', region='Norte')
+
+    def aplicar_lotes(self):
+        clasificaciones.aplicar_incrementos(Counter({
+            (self.usuario.id, MES, 'numero_registros'): 2, (self.usuario.id, MES, 'suma_huella_total'): 30.5,
+        }))
+        clasificaciones.aplicar_incrementos(Counter({
+            (self.usuario.id, MES, 'numero_registros'): -1, (self.usuario.id, MES, 'suma_huella_total'): -10.0,
+            (self.usuario.id, MES, 'kg_reciclados'): 4.0,
+        }))
+        return set(ResumenMensualUsuario.objects.values_list(
+            'usuario_id', 'mes', 'pais', 'region', 'numero_registros', 'suma_huella_total', 'kg_reciclados'
+        ))
+
+    def test_sin_upsert_el_resultado_es_el_mismo(self):
+        con_upsert = self.aplicar_lotes()
+        ResumenMensualUsuario.objects.all().delete()
+        with mock.patch('miapp.calculos._admite_upsert', return_value=False):
+            self.assertEqual(self.aplicar_lotes(), con_upsert)
+        self.assertEqual(con_upsert, {(self.usuario.id, MES, 'MX', 'Norte', 1, 20.5, 4.0)})
+        # Las particiones del mes y del siguiente quedan pendientes
+        self.assertEqual(
+            set(ParticionClasificacion.objects.filter(pendiente=True).values_list('mes', 'pais', 'region')),
+            {(MES, 'MX', ''), (MES, 'MX', 'Norte'), (clasificaciones.mes_siguiente(MES), 'MX', ''),
+             (clasificaciones.mes_siguiente(MES), 'MX', 'Norte')}
+        )
+
+
+class LecturaClasificacionTests(BaseTests):
+    def test_leer_no_refresca_la_particion(self):
+        usuarios = [Usuario.objects.create(username=f'usuario{i}', pais='MX') for i in range(3)]
+        for i, usuario in enumerate(usuarios):
+            self.cliente(usuario).post('/api/huella-carbono/', {
+                'fecha': '2024-03-10T10:00:00Z', 'detalle_transporte': {'km_autobus': 100 * (i + 1)}
+            }, format='json')
+        ParticionClasificacion.objects.update(actualizada=datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc))
+        cliente = self.cliente(usuarios[0])
+        url = '/api/usuarios/clasificacion/?metrica=huella&ambito=pais&mes=2024-03'
+
+        with self.assertNumQueries(3):
+            respuesta = cliente.get(url).json()
+        self.assertTrue(respuesta['pendiente'])
+        self.assertEqual(respuesta['clasificacion'], [])
+        self.assertIsNone(respuesta['usuario'])
+        self.assertFalse(ResumenMensualUsuario.objects.filter(posicion_huella_pais__isnull=False).exists())
+
+        call_command('refrescar_clasificaciones', stdout=StringIO())
+        respuesta = cliente.get(url).json()
+        self.assertFalse(respuesta['pendiente'])
+        self.assertEqual([fila['usuario'] for fila in respuesta['clasificacion']], ['usuario0', 'usuario1', 'usuario2'])
+        self.assertEqual(respuesta['usuario']['posicion'], 1)
@@ -0,0 +1,26 @@
+from ..models import Usuario
+from .base import BaseTests
+
+
+class EscenariosTests(BaseTests):
+    def test_entradas_invalidas_devuelven_400(self):
+        usuario = Usuario.objects.create(username='usuario')
+        cliente = self.cliente(usuario)
+        registro_id = cliente.post(
+            '/api/huella-carbono/', {'detalle_transporte': {'km_vehiculo_gasolina': 100}}, format='json'
+        ).json()['id']
+        url = f'/api/huella-carbono/{registro_id}/escenarios/'
+        eje = {'campo': 'km_vehiculo_gasolina', 'valores': [1, 2]}
+
+        for datos in (
+            {'ejes': [{'campo': ['km_vehiculo_gasolina'], 'valores': [1]}]},
+            {'ejes': [{'campo': 'km_vehiculo_gasolina', 'valores': [10 ** 400]}]},
+            {'ejes': [{'campo': 'km_vehiculo_gasolina', 'traslado': [0.5], 'hacia': {'campo': 'km_autobus'}}]},
+            {'ejes': [eje], 'limite': 'diez'},
+            {'ejes': [eje], 'limite': [1]},
+        ):
+            self.assertEqual(cliente.post(url, datos, format='json').status_code, 400, datos)
+
+        respuesta = cliente.post(url, {'ejes': [eje], 'limite': 1}, format='json')
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertEqual(len(respuesta.json()['escenarios']), 1)
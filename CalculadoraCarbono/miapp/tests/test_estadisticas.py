@@ -0,0 +1,130 @@
+import datetime
+import random
+
+from ..calculos import propagar_cambios_factores
+from ..clasificaciones import reconstruir_resumenes
+from ..estadisticas import recalcular_estadisticas
+from ..models import EstadisticasUsuario, FactorEmision, Material, ResumenMensualUsuario, Usuario
+from ..percentiles import reconstruir_histogramas
+from .base import BaseTests, agregados
+
+
+# Estadísticas, histogramas y resúmenes incrementales frente a su reconstrucción
+class AgregadosIncrementalesTests(BaseTests):
+    def test_escrituras_aleatorias_coinciden_con_la_reconstruccion(self):
+        generador = random.Random(11)
+        usuarios = [
+            Usuario.objects.create(
+                username=f'usuario{i}', pais=generador.choice(['MX', 'CL']), region=generador.choice(['', 'Norte'])
+            )
+            for i in range(3)
+        ]
+        material = Material.objects.create(nombre='PET', tipo='PLASTICO', valor_por_unidad=3, factor_reduccion_co2=1.5)
+        registros = {usuario.id: [] for usuario in usuarios}
+
+        for _ in range(120):
+            usuario = generador.choice(usuarios)
+            cliente = self.cliente(usuario)
+            fecha = f'2024-{generador.randint(1, 6):02d}-{generador.randint(1, 28):02d}T10:00:00Z'
+            operacion = generador.random()
+            if operacion < 0.4 or not registros[usuario.id]:
+                respuesta = cliente.post('/api/huella-carbono/', {
+                    'fecha': fecha, 'detalle_transporte': {'km_autobus': generador.choice([10, 50, 100, 300])}
+                }, format='json')
+                self.assertEqual(respuesta.status_code, 201)
+                registros[usuario.id].append(respuesta.json()['id'])
+            elif operacion < 0.75:
+                cambios = {}
+                if generador.random() < 0.5:
+                    cambios['fecha'] = fecha
+                if generador.random() < 0.7:
+                    cambios['detalle_transporte'] = {'km_autobus': generador.choice([10, 50, 100, 300, 700])}
+                registro_id = generador.choice(registros[usuario.id])
+                respuesta = cliente.patch(f'/api/huella-carbono/{registro_id}/', cambios, format='json')
+                self.assertEqual(respuesta.status_code, 200)
+            elif operacion < 0.9:
+                reciclaje = cliente.post('/api/reciclaje/', {
+                    'fecha': fecha, 'registro_huella': generador.choice(registros[usuario.id])
+                }, format='json').json()
+                respuesta = cliente.post(f"/api/reciclaje/{reciclaje['id']}/agregar_materiales/", {
+                    'materiales': [{'material': material.id, 'cantidad': generador.randint(1, 5)}]
+                }, format='json')
+                self.assertEqual(respuesta.status_code, 201)
+            else:
+                registro_id = registros[usuario.id].pop(generador.randrange(len(registros[usuario.id])))
+                self.assertEqual(cliente.delete(f'/api/huella-carbono/{registro_id}/').status_code, 204)
+
+        incrementales = agregados()
+        recalcular_estadisticas([usuario.id for usuario in usuarios])
+        reconstruir_histogramas()
+        reconstruir_resumenes()
+        self.assertAgregadosIguales(incrementales, agregados())
+
+
+# Las escrituras en bloque no envían señales: sus efectos deben coincidir con la reconstrucción
+class EscriturasEnBloqueTests(BaseTests):
+    def assertCoincideConLaReconstruccion(self):
+        incrementales = agregados()
+        recalcular_estadisticas(Usuario.objects.values_list('id', flat=True))
+        reconstruir_histogramas()
+        reconstruir_resumenes()
+        self.assertAgregadosIguales(incrementales, agregados())
+
+    def test_alta_en_lote_y_recalculo_por_factores(self):
+        usuario = Usuario.objects.create(username='usuario', pais='MX', region='Norte')
+        otro = Usuario.objects.create(username='otro', pais='MX')
+        cliente = self.cliente(usuario)
+        for km in (10, 400):
+            cliente.post('/api/huella-carbono/', {
+                'fecha': '2024-02-10T10:00:00Z', 'detalle_transporte': {'km_autobus': km}
+            }, format='json')
+        self.cliente(otro).post('/api/huella-carbono/', {'detalle_transporte': {'km_autobus': 50}}, format='json')
+
+        respuesta = cliente.post('/api/huella-carbono/lote/', {'registros': [
+            {'fecha': '2024-03-01T10:00:00Z', 'detalle_transporte': {'km_autobus': 1000}},
+            {'fecha': 'no es una fecha'},
+            {'fecha': '2024-01-05T10:00:00Z', 'detalle_transporte': {'km_autobus': 1}},
+        ]}, format='json')
+        self.assertEqual(len(respuesta.json()['creados']), 2)
+        self.assertEqual(EstadisticasUsuario.objects.get(usuario=usuario).numero_registros, 4)
+        self.assertCoincideConLaReconstruccion()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            FactorEmision.objects.create(categoria='Transporte', subcategoria='Autobús', valor=2, unidad='kg CO2/km')
+        self.assertEqual(propagar_cambios_factores(tamano_lote=2)[1], 5)
+        self.assertCoincideConLaReconstruccion()
+
+    def test_materiales_de_reciclaje(self):
+        usuario = Usuario.objects.create(username='usuario', pais='CL', region='Sur')
+        cliente = self.cliente(usuario)
+        pet = Material.objects.create(nombre='PET', tipo='PLASTICO', valor_por_unidad=3, factor_reduccion_co2=1.5)
+        vidrio = Material.objects.create(nombre='Vidrio', tipo='VIDRIO', valor_por_unidad=1, factor_reduccion_co2=0.3)
+        registros = [
+            cliente.post('/api/huella-carbono/', {
+                'fecha': fecha, 'detalle_transporte': {'km_autobus': 200}
+            }, format='json').json()['id']
+            for fecha in ('2024-04-02T10:00:00Z', '2024-05-02T10:00:00Z')
+        ]
+
+        # Con materiales al crear, añadidos después y sin registro de huella
+        cliente.post('/api/reciclaje/', {
+            'fecha': '2024-04-03T10:00:00Z', 'registro_huella': registros[0],
+            'materiales': [{'material': pet.id, 'cantidad': 4}],
+        }, format='json')
+        reciclaje = cliente.post('/api/reciclaje/', {
+            'fecha': '2024-05-03T10:00:00Z', 'registro_huella': registros[1]
+        }, format='json').json()
+        respuesta = cliente.post(f"/api/reciclaje/{reciclaje['id']}/agregar_materiales/", {
+            'materiales': [{'material': pet.id, 'cantidad': 2}, {'material': vidrio.id, 'cantidad': 10}]
+        }, format='json')
+        self.assertEqual(respuesta.status_code, 201)
+        cliente.post('/api/reciclaje/', {
+            'fecha': '2024-05-20T10:00:00Z', 'materiales': [{'material': vidrio.id, 'cantidad': 1}]
+        }, format='json')
+
+        estadisticas = EstadisticasUsuario.objects.get(usuario=usuario)
+        self.assertAlmostEqual(estadisticas.suma_reduccion_por_reciclaje, 4 * 1.5 + 2 * 1.5 + 10 * 0.3)
+        self.assertEqual(
+            ResumenMensualUsuario.objects.get(usuario=usuario, mes=datetime.date(2024, 5, 1)).kg_reciclados, 13
+        )
+        self.assertCoincideConLaReconstruccion()
@@ -0,0 +1,116 @@
+import datetime
+from unittest import mock
+
+from django.utils import timezone
+
+from ..factores import INTERVALO_VERIFICACION, LineaTemporal, clave_de_factor, obtener_factores
+from ..models import FactorEmision, Usuario, VersionFactores
+from .base import BaseTests
+
+
+class RegistroFactoresTests(BaseTests):
+    def test_otros_procesos_ven_el_cambio_tras_el_intervalo(self):
+        clave = clave_de_factor('Transporte', 'Autobús')
+        anterior = obtener_factores()[clave]
+        # Un cambio hecho por otro proceso: sin señales ni invalidación local
+        FactorEmision.objects.bulk_create([
+            FactorEmision(categoria='Transporte', subcategoria='Autobús', valor=anterior + 1, unidad='kg')
+        ])
+        VersionFactores.objects.create(motivo='otro proceso')
+        self.assertEqual(obtener_factores()[clave], anterior)
+
+        ahora = timezone.now().timestamp()
+        with mock.patch('miapp.factores.time.monotonic', return_value=ahora + 10 * INTERVALO_VERIFICACION):
+            self.assertEqual(obtener_factores()[clave], anterior + 1)
+
+
+class PorRegionLoteTests(BaseTests):
+    def setUp(self):
+        super().setUp()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.defecto = FactorEmision.objects.create(
+                categoria='Transporte', subcategoria='Autobús', valor=0.1, unidad='kg CO2/km'
+            )
+            self.chile = FactorEmision.objects.create(
+                categoria='Transporte', subcategoria='Autobús', valor=0.3, unidad='kg CO2/km', region='Chile'
+            )
+        self.cliente_usuario = self.cliente(Usuario.objects.create(username='usuario'))
+
+    def test_cada_consulta_recibe_su_resultado_o_su_error(self):
+        consultas = [
+            {'categoria': 'Transporte', 'subcategoria': 'Autobús', 'region': 'Chile'},
+            {'categoria': 'Transporte', 'subcategoria': 'Autobús', 'region': 'Perú', 'fecha': '2024-01-01'},
+            {'categoria': 'Transporte', 'subcategoria': 'Nave espacial'},
+            {'subcategoria': 'Autobús'},
+            {'categoria': 'Transporte', 'fecha': '01/01/2024'},
+            'Transporte',
+        ]
+        url = '/api/factores-emision/por_region_lote/'
+        self.cliente_usuario.post(url, {'consultas': consultas[:1]}, format='json')
+        # Con el índice en memoria cargado, el lote no consulta la base de datos
+        with self.assertNumQueries(0):
+            respuesta = self.cliente_usuario.post(url, {'consultas': consultas}, format='json')
+        self.assertEqual(respuesta.status_code, 200)
+        resultados = respuesta.json()
+        self.assertEqual([resultado['consulta'] for resultado in resultados], consultas)
+        self.assertEqual(resultados[0]['factor']['id'], self.chile.id)
+        # Sin factor regional se usa el de region vacía
+        self.assertEqual(resultados[1]['factor']['id'], self.defecto.id)
+        self.assertIsNone(resultados[2]['factor'])
+        self.assertEqual(
+            [sorted(resultado) for resultado in resultados[3:]], [['consulta', 'error']] * 3
+        )
+        self.assertIn('fecha', resultados[4]['error'])
+
+    def test_el_lote_vacio_o_demasiado_grande_se_rechaza(self):
+        url = '/api/factores-emision/por_region_lote/'
+        self.assertEqual(self.cliente_usuario.post(url, {'consultas': []}, format='json').status_code, 400)
+        consultas = [{'categoria': 'Transporte'}] * 501
+        self.assertEqual(self.cliente_usuario.post(url, {'consultas': consultas}, format='json').status_code, 400)
+
+
+class FactoresHistoricosTests(BaseTests):
+    def test_linea_temporal_desde_intervalos(self):
+        dia = datetime.date(2024, 1, 1).toordinal()
+        linea = LineaTemporal.desde_intervalos([
+            (None, None, 'base'),
+            (dia, dia + 10, 'a'),
+            (dia + 5, None, 'b'),
+            (dia + 20, dia + 30, None),
+        ])
+        self.assertEqual(
+            [linea.en(ordinal) for ordinal in (0, dia - 1, dia, dia + 4, dia + 5, dia + 19, dia + 20, dia + 29, dia + 30)],
+            ['base', 'base', 'a', 'a', 'b', 'b', None, None, 'b']
+        )
+        # Los tramos contiguos con el mismo valor se funden
+        self.assertEqual(linea.inicios, [0, dia, dia + 5, dia + 20, dia + 30])
+
+    def test_las_fechas_pasadas_usan_el_factor_vigente_entonces(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            defecto = FactorEmision.objects.create(
+                categoria='Electricidad', subcategoria='Red Eléctrica', valor=0.5, unidad='kg CO2/kWh'
+            )
+            antiguo = FactorEmision.objects.create(
+                categoria='Electricidad', subcategoria='Red Eléctrica', valor=0.8, unidad='kg CO2/kWh', region='CDMX',
+                vigente_hasta=datetime.date(2024, 3, 1)
+            )
+            vigente = FactorEmision.objects.create(
+                categoria='Electricidad', subcategoria='Red Eléctrica', valor=0.6, unidad='kg CO2/kWh', region='CDMX',
+                vigente_desde=datetime.date(2024, 6, 1)
+            )
+        clave = clave_de_factor('Electricidad', 'Red Eléctrica')
+        casos = (
+            (datetime.date(2023, 12, 31), antiguo, 0.8),
+            (datetime.date(2024, 2, 29), antiguo, 0.8),
+            # Entre ambos tramos regionales se recurre al valor por defecto
+            (datetime.date(2024, 3, 1), defecto, 0.5),
+            (datetime.date(2024, 6, 1), vigente, 0.6),
+            (None, vigente, 0.6),
+        )
+        for fecha, factor, valor in casos:
+            self.assertEqual(FactorEmision.obtener_factor_por_region(
+                'Electricidad', 'Red Eléctrica', 'CDMX', fecha
+            ), factor, fecha)
+            self.assertEqual(obtener_factores('CDMX', 'México', fecha)[clave], valor, fecha)
+        # Otra región del mismo país, sin factor propio, usa el valor por defecto
+        self.assertEqual(obtener_factores('Jalisco', 'México', datetime.date(2024, 1, 1))[clave], 0.5)
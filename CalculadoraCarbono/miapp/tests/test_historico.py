@@ -0,0 +1,88 @@
+import datetime
+from unittest import mock
+
+from ..models import RegistroHuellaCarbono, Usuario
+from ..views import RegistroHuellaCarbonoViewSet
+from .base import BaseTests
+
+
+class HistoricoTests(BaseTests):
+    def setUp(self):
+        super().setUp()
+        # Ciudad de México: UTC-6 todo el año
+        self.usuario = Usuario.objects.create(username='usuario', zona_horaria='America/Mexico_City')
+        self.cliente_usuario = self.cliente(self.usuario)
+        for instante, huella in (
+            ('2024-01-31T23:00:00+00:00', 10),
+            # 31 de enero a las 21:00 en la zona del usuario, 1 de febrero en UTC
+            ('2024-02-01T03:00:00+00:00', 20),
+            ('2024-02-15T12:00:00+00:00', 40),
+            ('2024-03-04T12:00:00+00:00', 80),
+        ):
+            RegistroHuellaCarbono.objects.create(
+                usuario=self.usuario, fecha=datetime.datetime.fromisoformat(instante), huella_total=huella
+            )
+        RegistroHuellaCarbono.objects.create(
+            usuario=Usuario.objects.create(username='otro'),
+            fecha=datetime.datetime(2024, 2, 15, tzinfo=datetime.timezone.utc), huella_total=1000
+        )
+
+    def periodos(self, **parametros):
+        respuesta = self.cliente_usuario.get('/api/huella-carbono/historico/', parametros)
+        self.assertEqual(respuesta.status_code, 200)
+        return respuesta.json()
+
+    def resumen(self, datos):
+        return {fila['periodo']: (fila['numero_registros'], fila['huella_total']) for fila in datos['periodos']}
+
+    def test_agrupa_en_la_zona_horaria_del_usuario(self):
+        datos = self.periodos(granularidad='mes')
+        self.assertEqual(datos['zona_horaria'], 'America/Mexico_City')
+        self.assertFalse(datos['truncado'])
+        self.assertEqual(
+            self.resumen(datos),
+            {'2024-01': (2, 15), '2024-02': (1, 40), '2024-03': (1, 80)}
+        )
+        # La zona indicada en la consulta tiene prioridad
+        self.assertEqual(
+            self.resumen(self.periodos(granularidad='mes', zona_horaria='UTC')),
+            {'2024-01': (1, 10), '2024-02': (2, 30), '2024-03': (1, 80)}
+        )
+
+    def test_etiquetas_por_granularidad(self):
+        self.assertEqual(list(self.resumen(self.periodos(granularidad='dia'))), ['2024-01-31', '2024-02-15', '2024-03-04'])
+        # Las semanas se etiquetan con su lunes
+        self.assertEqual(list(self.resumen(self.periodos(granularidad='semana'))), ['2024-01-29', '2024-02-12', '2024-03-04'])
+        self.assertEqual(self.resumen(self.periodos(granularidad='anio')), {'2024': (4, 37.5)})
+
+    def test_rango_en_dias_locales(self):
+        self.assertEqual(
+            self.resumen(self.periodos(granularidad='dia', desde='2024-02-01', hasta='2024-02-15')),
+            {'2024-02-15': (1, 40)}
+        )
+        self.assertEqual(
+            self.resumen(self.periodos(granularidad='dia', desde='2024-02-01', hasta='2024-02-15', zona_horaria='UTC')),
+            {'2024-02-01': (1, 20), '2024-02-15': (1, 40)}
+        )
+
+    def test_conserva_los_periodos_mas_recientes(self):
+        with mock.patch.object(RegistroHuellaCarbonoViewSet, 'MAX_PERIODOS_HISTORICO', 2):
+            datos = self.periodos(granularidad='mes')
+        self.assertTrue(datos['truncado'])
+        self.assertEqual(list(self.resumen(datos)), ['2024-02', '2024-03'])
+
+    def test_sin_granularidad_pagina_con_fechas_locales(self):
+        datos = self.periodos(limite=3)
+        self.assertEqual([fila['huella_total'] for fila in datos['results']], [80, 40, 20])
+        self.assertEqual(
+            datetime.datetime.fromisoformat(datos['results'][2]['fecha']).utcoffset(), datetime.timedelta(hours=-6)
+        )
+        self.assertEqual([fila['huella_total'] for fila in self.cliente_usuario.get(datos['next']).json()['results']], [10])
+
+    def test_parametros_invalidos(self):
+        for parametros in (
+            {'granularidad': 'hora'}, {'zona_horaria': 'Marte/Olympus'}, {'desde': '2024-02-30'},
+        ):
+            respuesta = self.cliente_usuario.get('/api/huella-carbono/historico/', parametros)
+            self.assertEqual(respuesta.status_code, 400)
+            self.assertIn('error', respuesta.json())
@@ -0,0 +1,152 @@
+import datetime
+import io
+import json
+
+from django.core.exceptions import ValidationError
+from django.utils import timezone
+
+from ..clasificaciones import reconstruir_resumenes
+from ..estadisticas import recalcular_estadisticas
+from ..importacion import importar_actividad, validar_fila
+from ..models import DetalleEnergia, DetalleTransporte, EstadisticasUsuario, RegistroHuellaCarbono, Usuario
+from ..percentiles import reconstruir_histogramas
+from .base import BaseTests, agregados
+
+
+class ValidarFilaTests(BaseTests):
+    def errores(self, fila):
+        with self.assertRaises(ValidationError) as contexto:
+            validar_fila(fila)
+        return contexto.exception.message_dict
+
+    def test_convierte_los_campos_de_cada_detalle(self):
+        usuario, fecha, valores = validar_fila({
+            'usuario': ' ana ', 'fecha': '2024-03-05', 'consumo_electricidad_kwh': '120.5',
+            'tipo_calefaccion': 'GAS', 'km_autobus': '30', 'km_tren_metro': '',
+        })
+        self.assertEqual(usuario, ('username', 'ana'))
+        self.assertEqual(fecha, datetime.date(2024, 3, 5))
+        self.assertEqual(valores, {
+            DetalleEnergia: {'consumo_electricidad_kwh': 120.5, 'tipo_calefaccion': 'GAS'},
+            DetalleTransporte: {'km_autobus': 30.0},
+        })
+        # usuario_id tiene prioridad sobre usuario
+        self.assertEqual(validar_fila({'usuario_id': '7', 'usuario': 'ana', 'fecha': '2024-03-05', 'km_autobus': 1})[0], ('id', 7))
+
+    def test_errores_por_campo(self):
+        self.assertEqual(
+            set(self.errores({'usuario_id': 'x', 'fecha': '05/03/2024', 'km_autobus': 'mucho'})),
+            {'usuario_id', 'fecha', 'km_autobus'}
+        )
+        self.assertIn('usuario', self.errores({'fecha': '2024-03-05', 'km_autobus': 1}))
+        self.assertIn('__all__', self.errores({'usuario': 'ana', 'fecha': '2024-03-05', 'otro': 1}))
+        with self.assertRaises(ValidationError):
+            validar_fila(None)
+
+
+class ImportarActividadTests(BaseTests):
+    def setUp(self):
+        super().setUp()
+        self.ana = Usuario.objects.create(username='ana', pais='MX', region='Norte')
+        self.luis = Usuario.objects.create(username='luis', pais='MX')
+
+    def importar(self, texto, formato, tamano_lote=1000):
+        rechazos = io.StringIO()
+        resumen = importar_actividad(io.StringIO(texto), formato, tamano_lote=tamano_lote, rechazos=rechazos)
+        return resumen, [json.loads(linea) for linea in rechazos.getvalue().splitlines()]
+
+    def registros(self):
+        return {
+            (registro.usuario.username, timezone.localtime(registro.fecha).date()): (
+                registro.detalle_energia.consumo_electricidad_kwh if hasattr(registro, 'detalle_energia') else None,
+                registro.detalle_transporte.km_autobus if hasattr(registro, 'detalle_transporte') else None,
+                round(registro.huella_total, 9),
+            )
+            for registro in RegistroHuellaCarbono.objects.select_related(
+                'usuario', 'detalle_energia', 'detalle_transporte'
+            )
+        }
+
+    def test_csv_y_ndjson_dan_el_mismo_resultado(self):
+        csv = (
+            'usuario,usuario_id,fecha,consumo_electricidad_kwh,km_autobus\n'
+            'ana,,2024-03-05,120,\n'
+            f',{self.luis.id},2024-03-05,,40\n'
+            'ana,,2024-03-06,80,15\n'
+        )
+        ndjson = '\n'.join(json.dumps(fila) for fila in (
+            {'usuario': 'ana', 'fecha': '2024-03-05', 'consumo_electricidad_kwh': 120},
+            {'usuario_id': self.luis.id, 'fecha': '2024-03-05', 'km_autobus': 40},
+            {},
+            {'usuario': 'ana', 'fecha': '2024-03-06', 'consumo_electricidad_kwh': 80, 'km_autobus': 15},
+        ))
+        resumen, _ = self.importar(csv, 'csv')
+        self.assertEqual(resumen, {'leidas': 3, 'importadas': 3, 'rechazadas': 0})
+        desde_csv = self.registros()
+        self.assertEqual(len(desde_csv), 3)
+
+        RegistroHuellaCarbono.objects.all().delete()
+        resumen, rechazos = self.importar(ndjson, 'ndjson')
+        self.assertEqual(resumen, {'leidas': 4, 'importadas': 3, 'rechazadas': 1})
+        self.assertEqual(rechazos[0]['linea'], 3)
+        self.assertEqual(self.registros(), desde_csv)
+
+    def test_filas_rechazadas_y_usuarios_inexistentes(self):
+        resumen, rechazos = self.importar(
+            'usuario,fecha,km_autobus\n'
+            'ana,2024-03-05,10\n'
+            'nadie,2024-03-05,10\n'
+            'ana,ayer,10\n'
+            'ana,2024-03-05,\n',
+            'csv', tamano_lote=2
+        )
+        self.assertEqual(resumen, {'leidas': 4, 'importadas': 1, 'rechazadas': 3})
+        self.assertEqual(
+            sorted((rechazo['linea'], sorted(rechazo['errores'])) for rechazo in rechazos),
+            [(3, ['usuario']), (4, ['fecha']), (5, ['__all__'])]
+        )
+        desconocido, = (rechazo for rechazo in rechazos if rechazo['linea'] == 3)
+        self.assertEqual(desconocido['fila']['usuario'], 'nadie')
+        self.assertEqual(RegistroHuellaCarbono.objects.count(), 1)
+
+    def test_actualiza_el_registro_del_mismo_dia(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            existente = self.cliente(self.ana).post('/api/huella-carbono/', {
+                'fecha': '2024-03-05T15:00:00Z',
+                'detalle_energia': {'consumo_electricidad_kwh': 50, 'consumo_agua_m3': 3},
+            }, format='json').json()
+        self.importar(
+            'usuario,fecha,consumo_electricidad_kwh,km_autobus\n'
+            'ana,2024-03-05,200,\n'
+            'ana,2024-03-05,,25\n',
+            'csv'
+        )
+        registro = RegistroHuellaCarbono.objects.get()
+        self.assertEqual(registro.id, existente['id'])
+        # Las filas del mismo día se combinan y los campos ausentes conservan su valor
+        self.assertEqual(registro.detalle_energia.consumo_electricidad_kwh, 200)
+        self.assertEqual(registro.detalle_energia.consumo_agua_m3, 3)
+        self.assertEqual(registro.detalle_transporte.km_autobus, 25)
+        self.assertGreater(registro.huella_total, existente['huella_total'])
+        self.assertEqual(EstadisticasUsuario.objects.get(usuario=self.ana).numero_registros, 1)
+
+    def test_agregados_de_los_registros_nuevos(self):
+        self.cliente(self.luis).post('/api/huella-carbono/', {
+            'fecha': '2024-02-01T10:00:00Z', 'detalle_transporte': {'km_autobus': 70}
+        }, format='json')
+        self.importar(
+            'usuario,fecha,consumo_electricidad_kwh,km_autobus\n'
+            'ana,2024-03-05,200,\n'
+            'ana,2024-04-01,,25\n'
+            'luis,2024-02-01,90,\n'
+            'luis,2024-03-31,10,5\n',
+            'csv', tamano_lote=3
+        )
+        self.assertEqual(EstadisticasUsuario.objects.get(usuario=self.ana).numero_registros, 2)
+        self.assertEqual(EstadisticasUsuario.objects.get(usuario=self.luis).numero_registros, 2)
+
+        incrementales = agregados()
+        recalcular_estadisticas([self.ana.id, self.luis.id])
+        reconstruir_histogramas()
+        reconstruir_resumenes()
+        self.assertAgregadosIguales(incrementales, agregados())
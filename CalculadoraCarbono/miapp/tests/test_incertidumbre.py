@@ -0,0 +1,67 @@
+import random
+
+from ..incertidumbre import bandas_registro, bandas_registros
+from ..models import FactorEmision, RegistroHuellaCarbono, Usuario
+from ..serializers import RegistroHuellaCarbonoSerializer
+from .base import CAMPOS_HUELLA, BaseTests, datos_aleatorios
+
+
+class BandasIncertidumbreTests(BaseTests):
+    def setUp(self):
+        super().setUp()
+        with self.captureOnCommitCallbacks(execute=True):
+            FactorEmision.objects.create(
+                categoria='Transporte', subcategoria='Automóvil Gasolina', valor=0.2, unidad='kg CO2/km',
+                distribucion='LOGNORMAL', incertidumbre=0.3
+            )
+            FactorEmision.objects.create(
+                categoria='Electricidad', subcategoria='Red Eléctrica', valor=0.4, unidad='kg CO2/kWh', region='Chile',
+                distribucion='NORMAL', incertidumbre=0.2
+            )
+        generador = random.Random(9)
+        for i, pais in enumerate(('México', 'Chile')):
+            usuario = Usuario.objects.create(username=f'usuario{i}', pais=pais)
+            for _ in range(4):
+                datos = datos_aleatorios(generador)
+                datos['detalle_transporte'] = {'km_vehiculo_gasolina': generador.random() * 500}
+                RegistroHuellaCarbonoSerializer().create(dict(datos, usuario=usuario))
+        self.usuario = usuario
+        self.registro = RegistroHuellaCarbono.objects.filter(usuario=usuario).first()
+
+    def incertidumbre(self, **parametros):
+        return self.cliente(self.usuario).get(f'/api/huella-carbono/{self.registro.id}/incertidumbre/', parametros)
+
+    def test_la_misma_semilla_da_las_mismas_bandas(self):
+        primera = self.incertidumbre(muestras=3000, semilla=42).json()
+        self.assertEqual(self.incertidumbre(muestras=3000, semilla=42).json(), primera)
+        self.assertNotEqual(self.incertidumbre(muestras=3000, semilla=43).json()['bandas'], primera['bandas'])
+        total = primera['bandas']['huella_total']
+        self.assertLess(total['p5'], total['p50'])
+        self.assertLess(total['p50'], total['p95'])
+        self.assertEqual(set(primera['distribuciones']), {'gasolina', 'electricidad'})
+
+    def test_el_informe_coincide_con_la_api_sea_cual_sea_el_lote(self):
+        por_registro = {
+            registro.id: bandas_registro(registro, muestras=500, semilla=7)['bandas']
+            for registro in RegistroHuellaCarbono.objects.select_related('usuario')
+        }
+        for tamano_lote in (3, 1000):
+            informe = dict(bandas_registros(RegistroHuellaCarbono.objects.all(), muestras=500, semilla=7, tamano_lote=tamano_lote))
+            self.assertEqual(informe.keys(), por_registro.keys())
+            for registro_id, bandas in informe.items():
+                for campo in CAMPOS_HUELLA:
+                    for percentil, valor in bandas[campo].items():
+                        self.assertAlmostEqual(valor, por_registro[registro_id][campo][percentil], places=6)
+
+    def test_sin_distribuciones_las_bandas_son_la_estimacion_puntual(self):
+        bandas = self.cliente(self.usuario).post(
+            f'/api/huella-carbono/{self.registro.id}/incertidumbre/',
+            {'semilla': 1, 'distribuciones': {'gasolina': {}, 'electricidad': {}}}, format='json'
+        ).json()['bandas']
+        for campo in CAMPOS_HUELLA:
+            self.assertEqual(len({round(valor, 6) for valor in bandas[campo].values()}), 1, campo)
+            self.assertAlmostEqual(bandas[campo]['p50'], getattr(self.registro, campo), places=6)
+
+    def test_parametros_invalidos(self):
+        for parametros in ({'muestras': 0}, {'muestras': 'x'}, {'semilla': -1}):
+            self.assertEqual(self.incertidumbre(**parametros).status_code, 400, parametros)
@@ -0,0 +1,42 @@
+import datetime
+
+from django.utils import timezone
+
+from ..models import RegistroHuellaCarbono, Usuario
+from .base import BaseTests
+
+
+class PaginacionCursorTests(BaseTests):
+    def test_recorre_todos_los_registros_en_orden_sin_repetir(self):
+        usuario = Usuario.objects.create(username='usuario')
+        otro = Usuario.objects.create(username='otro')
+        inicio = timezone.make_aware(datetime.datetime(2024, 1, 1))
+        for i in range(25):
+            # Fechas repetidas: el desempate es por id
+            RegistroHuellaCarbono.objects.create(usuario=usuario, fecha=inicio + datetime.timedelta(days=i // 3))
+        RegistroHuellaCarbono.objects.create(usuario=otro, fecha=inicio)
+        esperados = list(
+            RegistroHuellaCarbono.objects.filter(usuario=usuario).order_by('-fecha', '-id').values_list('id', flat=True)
+        )
+
+        cliente = self.cliente(usuario)
+        obtenidos = []
+        url = '/api/huella-carbono/?limite=10'
+        while url:
+            pagina = cliente.get(url).json()
+            self.assertLessEqual(len(pagina['results']), 10)
+            obtenidos += [registro['id'] for registro in pagina['results']]
+            url = pagina['next']
+        self.assertEqual(obtenidos, esperados)
+
+        # Hacia atrás desde la última página
+        pagina = cliente.get('/api/huella-carbono/?limite=10').json()
+        segunda = cliente.get(pagina['next']).json()
+        anterior = cliente.get(segunda['previous']).json()
+        self.assertEqual([r['id'] for r in anterior['results']], esperados[:10])
+
+    def test_limite_maximo(self):
+        usuario = Usuario.objects.create(username='usuario')
+        RegistroHuellaCarbono.objects.bulk_create([RegistroHuellaCarbono(usuario=usuario) for _ in range(205)])
+        pagina = self.cliente(usuario).get('/api/huella-carbono/?limite=1000').json()
+        self.assertEqual(len(pagina['results']), 200)
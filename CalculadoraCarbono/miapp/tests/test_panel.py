@@ -0,0 +1,99 @@
+import io
+from unittest import mock
+
+from django.db import transaction
+
+from .. import panel
+from ..importacion import importar_actividad
+from ..models import Material, Usuario
+from .base import BaseTests
+
+
+class PanelEnCacheTests(BaseTests):
+    def setUp(self):
+        super().setUp()
+        self.usuario = Usuario.objects.create(username='usuario')
+        self.otro = Usuario.objects.create(username='otro')
+        self.cliente_usuario = self.cliente(self.usuario)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.material = Material.objects.create(
+                nombre='PET', tipo='PLASTICO', valor_por_unidad=3, factor_reduccion_co2=1.5
+            )
+            self.registro = self.crear_registro(self.cliente_usuario, 50)
+
+    def crear_registro(self, cliente, km):
+        return cliente.post('/api/huella-carbono/', {'detalle_transporte': {'km_autobus': km}}, format='json').json()
+
+    def panel(self):
+        # Devuelve el dashboard y si hubo que construirlo de nuevo
+        with mock.patch.object(panel, 'construir_panel', wraps=panel.construir_panel) as construir:
+            respuesta = self.cliente_usuario.get('/api/usuarios/dashboard/')
+        self.assertEqual(respuesta.status_code, 200)
+        return respuesta.json(), construir.called
+
+    def assertEnCache(self):
+        _, construido = self.panel()
+        self.assertFalse(construido)
+
+    def assertReconstruido(self):
+        datos, construido = self.panel()
+        self.assertTrue(construido)
+        return datos
+
+    def test_se_sirve_desde_la_cache(self):
+        datos, construido = self.panel()
+        self.assertTrue(construido)
+        self.assertEqual(datos['huella_carbono']['id'], self.registro['id'])
+        self.assertEnCache()
+
+    def test_las_escrituras_del_usuario_invalidan_su_panel(self):
+        self.panel()
+        with self.captureOnCommitCallbacks(execute=True):
+            nuevo = self.crear_registro(self.cliente_usuario, 80)
+        self.assertEqual(self.assertReconstruido()['huella_carbono']['id'], nuevo['id'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            actualizado = self.cliente_usuario.patch(
+                f"/api/huella-carbono/{nuevo['id']}/", {'detalle_transporte': {'km_autobus': 500}}, format='json'
+            ).json()
+        self.assertEqual(self.assertReconstruido()['huella_carbono']['huella_total'], actualizado['huella_total'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            reciclaje = self.cliente_usuario.post('/api/reciclaje/', {'registro_huella': nuevo['id']}, format='json').json()
+        self.assertEqual([r['id'] for r in self.assertReconstruido()['reciclaje_reciente']], [reciclaje['id']])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.cliente_usuario.post(
+                f"/api/reciclaje/{reciclaje['id']}/agregar_materiales/",
+                {'materiales': [{'material': self.material.id, 'cantidad': 4}]}, format='json'
+            )
+        self.assertEqual(self.assertReconstruido()['reciclaje_reciente'][0]['kg_total_reciclado'], 4)
+        self.assertEnCache()
+
+    def test_la_importacion_masiva_invalida_el_panel(self):
+        self.panel()
+        with self.captureOnCommitCallbacks(execute=True):
+            importar_actividad(io.StringIO('usuario,fecha,km_autobus\nusuario,2099-01-01,30\n'), 'csv')
+        self.assertEqual(self.assertReconstruido()['huella_carbono']['fecha'][:10], '2099-01-01')
+
+    def test_las_escrituras_de_otros_usuarios_no_invalidan_el_panel(self):
+        self.panel()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.crear_registro(self.cliente(self.otro), 80)
+        self.assertEnCache()
+
+    def test_una_escritura_revertida_no_invalida_el_panel(self):
+        self.panel()
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                self.crear_registro(self.cliente_usuario, 80)
+                transaction.set_rollback(True)
+        self.assertEnCache()
+
+    def test_los_catalogos_invalidan_todos_los_paneles(self):
+        self.panel()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.material.valor_por_unidad = 4
+            self.material.save()
+        self.assertReconstruido()
+        self.assertEnCache()
@@ -0,0 +1,79 @@
+from collections import Counter
+from unittest import mock
+
+from ..calculos import recalcular_huellas
+from ..clasificaciones import reconstruir_resumenes
+from ..estadisticas import recalcular_estadisticas
+from ..models import HistogramaHuella, RegistroHuellaCarbono, Usuario
+from ..percentiles import aplicar_incrementos, indice, reconstruir_histogramas
+from ..serializers import RegistroHuellaCarbonoSerializer
+from .base import BaseTests, agregados
+
+
+class AplicarIncrementosTests(BaseTests):
+    def contenedores(self):
+        return set(HistogramaHuella.objects.values_list('pais', 'region', 'campo', 'indice', 'conteo'))
+
+    def aplicar_lotes(self):
+        aplicar_incrementos(Counter({('MX', '', 'huella_total', 3): 2, ('MX', 'Norte', 'huella_total', 3): 1}))
+        aplicar_incrementos(Counter({('MX', '', 'huella_total', 3): -1, ('MX', '', 'huella_total', 7): 1}))
+        return self.contenedores()
+
+    def test_sin_upsert_el_resultado_es_el_mismo(self):
+        con_upsert = self.aplicar_lotes()
+        HistogramaHuella.objects.all().delete()
+        with mock.patch('miapp.calculos._admite_upsert', return_value=False):
+            self.assertEqual(self.aplicar_lotes(), con_upsert)
+        self.assertEqual(con_upsert, {
+            ('MX', '', 'huella_total', 3, 1), ('MX', 'Norte', 'huella_total', 3, 1), ('MX', '', 'huella_total', 7, 1)
+        })
+
+
+class PercentilesPorUsuarioTests(BaseTests):
+    def setUp(self):
+        super().setUp()
+        self.muchos = Usuario.objects.create(username='muchos', pais='MX', region='Norte')
+        self.medio = Usuario.objects.create(username='medio', pais='MX', region='Norte')
+        self.alto = Usuario.objects.create(username='alto', pais='MX', region='Sur')
+        for _ in range(20):
+            self.crear(self.muchos, 1)
+        self.registro_medio = self.crear(self.medio, 50)
+        self.registro_alto = self.crear(self.alto, 1000)
+
+    def crear(self, usuario, km):
+        return RegistroHuellaCarbonoSerializer().create({'usuario': usuario, 'detalle_transporte': {'km_autobus': km}})
+
+    def assertCoincideConLaReconstruccion(self):
+        incrementales = agregados()
+        recalcular_estadisticas(Usuario.objects.values_list('id', flat=True))
+        reconstruir_histogramas()
+        reconstruir_resumenes()
+        self.assertAgregadosIguales(incrementales, agregados())
+
+    def test_cada_usuario_cuenta_una_vez(self):
+        self.registro_medio.refresh_from_db()
+        pais = self.registro_medio.comparar_con_promedio()['percentiles']['pais']
+        # Con un conteo por registro los 20 del primer usuario lo dejarían cerca del 93
+        self.assertEqual(pais['usuarios'], 3)
+        self.assertEqual(pais['percentiles']['huella_total'], 50)
+        self.assertEqual(self.registro_medio.comparar_con_promedio()['percentiles']['region']['usuarios'], 2)
+        self.assertEqual(reconstruir_histogramas(), 3)
+        self.assertEqual(agregados()[1][('MX', '', 'huella_total', indice(self.registro_medio.huella_total))], 1)
+
+    def test_las_escrituras_mueven_la_media_del_usuario(self):
+        cliente = self.cliente(self.muchos)
+        registro = RegistroHuellaCarbono.objects.filter(usuario=self.muchos).first()
+        cliente.patch(f'/api/huella-carbono/{registro.id}/', {'detalle_transporte': {'km_autobus': 400}}, format='json')
+        self.assertCoincideConLaReconstruccion()
+
+        cliente.delete(f'/api/huella-carbono/{registro.id}/')
+        self.cliente(self.alto).patch(
+            f'/api/huella-carbono/{self.registro_alto.id}/', {'detalle_transporte': {'km_autobus': 10}}, format='json'
+        )
+        self.assertCoincideConLaReconstruccion()
+
+        self.muchos.region = 'Sur'
+        self.muchos.save()
+        recalcular_huellas()
+        self.assertCoincideConLaReconstruccion()
+        self.assertEqual(HistogramaHuella.objects.filter(region='Norte', campo='huella_total').get().conteo, 1)
@@ -0,0 +1,62 @@
+import random
+from unittest import mock
+
+from django.test import override_settings
+
+from ..models import Material, RegistroReciclaje, Usuario
+from ..serializers import RegistroHuellaCarbonoSerializer
+from .base import BaseTests, datos_aleatorios
+
+
+# Consultas de listados y detalles con relaciones anidadas: fijas sea cual sea la página
+class PresupuestoConsultasTests(BaseTests):
+    def crear_registros(self, usuario, cantidad):
+        generador = random.Random(cantidad)
+        material = Material.objects.create(nombre='PET', tipo='PLASTICO', valor_por_unidad=3, factor_reduccion_co2=1.5)
+        vidrio = Material.objects.create(nombre='Vidrio', tipo='VIDRIO', valor_por_unidad=1, factor_reduccion_co2=0.3)
+        for _ in range(cantidad):
+            RegistroHuellaCarbonoSerializer().create(dict(datos_aleatorios(generador), usuario=usuario))
+            RegistroReciclaje.objects.create(usuario=usuario).agregar_materiales([
+                {'material': material, 'cantidad': generador.randint(1, 5)},
+                {'material': vidrio, 'cantidad': generador.randint(1, 5)},
+            ])
+
+    def comprobar_consultas(self, cantidad):
+        usuario = Usuario.objects.create(username=f'usuario{cantidad}')
+        self.crear_registros(usuario, cantidad)
+        cliente = self.cliente(usuario)
+        huella = usuario.registrohuellacarbono_set.values_list('id', flat=True).first()
+        reciclaje = usuario.registroreciclaje_set.values_list('id', flat=True).first()
+        # URL -> consultas: la principal y una por cada Prefetch (materiales)
+        esperadas = {
+            f'/api/huella-carbono/?limite={cantidad}': 1,
+            f'/api/huella-carbono/{huella}/': 1,
+            f'/api/huella-carbono/?limite={cantidad}&fields=id,fecha,huella_total': 1,
+            f'/api/huella-carbono/?limite={cantidad}&expand=detalle_transporte': 1,
+            f'/api/reciclaje/?limite={cantidad}': 2,
+            f'/api/reciclaje/{reciclaje}/': 2,
+            f'/api/reciclaje/?limite={cantidad}&fields=id,kg_total_reciclado': 1,
+            f'/api/reciclaje/?limite={cantidad}&expand=materiales': 2,
+        }
+        for url, consultas in esperadas.items():
+            with self.subTest(url=url), self.assertNoLogs('miapp.precarga'), self.assertNumQueries(consultas):
+                respuesta = cliente.get(url)
+            self.assertEqual(respuesta.status_code, 200)
+            if 'limite' in url:
+                self.assertEqual(len(respuesta.json()['results']), cantidad)
+
+    def test_pagina_pequena(self):
+        self.comprobar_consultas(5)
+
+    def test_pagina_grande(self):
+        self.comprobar_consultas(40)
+
+    @override_settings(DEBUG=True)
+    def test_exceder_el_presupuesto_solo_se_registra(self):
+        usuario = Usuario.objects.create(username='usuario')
+        self.crear_registros(usuario, 3)
+        with mock.patch('miapp.precarga.CONSULTAS_BASE', -1), self.assertLogs('miapp.precarga', 'WARNING') as registro:
+            respuesta = self.cliente(usuario).get('/api/reciclaje/')
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertEqual(len(respuesta.json()['results']), 3)
+        self.assertIn('RegistroReciclajeViewSet.list', registro.output[0])
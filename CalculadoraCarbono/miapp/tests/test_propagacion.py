@@ -0,0 +1,102 @@
+import random
+from unittest import mock
+
+from django.core.management import call_command
+from django.db import transaction
+
+from ..calculos import recalcular_huellas
+from ..models import CambioFactorPendiente, FactorEmision, RegistroHuellaCarbono, Usuario
+from ..serializers import RegistroHuellaCarbonoSerializer
+from .base import BaseTests, datos_aleatorios
+
+
+class PropagacionFactoresTests(BaseTests):
+    def setUp(self):
+        super().setUp()
+        generador = random.Random(5)
+        for i, (region, pais) in enumerate([('CDMX', 'México'), ('Jalisco', 'México'), ('', 'Chile')]):
+            usuario = Usuario.objects.create(username=f'usuario{i}', region=region, pais=pais)
+            for _ in range(10):
+                datos = datos_aleatorios(generador)
+                datos['detalle_transporte'] = {'km_vehiculo_gasolina': generador.random() * 500}
+                RegistroHuellaCarbonoSerializer().create(dict(datos, usuario=usuario))
+
+    def huellas_por_registro(self):
+        return {registro.id: round(registro.huella_total, 9) for registro in RegistroHuellaCarbono.objects.all()}
+
+    def propagar(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('propagar_factores', stdout=mock.Mock())
+
+    def test_el_cambio_se_encola_y_el_comando_recalcula_lo_afectado(self):
+        antes = self.huellas_por_registro()
+        with self.captureOnCommitCallbacks(execute=True):
+            FactorEmision.objects.create(
+                categoria='Transporte', subcategoria='Automóvil Gasolina', valor=0.5, unidad='kg CO2/km', region='México'
+            )
+        # Guardar el factor no recalcula nada
+        self.assertEqual(self.huellas_por_registro(), antes)
+        self.assertEqual(CambioFactorPendiente.objects.count(), 1)
+
+        self.propagar()
+        propagadas = self.huellas_por_registro()
+        self.assertFalse(CambioFactorPendiente.objects.exists())
+        cambiados = {registro_id for registro_id in antes if antes[registro_id] != propagadas[registro_id]}
+        self.assertEqual(
+            cambiados,
+            set(RegistroHuellaCarbono.objects.filter(usuario__pais='México').values_list('id', flat=True))
+        )
+
+        # Coincide con recalcular todo
+        recalcular_huellas()
+        for registro_id, huella in self.huellas_por_registro().items():
+            self.assertAlmostEqual(huella, propagadas[registro_id], places=6)
+
+    def test_el_cambio_de_ubicacion_recalcula_los_registros_del_usuario(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            FactorEmision.objects.create(
+                categoria='Transporte', subcategoria='Automóvil Gasolina', valor=0.5, unidad='kg CO2/km', region='Jalisco'
+            )
+        self.propagar()
+        antes = self.huellas_por_registro()
+
+        usuario = Usuario.objects.get(username='usuario0')
+        with self.captureOnCommitCallbacks(execute=True):
+            usuario.region = 'Jalisco'
+            usuario.save()
+        self.assertEqual(self.huellas_por_registro(), antes)
+        self.assertEqual(CambioFactorPendiente.objects.get().usuario, usuario)
+
+        self.propagar()
+        propagadas = self.huellas_por_registro()
+        self.assertFalse(CambioFactorPendiente.objects.exists())
+        cambiados = {registro_id for registro_id in antes if antes[registro_id] != propagadas[registro_id]}
+        self.assertEqual(cambiados, set(RegistroHuellaCarbono.objects.filter(usuario=usuario).values_list('id', flat=True)))
+
+        recalcular_huellas()
+        for registro_id, huella in self.huellas_por_registro().items():
+            self.assertAlmostEqual(huella, propagadas[registro_id], places=6)
+
+    def test_repetir_el_comando_continua_con_los_que_faltan(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            FactorEmision.objects.create(
+                categoria='Transporte', subcategoria='Automóvil Gasolina', valor=0.5, unidad='kg CO2/km'
+            )
+        with mock.patch('miapp.calculos.CambioFactorPendiente.objects.filter', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                self.propagar()
+        # Los registros ya quedaron con la versión vigente y el cambio sigue pendiente
+        self.assertTrue(CambioFactorPendiente.objects.exists())
+
+        with self.assertNumQueries(3):
+            self.propagar()
+        self.assertFalse(CambioFactorPendiente.objects.exists())
+
+    def test_rollback_no_deja_cambios_pendientes(self):
+        try:
+            with transaction.atomic():
+                FactorEmision.objects.create(categoria='Transporte', subcategoria='Autobús', valor=1, unidad='kg')
+                raise RuntimeError
+        except RuntimeError:
+            pass
+        self.assertFalse(CambioFactorPendiente.objects.exists())
@@ -0,0 +1,17 @@
+from ..management.commands.recalcular_huellas_paralelo import planear_fragmentos
+from ..models import RegistroHuellaCarbono, Usuario
+from .base import BaseTests
+
+
+class RecalculoParaleloTests(BaseTests):
+    def test_los_fragmentos_son_contiguos_y_abiertos(self):
+        for i in range(10):
+            usuario = Usuario.objects.create(username=f'usuario{i}')
+            RegistroHuellaCarbono.objects.bulk_create([RegistroHuellaCarbono(usuario=usuario) for _ in range(i + 1)])
+
+        fragmentos = planear_fragmentos(10)
+        self.assertGreater(len(fragmentos), 1)
+        self.assertIsNone(fragmentos[0][0])
+        self.assertIsNone(fragmentos[-1][1])
+        for (_, fin), (inicio, _) in zip(fragmentos, fragmentos[1:]):
+            self.assertEqual(inicio, fin + 1)
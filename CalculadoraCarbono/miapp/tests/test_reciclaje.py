@@ -0,0 +1,102 @@
+import datetime
+from collections import defaultdict
+
+from django.utils import timezone
+
+from ..calculos import agregar_materiales_reciclaje
+from ..models import Material, RegistroReciclaje, Usuario
+from .base import BaseTests
+
+
+class EstadisticasReciclajeTests(BaseTests):
+    def setUp(self):
+        super().setUp()
+        self.pet = Material.objects.create(nombre='PET', tipo='PLASTICO', valor_por_unidad=3, factor_reduccion_co2=1.5)
+        self.vidrio = Material.objects.create(nombre='Vidrio', tipo='VIDRIO', valor_por_unidad=1, factor_reduccion_co2=0.3)
+        self.usuario = Usuario.objects.create(username='usuario')
+        self.cliente_usuario = self.cliente(self.usuario)
+        self.canastas = [
+            (datetime.date(2024, 1, 10), [(self.pet, 2), (self.vidrio, 5)]),
+            (datetime.date(2024, 1, 25), [(self.pet, 1)]),
+            (datetime.date(2024, 2, 3), [(self.vidrio, 4), (self.vidrio, 1)]),
+            (datetime.date(2025, 3, 1), [(self.pet, 7)]),
+        ]
+        for fecha, materiales in self.canastas:
+            self.reciclar(self.usuario, fecha, materiales)
+        # Los datos de otros usuarios no cuentan
+        self.reciclar(Usuario.objects.create(username='otro'), datetime.date(2024, 1, 10), [(self.pet, 100)])
+
+    def reciclar(self, usuario, fecha, materiales):
+        registro = RegistroReciclaje.objects.create(
+            usuario=usuario, fecha=timezone.make_aware(datetime.datetime.combine(fecha, datetime.time(12)))
+        )
+        agregar_materiales_reciclaje(registro, [{'material': material, 'cantidad': cantidad} for material, cantidad in materiales])
+
+    def esperado(self, etiqueta, desde=None, hasta=None):
+        resumen = defaultdict(float)
+        por_tipo = defaultdict(lambda: defaultdict(float))
+        historico = defaultdict(lambda: defaultdict(float))
+        for fecha, materiales in self.canastas:
+            if (desde and fecha < desde) or (hasta and fecha > hasta):
+                continue
+            resumen['numero_registros'] += 1
+            for material, cantidad in materiales:
+                valores = {
+                    'cantidad': cantidad,
+                    'valor_economico': cantidad * material.valor_por_unidad,
+                    'reduccion_co2': cantidad * material.factor_reduccion_co2,
+                }
+                resumen['total_kg_reciclados'] += cantidad
+                resumen['total_valor_economico'] += valores['valor_economico']
+                resumen['total_reduccion_co2'] += valores['reduccion_co2']
+                for campo, valor in valores.items():
+                    por_tipo[material.tipo][campo] += valor
+                periodo = historico[fecha.strftime(etiqueta)]
+                periodo['kg_reciclados'] += cantidad
+                periodo['valor_economico'] += valores['valor_economico']
+                periodo['reduccion_co2'] += valores['reduccion_co2']
+        return resumen, por_tipo, historico
+
+    def assertEstadisticas(self, parametros, etiqueta, desde=None, hasta=None):
+        respuesta = self.cliente_usuario.get('/api/reciclaje/estadisticas/', parametros)
+        self.assertEqual(respuesta.status_code, 200)
+        datos = respuesta.json()
+        resumen, por_tipo, historico = self.esperado(etiqueta, desde, hasta)
+        for campo, valor in resumen.items():
+            self.assertAlmostEqual(datos['resumen'][campo], valor, places=6)
+        self.assertEqual(datos['por_tipo_material'].keys(), por_tipo.keys())
+        for tipo, valores in por_tipo.items():
+            for campo, valor in valores.items():
+                self.assertAlmostEqual(datos['por_tipo_material'][tipo][campo], valor, places=6)
+        self.assertEqual(list(datos['historico']), sorted(historico))
+        for periodo, valores in historico.items():
+            for campo, valor in valores.items():
+                self.assertAlmostEqual(datos['historico'][periodo][campo], valor, places=6)
+        return datos
+
+    def test_agrupa_en_la_base_de_datos(self):
+        datos = self.assertEstadisticas({}, '%Y-%m')
+        self.assertEqual(datos['por_tipo_material']['PLASTICO']['nombre'], 'Plástico')
+        self.assertEqual(datos['historico_mensual'], datos['historico'])
+
+        datos = self.assertEstadisticas({'granularidad': 'anio'}, '%Y')
+        self.assertNotIn('historico_mensual', datos)
+        self.assertEstadisticas(
+            {'desde': '2024-01-20', 'hasta': '2024-02-03'}, '%Y-%m',
+            datetime.date(2024, 1, 20), datetime.date(2024, 2, 3)
+        )
+
+    def test_las_consultas_no_crecen_con_los_datos(self):
+        # La primera petición carga el catálogo de materiales
+        self.cliente_usuario.get('/api/reciclaje/estadisticas/')
+        # Versión de los datos del usuario y tres agregaciones
+        with self.assertNumQueries(4):
+            self.cliente_usuario.get('/api/reciclaje/estadisticas/')
+        for dia in range(1, 20):
+            self.reciclar(self.usuario, datetime.date(2023, 6, dia), [(self.pet, 1), (self.vidrio, 2)])
+        with self.assertNumQueries(4):
+            self.cliente_usuario.get('/api/reciclaje/estadisticas/', {'granularidad': 'dia'})
+
+    def test_parametros_invalidos(self):
+        for parametros in ({'granularidad': 'hora'}, {'desde': '2024-13-01'}, {'desde': '2024-02-01', 'hasta': '2024-01-01'}):
+            self.assertEqual(self.cliente_usuario.get('/api/reciclaje/estadisticas/', parametros).status_code, 400)
@@ -0,0 +1,41 @@
+from ..models import Recomendacion, RecomendacionUsuario, Usuario
+from ..recomendador import recomendar
+from ..serializers import RegistroHuellaCarbonoSerializer
+from .base import BaseTests
+
+
+class RecomendarTests(BaseTests):
+    def setUp(self):
+        super().setUp()
+        self.usuario = Usuario.objects.create(username='usuario')
+        crear = Recomendacion.objects.create
+        self.transporte = crear(categoria='TRANSPORTE', descripcion='Bici', impacto_potencial=10)
+        self.consumo = crear(categoria='CONSUMO', descripcion='Menos carne', impacto_potencial=30)
+        self.general = crear(categoria='GENERAL', descripcion='Medir', impacto_potencial=18)
+        self.energia = crear(categoria='ENERGIA', descripcion='LED', impacto_potencial=5)
+        self.general_empatada = crear(categoria='GENERAL', descripcion='Compartir', impacto_potencial=18)
+
+    def ids(self, limite=5):
+        return [recomendacion['id'] for recomendacion in recomendar(self.usuario, limite)]
+
+    def test_sin_registros_ordena_por_impacto_potencial(self):
+        self.assertEqual(
+            self.ids(),
+            [self.consumo.id, self.general.id, self.general_empatada.id, self.transporte.id, self.energia.id]
+        )
+
+    def test_ajusta_por_la_huella_del_ultimo_registro_y_descarta_asignadas(self):
+        # Transporte muy alto (ajuste 2) y el resto de categorías en cero (ajuste 0.5)
+        RegistroHuellaCarbonoSerializer().create({'usuario': self.usuario, 'detalle_transporte': {'km_autobus': 100000}})
+        self.assertEqual(self.ids(3), [self.transporte.id, self.general.id, self.general_empatada.id])
+        self.assertEqual(recomendar(self.usuario, 1)[0]['impacto_estimado'], 20)
+
+        RecomendacionUsuario.objects.create(usuario=self.usuario, recomendacion=self.general)
+        self.assertEqual(self.ids(3), [self.transporte.id, self.general_empatada.id, self.consumo.id])
+
+    def test_limite_del_endpoint(self):
+        cliente = self.cliente(self.usuario)
+        self.assertEqual(len(cliente.get('/api/recomendaciones/personalizadas/?limite=2').json()), 2)
+        for limite in ('0', '51', 'x'):
+            respuesta = cliente.get(f'/api/recomendaciones/personalizadas/?limite={limite}')
+            self.assertEqual(respuesta.status_code, 400)
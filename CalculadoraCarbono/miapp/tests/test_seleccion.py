@@ -0,0 +1,87 @@
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from ..models import Material, RegistroReciclaje, Usuario
+from ..serializers import RegistroHuellaCarbonoSerializer
+from .base import BaseTests
+
+DETALLES = {'detalle_consumo', 'detalle_transporte', 'detalle_energia', 'detalle_residuos'}
+
+
+class SeleccionCamposTests(BaseTests):
+    def setUp(self):
+        super().setUp()
+        self.usuario = Usuario.objects.create(username='usuario')
+        self.cliente_usuario = self.cliente(self.usuario)
+        self.registro = RegistroHuellaCarbonoSerializer().create({
+            'usuario': self.usuario,
+            'detalle_transporte': {'km_autobus': 40},
+            'detalle_energia': {'consumo_electricidad_kwh': 120},
+        })
+        material = Material.objects.create(nombre='PET', tipo='PLASTICO', valor_por_unidad=3, factor_reduccion_co2=1.5)
+        self.reciclaje = RegistroReciclaje.objects.create(usuario=self.usuario)
+        self.reciclaje.agregar_materiales([{'material': material, 'cantidad': 2}])
+
+    def obtener(self, url, **parametros):
+        respuesta = self.cliente_usuario.get(url, parametros)
+        self.assertEqual(respuesta.status_code, 200)
+        return respuesta.json()
+
+    def consultas(self, url, **parametros):
+        # SQL de la petición sin las lecturas de versiones y catálogos
+        with CaptureQueriesContext(connection) as capturadas:
+            self.obtener(url, **parametros)
+        return [consulta['sql'] for consulta in capturadas if 'miapp_version' not in consulta['sql']]
+
+    def test_sin_parametros_la_respuesta_no_cambia(self):
+        completo = self.obtener(f'/api/huella-carbono/{self.registro.id}/')
+        self.assertLessEqual(DETALLES | {'id', 'huella_total', 'usuario'}, completo.keys())
+
+    def test_fields_limita_los_campos(self):
+        pagina = self.obtener('/api/huella-carbono/', fields='id, huella_total')
+        self.assertEqual([set(fila) for fila in pagina['results']], [{'id', 'huella_total'}])
+        detalle = self.obtener(f'/api/huella-carbono/{self.registro.id}/', fields='id,detalle_energia')
+        self.assertEqual(set(detalle), {'id', 'detalle_energia'})
+        self.assertEqual(detalle['detalle_energia']['consumo_electricidad_kwh'], 120)
+
+    def test_expand_incluye_solo_las_relaciones_pedidas(self):
+        detalle = self.obtener(f'/api/huella-carbono/{self.registro.id}/', expand='detalle_transporte')
+        self.assertIn('huella_total', detalle)
+        self.assertEqual(DETALLES & detalle.keys(), {'detalle_transporte'})
+
+        reciclaje = self.obtener(f'/api/reciclaje/{self.reciclaje.id}/', fields='id,kg_total_reciclado')
+        self.assertEqual(set(reciclaje), {'id', 'kg_total_reciclado'})
+        reciclaje = self.obtener(f'/api/reciclaje/{self.reciclaje.id}/', fields='id', expand='materiales')
+        self.assertEqual(set(reciclaje), {'id', 'materiales'})
+        self.assertEqual(len(reciclaje['materiales']), 1)
+
+    def test_parametros_invalidos(self):
+        for url, parametros in (
+            ('/api/huella-carbono/', {'fields': 'id,contrasena'}),
+            ('/api/huella-carbono/', {'expand': 'usuario'}),
+            (f'/api/huella-carbono/{self.registro.id}/', {'expand': 'detalle_transporte,materiales'}),
+            ('/api/reciclaje/', {'expand': 'detalle_energia'}),
+        ):
+            respuesta = self.cliente_usuario.get(url, parametros)
+            self.assertEqual(respuesta.status_code, 400, parametros)
+            self.assertIn('error', respuesta.json())
+
+    def test_las_escrituras_ignoran_la_seleccion(self):
+        respuesta = self.cliente_usuario.post(
+            '/api/huella-carbono/?fields=id', {'detalle_transporte': {'km_autobus': 10}}, format='json'
+        )
+        self.assertEqual(respuesta.status_code, 201)
+        self.assertIn('huella_total', respuesta.json())
+
+    def test_la_consulta_solo_lee_lo_pedido(self):
+        sql, = self.consultas('/api/huella-carbono/', fields='id,fecha')
+        self.assertNotIn('"huella_consumo"', sql)
+        self.assertNotIn('JOIN', sql)
+
+        sql, = self.consultas('/api/huella-carbono/', fields='id', expand='detalle_transporte')
+        self.assertIn('miapp_detalletransporte', sql)
+        self.assertNotIn('miapp_detalleenergia', sql)
+
+        # Sin materiales no hay consulta de precarga
+        self.assertEqual(len(self.consultas('/api/reciclaje/', fields='id,kg_total_reciclado')), 1)
+        self.assertEqual(len(self.consultas('/api/reciclaje/', expand='materiales')), 2)
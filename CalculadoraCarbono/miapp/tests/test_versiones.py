@@ -0,0 +1,113 @@
+import datetime
+
+from django.db import transaction
+from django.utils import timezone
+
+from ..models import Material, RegistroHuellaCarbono, Usuario, VersionDatosUsuario
+from ..versiones import subir_versiones, version_datos
+from .base import BaseTests
+
+
+class LecturasCondicionalesTests(BaseTests):
+    def setUp(self):
+        super().setUp()
+        self.usuario = Usuario.objects.create(username='usuario')
+        self.cliente_usuario = self.cliente(self.usuario)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.registro_id = self.cliente_usuario.post(
+                '/api/huella-carbono/', {'detalle_transporte': {'km_autobus': 10}}, format='json'
+            ).json()['id']
+
+    def revalidar(self, url, etag):
+        return self.cliente_usuario.get(url, HTTP_IF_NONE_MATCH=etag).status_code
+
+    def version(self):
+        return version_datos(self.usuario).version
+
+    def test_304_sin_cambios_con_una_sola_consulta(self):
+        for url in (
+            '/api/usuarios/dashboard/', '/api/huella-carbono/historico/', '/api/reciclaje/estadisticas/',
+            f'/api/huella-carbono/{self.registro_id}/detalles/',
+        ):
+            respuesta = self.cliente_usuario.get(url)
+            self.assertEqual(respuesta.status_code, 200)
+            with self.assertNumQueries(1):
+                self.assertEqual(self.revalidar(url, respuesta['ETag']), 304, url)
+
+    def test_escrituras_propias_invalidan_y_ajenas_no(self):
+        url = '/api/huella-carbono/historico/'
+        etag = self.cliente_usuario.get(url)['ETag']
+        otro = self.cliente(Usuario.objects.create(username='otro'))
+        with self.captureOnCommitCallbacks(execute=True):
+            otro.post('/api/huella-carbono/', {}, format='json')
+        self.assertEqual(self.revalidar(url, etag), 304)
+
+        version = self.version()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.cliente_usuario.patch(
+                f'/api/huella-carbono/{self.registro_id}/', {'detalle_transporte': {'km_autobus': 20}}, format='json'
+            )
+        self.assertEqual(self.version(), version + 1)
+        self.assertEqual(self.revalidar(url, etag), 200)
+
+    def test_version_no_sube_si_la_transaccion_se_revierte(self):
+        version = self.version()
+        with self.captureOnCommitCallbacks(execute=True):
+            try:
+                with transaction.atomic():
+                    RegistroHuellaCarbono.objects.create(usuario=self.usuario)
+                    raise RuntimeError
+            except RuntimeError:
+                pass
+        self.assertEqual(self.version(), version)
+
+    def test_savepoint_revertido_no_pierde_las_demas_subidas(self):
+        otro = Usuario.objects.create(username='otro')
+        version = self.version()
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                subir_versiones([self.usuario.id])
+                try:
+                    with transaction.atomic():
+                        subir_versiones([self.usuario.id, otro.id])
+                        raise RuntimeError
+                except RuntimeError:
+                    pass
+                subir_versiones([self.usuario.id])
+        self.assertEqual(self.version(), version + 1)
+        # Lo anotado en el savepoint revertido solo puede subir de más
+        self.assertLessEqual(version_datos(otro).version, 1)
+
+    def test_las_lecturas_no_escriben(self):
+        nuevo = Usuario.objects.create(username='nuevo')
+        cliente = self.cliente(nuevo)
+        url = '/api/huella-carbono/historico/'
+        respuesta = cliente.get(url)
+        self.assertFalse(VersionDatosUsuario.objects.filter(usuario=nuevo).exists())
+        self.assertEqual(cliente.get(url, HTTP_IF_NONE_MATCH=respuesta['ETag']).status_code, 304)
+
+        # La primera escritura crea la fila con la versión 1
+        with self.captureOnCommitCallbacks(execute=True):
+            cliente.post('/api/huella-carbono/', {}, format='json')
+        self.assertEqual(VersionDatosUsuario.objects.get(usuario=nuevo).version, 1)
+        self.assertEqual(cliente.get(url, HTTP_IF_NONE_MATCH=respuesta['ETag']).status_code, 200)
+
+    def test_if_modified_since(self):
+        url = '/api/huella-carbono/historico/'
+        self.cliente_usuario.get(url)
+        VersionDatosUsuario.objects.update(modificado=timezone.now() - datetime.timedelta(minutes=5))
+        ultima = self.cliente_usuario.get(url)['Last-Modified']
+        self.assertEqual(self.cliente_usuario.get(url, HTTP_IF_MODIFIED_SINCE=ultima).status_code, 304)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.cliente_usuario.post('/api/huella-carbono/', {}, format='json')
+        self.assertEqual(self.cliente_usuario.get(url, HTTP_IF_MODIFIED_SINCE=ultima).status_code, 200)
+
+    def test_cambio_de_catalogo_solo_invalida_las_respuestas_que_lo_muestran(self):
+        panel = self.cliente_usuario.get('/api/usuarios/dashboard/')['ETag']
+        historico = self.cliente_usuario.get('/api/huella-carbono/historico/')['ETag']
+        version = self.version()
+        with self.captureOnCommitCallbacks(execute=True):
+            Material.objects.create(nombre='PET', tipo='PLASTICO', valor_por_unidad=3, factor_reduccion_co2=1.5)
+        self.assertEqual(self.version(), version)
+        self.assertEqual(self.revalidar('/api/usuarios/dashboard/', panel), 200)
+        self.assertEqual(self.revalidar('/api/huella-carbono/historico/', historico), 304)
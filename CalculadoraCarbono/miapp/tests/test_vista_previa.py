@@ -0,0 +1,49 @@
+import datetime
+import random
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from ..models import FactorEmision, RegistroHuellaCarbono, Usuario
+from .base import CAMPOS_HUELLA, BaseTests, agregados, datos_aleatorios
+
+
+class VistaPreviaTests(BaseTests):
+    def setUp(self):
+        super().setUp()
+        with self.captureOnCommitCallbacks(execute=True):
+            FactorEmision.objects.create(
+                categoria='Electricidad', subcategoria='Red Eléctrica', valor=0.9, unidad='kg CO2/kWh', region='CDMX',
+                vigente_desde=datetime.date(2024, 3, 1)
+            )
+        self.usuario = Usuario.objects.create(username='usuario', region='CDMX', pais='México')
+        self.cliente_usuario = self.cliente(self.usuario)
+
+    def test_calcula_lo_mismo_que_el_alta_sin_escribir(self):
+        generador = random.Random(3)
+        for fecha in ('2024-02-15T12:00:00Z', '2024-04-15T12:00:00Z'):
+            datos = dict(datos_aleatorios(generador), fecha=fecha)
+            antes = agregados()
+            with CaptureQueriesContext(connection) as consultas:
+                vista_previa = self.cliente_usuario.post('/api/huella-carbono/calcular/', datos, format='json')
+            self.assertEqual(vista_previa.status_code, 200)
+            escrituras = [
+                consulta['sql'] for consulta in consultas.captured_queries
+                if not consulta['sql'].lstrip().upper().startswith('SELECT')
+            ]
+            self.assertEqual(escrituras, [])
+            self.assertFalse(RegistroHuellaCarbono.objects.exists())
+            self.assertEqual(agregados(), antes)
+
+            # El alta con el mismo payload guarda las mismas huellas
+            creado = self.cliente_usuario.post('/api/huella-carbono/', datos, format='json').json()
+            for campo in CAMPOS_HUELLA:
+                self.assertAlmostEqual(vista_previa.json()[campo], creado[campo], places=9)
+            RegistroHuellaCarbono.objects.all().delete()
+
+    def test_payload_invalido(self):
+        respuesta = self.cliente_usuario.post(
+            '/api/huella-carbono/calcular/', {'detalle_transporte': {'km_autobus': 'mucho'}}, format='json'
+        )
+        self.assertEqual(respuesta.status_code, 400)
+        self.assertIn('detalle_transporte', respuesta.json())
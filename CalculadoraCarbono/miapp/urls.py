@@ -5,7 +5,7 @@ from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
 from .views import (
     UsuarioViewSet, RegistroHuellaCarbonoViewSet, MaterialViewSet, 
     RegistroReciclajeViewSet, FactorEmisionViewSet, RecomendacionViewSet,
-    RecomendacionUsuarioViewSet
+    RecomendacionUsuarioViewSet, CatalogoViewSet
 )
 
 router = DefaultRouter()
@@ -16,6 +16,7 @@ router.register(r'reciclaje', RegistroReciclajeViewSet, basename='reciclaje')
 router.register(r'factores-emision', FactorEmisionViewSet, basename='factor-emision')
 router.register(r'recomendaciones', RecomendacionViewSet, basename='recomendacion')
 router.register(r'mis-recomendaciones', RecomendacionUsuarioViewSet, basename='mis-recomendaciones')
+router.register(r'catalogos', CatalogoViewSet, basename='catalogo')
 
 urlpatterns = [
     path('', include(router.urls)),
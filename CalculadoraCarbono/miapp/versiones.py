@@ -0,0 +1,158 @@
+"""
+Lecturas condicionales (ETag / Last-Modified) a partir de la versión de datos
+de cada usuario.
+
+VersionDatosUsuario sube con cualquier escritura en la huella, el reciclaje o
+las recomendaciones del usuario: las señales de signals.py y las rutas de
+escritura masiva llaman a subir_versiones, que sube cada versión una sola vez
+por transacción, al confirmarla. Así, una vista decorada con
+respuesta_condicional puede contestar 304 leyendo solo ese contador. Las
+lecturas no escriben: un usuario sin fila tiene la versión 0, y la fila se
+crea con su primera escritura.
+
+La ETag combina la versión con la ruta completa, el formato de la respuesta,
+los datos del perfil que cambian el resultado (ubicación y zona horaria) y la
+versión de los catálogos que muestra la respuesta (VersionCatalogo), de modo
+que un cambio de catálogo no tiene que tocar la versión de cada usuario.
+"""
+
+import functools
+import hashlib
+
+from django.db import connection, router, transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.cache import parse_etags, quote_etag
+from django.utils.http import http_date, parse_http_date_safe
+from rest_framework import status
+from rest_framework.response import Response
+
+from .models import Usuario, VersionDatosUsuario
+from .precarga import ContadorConsultas
+
+
+def _subir(usuario_ids):
+    # Se ejecuta con las escrituras ya confirmadas
+    ahora = timezone.now()
+    actualizadas = VersionDatosUsuario.objects.filter(usuario_id__in=usuario_ids).update(
+        version=F('version') + 1, modificado=ahora
+    )
+    if actualizadas < len(usuario_ids):
+        # Primera escritura de algún usuario (o usuario ya eliminado): se crea
+        # la fila de los que existen. Si otra transacción la crea entretanto,
+        # su versión ya refleja estas escrituras
+        faltantes = Usuario.objects.filter(id__in=usuario_ids, version_datos__isnull=True).values_list('id', flat=True)
+        VersionDatosUsuario.objects.bulk_create(
+            [VersionDatosUsuario(usuario_id=usuario_id, version=1, modificado=ahora) for usuario_id in faltantes],
+            ignore_conflicts=True
+        )
+
+
+def _subir_pendientes(conexion):
+    # Callback on_commit: el primero que se ejecuta sube todas las versiones anotadas
+    usuario_ids = conexion.versiones_pendientes
+    conexion.versiones_pendientes = set()
+    if usuario_ids:
+        _subir(usuario_ids)
+
+
+def subir_versiones(usuario_ids):
+    """
+    Sube la versión de datos de los usuarios al confirmar la transacción en
+    curso, con un solo UPDATE aunque se llame varias veces en ella.
+
+    Los usuarios se anotan en un conjunto guardado en la conexión y cada
+    llamada registra su propio callback on_commit: si se revierte el
+    savepoint de una llamada, el callback de otra sigue subiendo las
+    versiones. Los usuarios anotados en una transacción o savepoint
+    revertidos se suben con la siguiente confirmación, lo que solo invalida
+    su caché.
+    """
+    usuario_ids = {usuario_id for usuario_id in usuario_ids if usuario_id is not None}
+    if not usuario_ids:
+        return
+    alias = router.db_for_write(VersionDatosUsuario)
+    conexion = transaction.get_connection(alias)
+    if not conexion.in_atomic_block:
+        _subir(usuario_ids)
+        return
+    if not hasattr(conexion, 'versiones_pendientes'):
+        conexion.versiones_pendientes = set()
+    conexion.versiones_pendientes.update(usuario_ids)
+    transaction.on_commit(functools.partial(_subir_pendientes, conexion), using=alias)
+
+
+def version_datos(usuario):
+    # Sin fila (el usuario aún no ha escrito nada) la versión es 0 y la fecha, la de alta
+    return (
+        VersionDatosUsuario.objects.filter(usuario_id=usuario.pk).first()
+        or VersionDatosUsuario(usuario_id=usuario.pk, version=0, modificado=usuario.date_joined)
+    )
+
+
+def _etag(request, versiones, ventana):
+    usuario = request.user
+    partes = (
+        usuario.pk, versiones, usuario.pais, usuario.region, usuario.zona_horaria,
+        request.get_full_path(), request.accepted_renderer.format, ventana
+    )
+    return quote_etag(hashlib.sha256(repr(partes).encode()).hexdigest()[:32])
+
+
+def coincide_etag(request, etag):
+    # None si no se envió If-None-Match
+    cabecera = request.headers.get('If-None-Match')
+    if not cabecera:
+        return None
+    etiquetas = parse_etags(cabecera)
+    return '*' in etiquetas or etag in (etiqueta.removeprefix('W/') for etiqueta in etiquetas)
+
+
+def respuesta_condicional(vigencia=None, catalogos=()):
+    """
+    Decorador para acciones GET de un ViewSet. Si el cliente envía la ETag
+    (o una fecha de If-Modified-Since) vigente, devuelve 304 sin ejecutar la
+    acción. ``vigencia`` (en segundos) limita cuánto puede reutilizarse una
+    respuesta que también depende de datos de otros usuarios. ``catalogos``
+    nombra los catálogos de catalogos.py cuyos datos aparecen en la respuesta.
+    """
+    def decorador(vista):
+        @functools.wraps(vista)
+        def envoltorio(self, request, *args, **kwargs):
+            # catalogos.py importa este módulo
+            from .catalogos import registro_catalogos
+
+            contador = ContadorConsultas()
+            with connection.execute_wrapper(contador):
+                datos = version_datos(request.user)
+                instantaneas = [registro_catalogos.instantanea(nombre) for nombre in catalogos]
+            # Fuera del presupuesto de la acción (PrecargaMixin)
+            self.consultas_adicionales = getattr(self, 'consultas_adicionales', 0) + contador.total
+            modificado = max([int(datos.modificado.timestamp())] + [
+                int(instantanea.modificado.timestamp()) for instantanea in instantaneas if instantanea.modificado
+            ])
+            ventana = None
+            if vigencia:
+                ventana = int(timezone.now().timestamp()) // vigencia
+                modificado = max(modificado, ventana * vigencia)
+            versiones = (datos.version,) + tuple(instantanea.version for instantanea in instantaneas)
+            etag = _etag(request, versiones, ventana)
+
+            coincide = coincide_etag(request, etag)
+            if coincide is None:
+                # If-Modified-Since solo cuenta si no se envió If-None-Match
+                desde = parse_http_date_safe(request.headers.get('If-Modified-Since', ''))
+                coincide = desde is not None and modificado <= desde
+            if coincide:
+                return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+
+            respuesta = vista(self, request, *args, **kwargs)
+            if respuesta.status_code == status.HTTP_200_OK:
+                respuesta['ETag'] = etag
+                respuesta['Cache-Control'] = 'private, no-cache'
+                # Un segundo aún en curso podría recibir otra escritura con la misma fecha
+                if modificado < int(timezone.now().timestamp()):
+                    respuesta['Last-Modified'] = http_date(modificado)
+            return respuesta
+        return envoltorio
+    return decorador
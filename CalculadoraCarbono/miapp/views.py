@@ -1,8 +1,15 @@
+import datetime
+import io
+import zoneinfo
+
+from django.db.models import Avg, Count, Sum
 from django.shortcuts import get_object_or_404
+from django.utils import timezone
 from rest_framework import viewsets, filters, status, permissions
 from rest_framework.decorators import action
 from rest_framework.response import Response
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.parsers import MultiPartParser
+from rest_framework.permissions import IsAuthenticated, IsAdminUser
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
 
 from .models import (
@@ -15,11 +22,32 @@ from .serializers import (
     DetalleConsumoSerializer, DetalleTransporteSerializer, DetalleEnergiaSerializer,
     DetalleResiduosSerializer, RegistroReciclajeSerializer, MaterialSerializer,
     MaterialReciclableSerializer, FactorEmisionSerializer, RecomendacionSerializer,
-    RecomendacionUsuarioSerializer
+    RecomendacionUsuarioSerializer, DETALLES_REGISTRO
+)
+from .agregaciones import (
+    parsear_rango, parsear_granularidad, filtrar_rango, truncar, etiqueta_periodo, ParametroInvalido
+)
+from .paginacion import HistoricoPaginacion, RegistrosPaginacion
+from .panel import obtener_panel
+from .precarga import PrecargaMixin
+from .seleccion import SeleccionCamposMixin
+from .versiones import respuesta_condicional
+from .catalogos import CatalogoMixin, registro_catalogos, respuesta_catalogo
+from .clasificaciones import (
+    clasificacion, parsear_mes, LIMITE_POR_DEFECTO as LIMITE_CLASIFICACION, MAX_LIMITE as MAX_LIMITE_CLASIFICACION
+)
+from .recomendador import (
+    recomendar, LIMITE_POR_DEFECTO as LIMITE_RECOMENDACIONES, MAX_LIMITE as MAX_LIMITE_RECOMENDACIONES
+)
+from .importacion import importar_actividad, formato_de_archivo, MuestraRechazos, FORMATOS
+from .escenarios import evaluar_escenarios, EscenarioInvalido
+from .calculos import agregar_materiales_reciclaje
+from .incertidumbre import (
+    bandas_registro, validar_distribuciones, DistribucionInvalida, MUESTRAS_POR_DEFECTO, MAX_MUESTRAS
 )
 
 # Usuario ViewSet
-class UsuarioViewSet(viewsets.ModelViewSet):
+class UsuarioViewSet(PrecargaMixin, viewsets.ModelViewSet):
     queryset = Usuario.objects.all()
     serializer_class = UsuarioSerializer
     filter_backends = [filters.SearchFilter]
@@ -48,39 +76,120 @@ class UsuarioViewSet(viewsets.ModelViewSet):
         return Response(serializer.data)
     
     @action(detail=False, methods=['get'])
+    @respuesta_condicional(catalogos=('materiales', 'recomendaciones'))
     def dashboard(self, request):
-        user = request.user
-        
-        # Obtener el último registro de huella de carbono
-        ultimo_registro = RegistroHuellaCarbono.objects.filter(usuario=user).order_by('-fecha').first()
-        
-        # Obtener estadísticas de reciclaje
-        registros_reciclaje = RegistroReciclaje.objects.filter(usuario=user).order_by('-fecha')[:5]
-        
-        # Obtener recomendaciones
-        recomendaciones = Recomendacion.obtener_recomendaciones_para_usuario(user)
-        
-        # Construir respuesta
-        response_data = {
-            'huella_carbono': RegistroHuellaCarbonoSerializer(ultimo_registro).data if ultimo_registro else None,
-            'reciclaje_reciente': RegistroReciclajeSerializer(registros_reciclaje, many=True).data,
-            'recomendaciones': RecomendacionSerializer(recomendaciones, many=True).data
-        }
+        # Instantánea en caché, invalidada cuando cambian los datos del usuario
+        return Response(obtener_panel(request.user))
+    
+    @action(detail=False, methods=['get'])
+    def clasificacion(self, request):
+        # Top N de huella más baja, mayor mejora o más kg reciclados en el país
+        # o la región del usuario, con su propia posición
+        try:
+            limite = int(request.query_params.get('limite', LIMITE_CLASIFICACION))
+            if not 1 <= limite <= MAX_LIMITE_CLASIFICACION:
+                raise ValueError
+        except ValueError:
+            return Response(
+                {"error": f"limite debe ser un entero entre 1 y {MAX_LIMITE_CLASIFICACION}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
         
-        return Response(response_data)
+        try:
+            resultado = clasificacion(
+                request.user,
+                request.query_params.get('metrica', 'huella'),
+                request.query_params.get('ambito', 'region'),
+                parsear_mes(request.query_params.get('mes')),
+                limite
+            )
+        except ParametroInvalido as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(resultado)
 
 # RegistroHuellaCarbono ViewSet
-class RegistroHuellaCarbonoViewSet(viewsets.ModelViewSet):
+class RegistroHuellaCarbonoViewSet(SeleccionCamposMixin, PrecargaMixin, viewsets.ModelViewSet):
     serializer_class = RegistroHuellaCarbonoSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = RegistrosPaginacion
+    acciones_precarga = ('list', 'retrieve', 'detalles')
+    MAX_REGISTROS_LOTE = 1000
+    MAX_RECHAZOS_RESPUESTA = 1000
+    MAX_PERIODOS_HISTORICO = 1000
+    # Los percentiles dependen de los registros de todos los usuarios: una
+    # comparación se reutiliza como mucho durante este tiempo, en segundos
+    VIGENCIA_COMPARACION = 15 * 60
+    CAMPOS_HISTORICO = (
+        'fecha', 'huella_total', 'huella_consumo', 'huella_transporte',
+        'huella_energia', 'huella_residuos', 'reduccion_por_reciclaje'
+    )
     
     def get_queryset(self):
-        return RegistroHuellaCarbono.objects.filter(usuario=self.request.user).order_by('-fecha')
+        queryset = RegistroHuellaCarbono.objects.filter(usuario=self.request.user).order_by('-fecha', '-id')
+        if self.action in ('update', 'partial_update'):
+            # El serializer actualiza el registro y sus detalles sin volver a consultarlos
+            queryset = queryset.select_related('usuario', *(campo for campo, _ in DETALLES_REGISTRO))
+        return queryset
     
     def perform_create(self, serializer):
         serializer.save(usuario=self.request.user)
     
+    @action(detail=False, methods=['post'])
+    def calcular(self, request):
+        # Vista previa de la huella: mismo payload que la creación, sin escrituras
+        serializer = self.get_serializer(data=request.data)
+        if serializer.is_valid():
+            return Response(serializer.calcular_desglose(request.user))
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    
+    @action(detail=False, methods=['post'])
+    def lote(self, request):
+        # Alta masiva: los elementos válidos se crean aunque otros tengan errores
+        items = request.data.get('registros') if isinstance(request.data, dict) else request.data
+        
+        if not isinstance(items, list) or not items:
+            return Response({"error": "Debe enviar una lista de registros"}, status=status.HTTP_400_BAD_REQUEST)
+        
+        if len(items) > self.MAX_REGISTROS_LOTE:
+            return Response({"error": f"Se permiten como máximo {self.MAX_REGISTROS_LOTE} registros por petición"}, status=status.HTTP_400_BAD_REQUEST)
+        
+        creados, errores = self.get_serializer().crear_lote(items, request.user)
+        
+        respuesta = {
+            'creados': [
+                {'indice': indice, 'id': registro.id, 'fecha': registro.fecha, 'huella_total': registro.huella_total}
+                for indice, registro in creados
+            ],
+            'errores': [{'indice': indice, 'errores': detalle} for indice, detalle in errores],
+        }
+        return Response(respuesta, status=status.HTTP_201_CREATED if creados else status.HTTP_400_BAD_REQUEST)
+    
+    @action(detail=False, methods=['post'], permission_classes=[IsAdminUser], parser_classes=[MultiPartParser])
+    def importar(self, request):
+        # Importación de archivos de actividad de empresas colaboradoras (solo personal)
+        archivo = request.FILES.get('archivo')
+        if archivo is None:
+            return Response({"error": "Debe adjuntar un archivo en el campo 'archivo'"}, status=status.HTTP_400_BAD_REQUEST)
+        
+        formato = request.data.get('formato') or formato_de_archivo(archivo.name)
+        if formato not in FORMATOS:
+            return Response({"error": f"Formato no reconocido; indique uno de: {', '.join(FORMATOS)}"}, status=status.HTTP_400_BAD_REQUEST)
+        
+        # El archivo subido se lee en flujo desde el disco o la memoria de Django
+        rechazos = MuestraRechazos(self.MAX_RECHAZOS_RESPUESTA)
+        texto = io.TextIOWrapper(archivo.file, encoding='utf-8-sig', newline='')
+        try:
+            resumen = importar_actividad(texto, formato, rechazos=rechazos)
+        except UnicodeDecodeError:
+            return Response({"error": "El archivo debe estar codificado en UTF-8"}, status=status.HTTP_400_BAD_REQUEST)
+        finally:
+            texto.detach()
+        
+        resumen['rechazos'] = rechazos.rechazos
+        return Response(resumen)
+    
     @action(detail=True, methods=['get'])
+    @respuesta_condicional()
     def detalles(self, request, pk=None):
         registro = self.get_object()
         
@@ -94,33 +203,113 @@ class RegistroHuellaCarbonoViewSet(viewsets.ModelViewSet):
         return Response(detalles)
     
     @action(detail=False, methods=['get'])
+    @respuesta_condicional()
     def historico(self, request):
-        registros = self.get_queryset()
-        
-        # Datos para gráficos
-        datos_historicos = []
-        
-        for registro in registros:
-            datos_historicos.append({
-                'fecha': registro.fecha,
-                'huella_total': registro.huella_total,
-                'huella_consumo': registro.huella_consumo,
-                'huella_transporte': registro.huella_transporte,
-                'huella_energia': registro.huella_energia,
-                'huella_residuos': registro.huella_residuos,
-                'reduccion_por_reciclaje': registro.reduccion_por_reciclaje
-            })
+        # Sin granularidad devuelve los registros paginados por fecha; con ella,
+        # los promedios por periodo calculados en la base de datos. Los días y
+        # periodos se toman en la zona horaria del usuario (o la indicada)
+        try:
+            desde, hasta = parsear_rango(request.query_params)
+            granularidad = request.query_params.get('granularidad')
+            if granularidad:
+                granularidad = parsear_granularidad(granularidad)
+            zona = self._zona_horaria(request)
+        except ParametroInvalido as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
         
-        return Response(datos_historicos)
+        registros = filtrar_rango(
+            RegistroHuellaCarbono.objects.filter(usuario=request.user), desde, hasta, tzinfo=zona
+        )
+        
+        if not granularidad:
+            paginador = HistoricoPaginacion()
+            pagina = paginador.paginate_queryset(registros.values('id', *self.CAMPOS_HISTORICO), request, view=self)
+            for fila in pagina:
+                fila['fecha'] = timezone.localtime(fila['fecha'], zona)
+            return paginador.get_paginated_response(pagina)
+        
+        # Los periodos más recientes, como mucho MAX_PERIODOS_HISTORICO
+        periodos = list(
+            registros.annotate(periodo=truncar(granularidad, tzinfo=zona))
+            .values('periodo')
+            .annotate(
+                numero_registros=Count('id'),
+                **{campo: Avg(campo) for campo in self.CAMPOS_HISTORICO if campo != 'fecha'}
+            )
+            .order_by('-periodo')[:self.MAX_PERIODOS_HISTORICO + 1]
+        )
+        truncado = len(periodos) > self.MAX_PERIODOS_HISTORICO
+        periodos = periodos[:self.MAX_PERIODOS_HISTORICO]
+        periodos.reverse()
+        for fila in periodos:
+            fila['periodo'] = etiqueta_periodo(fila['periodo'], granularidad)
+        
+        return Response({
+            'granularidad': granularidad,
+            'zona_horaria': str(zona),
+            'truncado': truncado,
+            'periodos': periodos
+        })
+    
+    def _zona_horaria(self, request):
+        valor = request.query_params.get('zona_horaria')
+        if not valor:
+            return request.user.obtener_zona_horaria()
+        try:
+            return zoneinfo.ZoneInfo(valor)
+        except (zoneinfo.ZoneInfoNotFoundError, ValueError):
+            raise ParametroInvalido(f"Zona horaria desconocida: {valor}")
     
     @action(detail=True, methods=['get'])
+    @respuesta_condicional(vigencia=VIGENCIA_COMPARACION)
     def comparar_promedio(self, request, pk=None):
         registro = self.get_object()
         comparacion = registro.comparar_con_promedio()
         return Response(comparacion)
+    
+    @action(detail=True, methods=['get', 'post'])
+    def incertidumbre(self, request, pk=None):
+        # GET con muestras y semilla en la URL; POST admite además "distribuciones"
+        # para sustituir las de la tabla FactorEmision en claves concretas
+        registro = self.get_object()
+        parametros = request.query_params if request.method == 'GET' else request.data
+        if not hasattr(parametros, 'get'):
+            return Response({"error": "Debe enviar un objeto JSON"}, status=status.HTTP_400_BAD_REQUEST)
+        
+        try:
+            muestras = int(parametros.get('muestras', MUESTRAS_POR_DEFECTO))
+            semilla = parametros.get('semilla')
+            semilla = int(semilla) if semilla not in (None, '') else None
+        except (TypeError, ValueError):
+            return Response({"error": "muestras y semilla deben ser números enteros"}, status=status.HTTP_400_BAD_REQUEST)
+        
+        if not 1 <= muestras <= MAX_MUESTRAS:
+            return Response({"error": f"muestras debe estar entre 1 y {MAX_MUESTRAS}"}, status=status.HTTP_400_BAD_REQUEST)
+        if semilla is not None and semilla < 0:
+            return Response({"error": "La semilla no puede ser negativa"}, status=status.HTTP_400_BAD_REQUEST)
+        
+        try:
+            distribuciones = validar_distribuciones(parametros.get('distribuciones') or {}) if request.method == 'POST' else None
+        except DistribucionInvalida as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        
+        return Response(bandas_registro(registro, muestras, semilla, distribuciones))
+    
+    @action(detail=True, methods=['post'])
+    def escenarios(self, request, pk=None):
+        registro = self.get_object()
+        datos = request.data if isinstance(request.data, dict) else {}
+        
+        try:
+            resultado = evaluar_escenarios(registro, datos.get('ejes'), datos.get('limite', 20))
+        except EscenarioInvalido as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        
+        return Response(resultado)
 
 # Material ViewSet
-class MaterialViewSet(viewsets.ReadOnlyModelViewSet):
+class MaterialViewSet(CatalogoMixin, PrecargaMixin, viewsets.ReadOnlyModelViewSet):
+    catalogo = 'materiales'
     queryset = Material.objects.all()
     serializer_class = MaterialSerializer
     permission_classes = [IsAuthenticated]
@@ -129,22 +318,22 @@ class MaterialViewSet(viewsets.ReadOnlyModelViewSet):
     
     @action(detail=False, methods=['get'])
     def por_tipo(self, request):
-        tipos = Material.TIPOS_MATERIAL
-        
-        resultado = {}
-        for tipo_codigo, tipo_nombre in tipos:
-            materiales = Material.objects.filter(tipo=tipo_codigo)
-            resultado[tipo_codigo] = MaterialSerializer(materiales, many=True).data
+        # Agrupado desde la instantánea del catálogo, sin consultas
+        resultado = {tipo_codigo: [] for tipo_codigo, _ in Material.TIPOS_MATERIAL}
+        for material in registro_catalogos.instantanea(self.catalogo).datos:
+            resultado.setdefault(material['tipo'], []).append(material)
         
         return Response(resultado)
 
 # RegistroReciclaje ViewSet
-class RegistroReciclajeViewSet(viewsets.ModelViewSet):
+class RegistroReciclajeViewSet(SeleccionCamposMixin, PrecargaMixin, viewsets.ModelViewSet):
     serializer_class = RegistroReciclajeSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = RegistrosPaginacion
+    MAX_MATERIALES_LOTE = 200
     
     def get_queryset(self):
-        return RegistroReciclaje.objects.filter(usuario=self.request.user).order_by('-fecha')
+        return RegistroReciclaje.objects.filter(usuario=self.request.user).order_by('-fecha', '-id')
     
     def perform_create(self, serializer):
         serializer.save(usuario=self.request.user)
@@ -155,91 +344,109 @@ class RegistroReciclajeViewSet(viewsets.ModelViewSet):
         
         serializer = MaterialReciclableSerializer(data=request.data)
         if serializer.is_valid():
-            serializer.save(registro_reciclaje=registro)
-            
-            # Recalcular totales
-            registro.kg_total_reciclado = sum(m.cantidad for m in registro.materialreciclable_set.all())
-            registro.calcular_valor_economico()
-            registro.calcular_reduccion_co2()
-            registro.save()
-            
-            # Si está vinculado a un registro de huella, actualizar reducción
-            if registro.registro_huella:
-                registro.registro_huella.reduccion_por_reciclaje = sum(
-                    r.reduccion_co2_total for r in RegistroReciclaje.objects.filter(
-                        registro_huella=registro.registro_huella
-                    )
-                )
-                registro.registro_huella.calcular_huella_total()
-                registro.registro_huella.save()
-            
-            return Response(serializer.data, status=status.HTTP_201_CREATED)
+            material, = agregar_materiales_reciclaje(registro, [serializer.validated_data])
+            return Response(MaterialReciclableSerializer(material).data, status=status.HTTP_201_CREATED)
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    
+    @action(detail=True, methods=['post'])
+    def agregar_materiales(self, request, pk=None):
+        # Variante de agregar_material para una canasta de materiales en una sola llamada
+        registro = self.get_object()
+        materiales = request.data.get('materiales') if isinstance(request.data, dict) else request.data
+        
+        if not isinstance(materiales, list) or not materiales:
+            return Response({"error": "Debe enviar una lista de materiales"}, status=status.HTTP_400_BAD_REQUEST)
+        
+        if len(materiales) > self.MAX_MATERIALES_LOTE:
+            return Response({"error": f"Se permiten como máximo {self.MAX_MATERIALES_LOTE} materiales por petición"}, status=status.HTTP_400_BAD_REQUEST)
+        
+        serializer = MaterialReciclableSerializer(data=materiales, many=True)
+        if serializer.is_valid():
+            nuevos = agregar_materiales_reciclaje(registro, serializer.validated_data)
+            return Response({
+                'materiales': MaterialReciclableSerializer(nuevos, many=True).data,
+                'kg_total_reciclado': registro.kg_total_reciclado,
+                'valor_economico_total': registro.valor_economico_total,
+                'reduccion_co2_total': registro.reduccion_co2_total
+            }, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
     
     @action(detail=False, methods=['get'])
+    @respuesta_condicional(catalogos=('materiales',))
     def estadisticas(self, request):
-        # Obtener datos de reciclaje para generar estadísticas
-        registros = self.get_queryset()
+        # Todas las sumas se agrupan en la base de datos: tres consultas sin
+        # importar cuántos registros y materiales tenga el usuario
+        try:
+            desde, hasta = parsear_rango(request.query_params)
+            granularidad = parsear_granularidad(request.query_params.get('granularidad'))
+        except ParametroInvalido as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        
+        registros = filtrar_rango(RegistroReciclaje.objects.filter(usuario=request.user), desde, hasta)
         
         # Estadísticas generales
-        total_kg_reciclados = sum(r.kg_total_reciclado for r in registros)
-        total_valor_economico = sum(r.valor_economico_total for r in registros)
-        total_reduccion_co2 = sum(r.reduccion_co2_total for r in registros)
+        resumen = registros.aggregate(
+            total_kg_reciclados=Sum('kg_total_reciclado'),
+            total_valor_economico=Sum('valor_economico_total'),
+            total_reduccion_co2=Sum('reduccion_co2_total'),
+            numero_registros=Count('id')
+        )
+        resumen = {clave: valor or 0 for clave, valor in resumen.items()}
         
         # Estadísticas por tipo de material
-        materiales_reciclados = MaterialReciclable.objects.filter(registro_reciclaje__in=registros)
-        tipos_materiales = {}
-        
-        for material in materiales_reciclados:
-            tipo = material.material.tipo
-            if tipo not in tipos_materiales:
-                tipos_materiales[tipo] = {
-                    'nombre': material.material.get_tipo_display(),
-                    'cantidad': 0,
-                    'valor_economico': 0,
-                    'reduccion_co2': 0
-                }
-            
-            tipos_materiales[tipo]['cantidad'] += material.cantidad
-            tipos_materiales[tipo]['valor_economico'] += material.valor_economico
-            tipos_materiales[tipo]['reduccion_co2'] += material.reduccion_co2
-        
-        # Datos históricos mensuales
-        # Esta implementación es simplificada, se podría mejorar con agregación de base de datos
-        import datetime
-        datos_mensuales = {}
-        
-        for registro in registros:
-            mes_año = registro.fecha.strftime('%Y-%m')
-            if mes_año not in datos_mensuales:
-                datos_mensuales[mes_año] = {
-                    'kg_reciclados': 0,
-                    'valor_economico': 0,
-                    'reduccion_co2': 0
-                }
-            
-            datos_mensuales[mes_año]['kg_reciclados'] += registro.kg_total_reciclado
-            datos_mensuales[mes_año]['valor_economico'] += registro.valor_economico_total
-            datos_mensuales[mes_año]['reduccion_co2'] += registro.reduccion_co2_total
+        nombres_tipo = dict(Material.TIPOS_MATERIAL)
+        por_tipo = (
+            MaterialReciclable.objects.filter(registro_reciclaje__in=registros)
+            .values('material__tipo')
+            .annotate(cantidad=Sum('cantidad'), valor_economico=Sum('valor_economico'), reduccion_co2=Sum('reduccion_co2'))
+            .order_by('material__tipo')
+        )
+        tipos_materiales = {
+            fila['material__tipo']: {
+                'nombre': nombres_tipo.get(fila['material__tipo'], fila['material__tipo']),
+                'cantidad': fila['cantidad'],
+                'valor_economico': fila['valor_economico'],
+                'reduccion_co2': fila['reduccion_co2']
+            }
+            for fila in por_tipo
+        }
         
-        return Response({
-            'resumen': {
-                'total_kg_reciclados': total_kg_reciclados,
-                'total_valor_economico': total_valor_economico,
-                'total_reduccion_co2': total_reduccion_co2,
-                'numero_registros': registros.count()
-            },
+        # Datos históricos por periodo
+        por_periodo = (
+            registros.annotate(periodo=truncar(granularidad))
+            .values('periodo')
+            .annotate(kg_reciclados=Sum('kg_total_reciclado'), valor_economico=Sum('valor_economico_total'), reduccion_co2=Sum('reduccion_co2_total'))
+            .order_by('periodo')
+        )
+        historico = {
+            etiqueta_periodo(fila['periodo'], granularidad): {
+                'kg_reciclados': fila['kg_reciclados'],
+                'valor_economico': fila['valor_economico'],
+                'reduccion_co2': fila['reduccion_co2']
+            }
+            for fila in por_periodo
+        }
+        
+        respuesta = {
+            'resumen': resumen,
             'por_tipo_material': tipos_materiales,
-            'historico_mensual': datos_mensuales
-        })
+            'granularidad': granularidad,
+            'historico': historico
+        }
+        if granularidad == 'mes':
+            # Nombre anterior de la serie mensual, se mantiene por compatibilidad
+            respuesta['historico_mensual'] = historico
+        return Response(respuesta)
 
 # FactorEmision ViewSet
-class FactorEmisionViewSet(viewsets.ReadOnlyModelViewSet):
+class FactorEmisionViewSet(CatalogoMixin, PrecargaMixin, viewsets.ReadOnlyModelViewSet):
+    catalogo = 'factores'
     queryset = FactorEmision.objects.all()
     serializer_class = FactorEmisionSerializer
     permission_classes = [IsAuthenticated]
     filter_backends = [filters.SearchFilter]
     search_fields = ['categoria', 'subcategoria', 'region']
+    MAX_CONSULTAS_LOTE = 500
     
     @action(detail=False, methods=['get'])
     def por_region(self, request):
@@ -250,15 +457,60 @@ class FactorEmisionViewSet(viewsets.ReadOnlyModelViewSet):
         if not categoria:
             return Response({"error": "Debe especificar una categoría"}, status=status.HTTP_400_BAD_REQUEST)
         
-        factor = FactorEmision.obtener_factor_por_region(categoria, subcategoria, region)
+        try:
+            fecha = self._parsear_fecha(request.query_params.get('fecha'))
+        except ValueError:
+            return Response({"error": "La fecha debe tener el formato AAAA-MM-DD"}, status=status.HTTP_400_BAD_REQUEST)
+        
+        factor = FactorEmision.obtener_factor_por_region(categoria, subcategoria, region, fecha)
         
         if not factor:
             return Response({"error": "No se encontró un factor de emisión para los parámetros especificados"}, status=status.HTTP_404_NOT_FOUND)
         
         return Response(FactorEmisionSerializer(factor).data)
+    
+    @action(detail=False, methods=['post'])
+    def por_region_lote(self, request):
+        consultas = request.data.get('consultas') if isinstance(request.data, dict) else request.data
+        
+        if not isinstance(consultas, list) or not consultas:
+            return Response({"error": "Debe enviar una lista de consultas"}, status=status.HTTP_400_BAD_REQUEST)
+        
+        if len(consultas) > self.MAX_CONSULTAS_LOTE:
+            return Response({"error": f"Se permiten como máximo {self.MAX_CONSULTAS_LOTE} consultas por petición"}, status=status.HTTP_400_BAD_REQUEST)
+        
+        # Una consulta inválida recibe su error sin impedir que se respondan las demás
+        resultados = []
+        for consulta in consultas:
+            if not isinstance(consulta, dict) or not consulta.get('categoria'):
+                resultados.append({'consulta': consulta, 'error': "Cada consulta debe especificar una categoría"})
+                continue
+            
+            try:
+                fecha = self._parsear_fecha(consulta.get('fecha'))
+            except (TypeError, ValueError):
+                resultados.append({'consulta': consulta, 'error': "La fecha debe tener el formato AAAA-MM-DD"})
+                continue
+            
+            factor = FactorEmision.obtener_factor_por_region(
+                consulta['categoria'], consulta.get('subcategoria'), consulta.get('region'), fecha
+            )
+            resultados.append({
+                'consulta': consulta,
+                'factor': FactorEmisionSerializer(factor).data if factor else None
+            })
+        
+        return Response(resultados)
+    
+    def _parsear_fecha(self, valor):
+        # Fecha opcional AAAA-MM-DD; sin fecha se usan los factores vigentes hoy
+        if not valor:
+            return None
+        return datetime.date.fromisoformat(valor)
 
 # Recomendacion ViewSet
-class RecomendacionViewSet(viewsets.ReadOnlyModelViewSet):
+class RecomendacionViewSet(CatalogoMixin, PrecargaMixin, viewsets.ReadOnlyModelViewSet):
+    catalogo = 'recomendaciones'
     queryset = Recomendacion.objects.all()
     serializer_class = RecomendacionSerializer
     permission_classes = [IsAuthenticated]
@@ -267,9 +519,18 @@ class RecomendacionViewSet(viewsets.ReadOnlyModelViewSet):
     
     @action(detail=False, methods=['get'])
     def personalizadas(self, request):
-        limite = int(request.query_params.get('limite', 5))
-        recomendaciones = Recomendacion.obtener_recomendaciones_para_usuario(request.user, limite)
-        return Response(RecomendacionSerializer(recomendaciones, many=True).data)
+        # Las de mayor impacto estimado para el usuario que aún no tiene asignadas
+        try:
+            limite = int(request.query_params.get('limite', LIMITE_RECOMENDACIONES))
+            if not 1 <= limite <= MAX_LIMITE_RECOMENDACIONES:
+                raise ValueError
+        except ValueError:
+            return Response(
+                {"error": f"limite debe ser un entero entre 1 y {MAX_LIMITE_RECOMENDACIONES}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        return Response(recomendar(request.user, limite))
     
     @action(detail=True, methods=['post'])
     def asignar(self, request, pk=None):
@@ -291,8 +552,16 @@ class RecomendacionViewSet(viewsets.ReadOnlyModelViewSet):
         serializer = RecomendacionUsuarioSerializer(recomendacion_usuario)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
+# Catalogo ViewSet
+class CatalogoViewSet(viewsets.ViewSet):
+    permission_classes = [IsAuthenticated]
+    
+    def list(self, request):
+        # Materiales, factores y recomendaciones con sus versiones, en una sola respuesta
+        return respuesta_catalogo(request, registro_catalogos.paquete())
+
 # RecomendacionUsuario ViewSet
-class RecomendacionUsuarioViewSet(viewsets.ModelViewSet):
+class RecomendacionUsuarioViewSet(SeleccionCamposMixin, PrecargaMixin, viewsets.ModelViewSet):
     serializer_class = RecomendacionUsuarioSerializer
     permission_classes = [IsAuthenticated]
     